@@ -7,11 +7,18 @@ import traceback
 import json
 from datetime import datetime
 
+from app.api.upload import read_binary_upload
 from app.schemas.register import RegisterInput
 from app.utils.validation import validate_all_register_fields, ValidationError
 from app.services.provider_ingest_service import ProviderIngestService
-from app.dependencies import get_face_app
-from app.repositories.faceid_repo import FaceIdRepo
+from app.dependencies import (
+    get_inference_pool,
+    get_gallery_refresher,
+    get_faceid_repo,
+    get_snapshot_buffer,
+    get_crop_store,
+)
+from app.services.inference_pool import InferenceQueueFull
 
 router = APIRouter()
 
@@ -19,9 +26,14 @@ router = APIRouter()
 ENABLE_STRICT_VALIDATION = False   # ← ВРЕМЕННО ОТКЛЮЧЕНО
 
 
-def get_ingest_service(face_app=Depends(get_face_app)):
-    repo = FaceIdRepo()
-    return ProviderIngestService(repo, face_app)
+def get_ingest_service(
+    pool=Depends(get_inference_pool),
+    refresher=Depends(get_gallery_refresher),
+    repo=Depends(get_faceid_repo),
+    buffer=Depends(get_snapshot_buffer),
+    crops=Depends(get_crop_store),
+):
+    return ProviderIngestService(repo, pool, refresher, buffer, crops)
 
 
 # =========================
@@ -54,6 +66,42 @@ class WebRegisterInput(BaseModel):
         return str(v)
 
 
+# =========================
+# Минимальные проверки → RegisterInput
+# =========================
+def to_register_input(input_data: WebRegisterInput, photo_bytes: Optional[bytes] = None) -> RegisterInput:
+    if not input_data.photos_base64 and not photo_bytes:
+        raise ValueError("photos_base64 обязательно")
+
+    if not input_data.full_name or not input_data.full_name.strip():
+        raise ValueError("full_name обязательно")
+
+    if not input_data.passport or not input_data.passport.strip():
+        raise ValueError("passport обязательно")
+
+    # Пол оставляем обязательным
+    if input_data.gender is None:
+        raise ValueError("Пол обязателен (1 или 2)")
+
+    sex = int(input_data.gender)
+    if sex not in (1, 2):
+        raise ValueError("Пол должен быть 1 или 2")
+
+    return RegisterInput(
+        photos_base64=None if photo_bytes else input_data.photos_base64,
+        photo_bytes=photo_bytes,
+        full_name=input_data.full_name.strip(),
+        passport=input_data.passport.strip(),
+        sex=sex,
+        citizenship=input_data.citizenship,
+        birth_date=input_data.birth_date,
+        visa_type=input_data.visa_type,
+        visa_number=input_data.visa_number,
+        entry_date=input_data.entry_date,
+        exit_date=input_data.exit_date,
+    )
+
+
 # =========================
 # Роут регистрации
 # =========================
@@ -82,39 +130,18 @@ async def register_person(
 
     # 3. Минимальные проверки (ОСТАВЛЯЕМ)
     try:
-        if not input_data.photos_base64:
-            raise ValueError("photos_base64 обязательно")
-
-        if not input_data.full_name or not input_data.full_name.strip():
-            raise ValueError("full_name обязательно")
-
-        if not input_data.passport or not input_data.passport.strip():
-            raise ValueError("passport обязательно")
-
-        # Пол оставляем обязательным
-        if input_data.gender is None:
-            raise ValueError("Пол обязателен (1 или 2)")
-
-        sex = int(input_data.gender)
-        if sex not in (1, 2):
-            raise ValueError("Пол должен быть 1 или 2")
-
-        register_data = RegisterInput(
-            photos_base64=input_data.photos_base64,
-            full_name=input_data.full_name.strip(),
-            passport=input_data.passport.strip(),
-            sex=sex,
-            citizenship=input_data.citizenship,
-            birth_date=input_data.birth_date,
-            visa_type=input_data.visa_type,
-            visa_number=input_data.visa_number,
-            entry_date=input_data.entry_date,
-            exit_date=input_data.exit_date,
-        )
-
+        register_data = to_register_input(input_data)
     except ValueError as ve:
         raise HTTPException(400, detail=str(ve))
 
+    return await _validate_and_ingest(register_data, service, log_prefix)
+
+
+async def _validate_and_ingest(
+    register_data: RegisterInput,
+    service: ProviderIngestService,
+    log_prefix: str,
+):
     # 4. ❌/✅ Кастомная бизнес-валидация (ПЕДАНТ)
     if ENABLE_STRICT_VALIDATION:
         try:
@@ -135,6 +162,115 @@ async def register_person(
             "person_id": person_id,
             "data": register_data.model_dump(),
         }
+    except InferenceQueueFull as e:
+        raise HTTPException(503, detail=str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(500, detail=str(e))
+
+
+# =========================
+# Регистрация бинарной загрузкой (без base64)
+# =========================
+@router.post("/upload")
+async def register_person_upload(
+    request: Request,
+    service: ProviderIngestService = Depends(get_ingest_service),
+):
+    """
+    multipart/form-data: фото в поле file, остальные поля — как в JSON POST /register.
+    application/octet-stream: тело — фото, поля — JSON в заголовке X-Register-Data
+    (ASCII, т.е. json.dumps(..., ensure_ascii=True) — кириллица как \\uXXXX).
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    log_prefix = f"[{timestamp}] REGISTER UPLOAD "
+
+    photo_bytes, fields = await read_binary_upload(request)
+    if not fields:
+        try:
+            fields = json.loads(request.headers.get("x-register-data") or "{}")
+        except ValueError:
+            raise HTTPException(400, detail="X-Register-Data должен быть JSON")
+        if not isinstance(fields, dict):
+            raise HTTPException(400, detail="X-Register-Data должен быть JSON-объектом")
+
+    print(f"{log_prefix}{len(photo_bytes)} bytes, {json.dumps(fields, ensure_ascii=False)}")
+
+    try:
+        input_data = WebRegisterInput(**fields)
+    except PydanticValidationError as ve:
+        raise HTTPException(422, detail=ve.errors())
+
+    try:
+        register_data = to_register_input(input_data, photo_bytes)
+    except ValueError as ve:
+        raise HTTPException(400, detail=str(ve))
+
+    return await _validate_and_ingest(register_data, service, log_prefix)
+
+
+# =========================
+# Bulk-регистрация: поток JSONL
+# =========================
+async def _iter_jsonl(request: Request):
+    """
+    Читает тело запроса потоком и отдаёт (номер строки, RegisterInput | ошибка).
+    Каждая строка — JSON той же формы, что и тело POST /register.
+    """
+    line_no = 0
+    # строка с фото в base64 растягивается на много кусков тела: копим их в bytearray
+    # и ищем \n только в новых байтах — без пересборки и повторного split всего буфера
+    buf = bytearray()
+    scanned = 0
+
+    def parse(raw: bytes):
+        try:
+            input_data = WebRegisterInput(**json.loads(raw))
+            register_data = to_register_input(input_data)
+            if ENABLE_STRICT_VALIDATION:
+                validate_all_register_fields(register_data)
+            return register_data
+        except ValidationError as ve:
+            return ValueError(f"{ve.field or 'general'}: {ve.message}")
+        except Exception as e:
+            return e
+
+    async for chunk in request.stream():
+        buf += chunk
+        start = 0
+        while True:
+            end = buf.find(b"\n", scanned)
+            if end < 0:
+                break
+            raw = bytes(buf[start:end])
+            start = scanned = end + 1
+            line_no += 1
+            if raw.strip():
+                yield line_no, parse(raw)
+        if start:
+            del buf[:start]
+        scanned = len(buf)
+
+    if buf.strip():
+        line_no += 1
+        yield line_no, parse(bytes(buf))
+
+
+@router.post("/bulk")
+async def register_bulk(
+    request: Request,
+    service: ProviderIngestService = Depends(get_ingest_service),
+):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    print(f"[{timestamp}] REGISTER BULK")
+
+    results = await service.ingest_bulk(_iter_jsonl(request))
+
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return {
+        "status": "ok",
+        "total": len(results),
+        "registered": ok,
+        "failed": len(results) - ok,
+        "results": results,
+    }
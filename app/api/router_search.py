@@ -1,11 +1,21 @@
 # app/api/router_search.py
 
-from fastapi import APIRouter, HTTPException, Depends, Body
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Body, Request
+from pydantic import BaseModel, ValidationError as PydanticValidationError
+from typing import Optional, List
+import json
 
-from app.dependencies import get_face_app
-from app.repositories.faceid_repo import FaceIdRepo
+from app.api.upload import read_binary_upload, read_form_files
+from app.core.config import SEARCH_BATCH_MAX_IMAGES
+from app.dependencies import (
+    get_inference_pool,
+    get_gallery_index,
+    get_gallery_refresher,
+    get_faceid_repo,
+    get_embedding_cache,
+    get_shard_gallery,
+)
+from app.schemas.search import SearchFilters
 from app.services.search_service import SearchService
 
 router = APIRouter()   # ← БЕЗ prefix
@@ -14,19 +24,168 @@ router = APIRouter()   # ← БЕЗ prefix
 class SearchRequest(BaseModel):
     photos_base64: str
     threshold: Optional[float] = 0.6
+    filters: Optional[SearchFilters] = None
+
+
+class BatchSearchParams(BaseModel):
+    threshold: Optional[float] = 0.6
+    filters: Optional[SearchFilters] = None
+
+
+class BatchSearchRequest(BatchSearchParams):
+    photos_base64: List[str]
+
+
+def parse_filters(raw: Optional[str]) -> Optional[SearchFilters]:
+    """Фильтры из поля формы / заголовка: JSON-объект как у SearchRequest.filters"""
+    if not raw:
+        return None
+    try:
+        return SearchFilters(**json.loads(raw))
+    except PydanticValidationError as ve:
+        raise HTTPException(422, detail=ve.errors())
+    except (ValueError, TypeError):
+        raise HTTPException(400, detail="filters должен быть JSON-объектом")
 
 
 @router.post("")
 async def search_person(
     data: SearchRequest = Body(...),
-    face_app=Depends(get_face_app),
+    pool=Depends(get_inference_pool),
+    gallery=Depends(get_gallery_index),
+    repo=Depends(get_faceid_repo),
+    cache=Depends(get_embedding_cache),
+    shards=Depends(get_shard_gallery),
 ):
     service = SearchService(
-        repo=FaceIdRepo(),
-        face_app=face_app,
+        repo=repo,
+        pool=pool,
+        gallery=gallery,
+        cache=cache,
+        shards=shards,
     )
 
     return await service.search_by_image_b64(
         image_b64=data.photos_base64,
         threshold=data.threshold,
+        filters=data.filters,
     )
+
+
+@router.post("/upload")
+async def search_person_upload(
+    request: Request,
+    pool=Depends(get_inference_pool),
+    gallery=Depends(get_gallery_index),
+    repo=Depends(get_faceid_repo),
+    cache=Depends(get_embedding_cache),
+    shards=Depends(get_shard_gallery),
+):
+    """
+    Поиск по фото без base64: multipart/form-data (поле file + необязательное threshold)
+    или application/octet-stream (тело — JPEG/PNG, порог — в заголовке X-Threshold).
+    Фильтры — JSON в поле filters или в заголовке X-Search-Filters.
+    Ответ — как у POST /search.
+    """
+    img_bytes, fields = await read_binary_upload(request)
+    try:
+        # is None, а не or: явный порог 0 — допустимое значение
+        raw = fields.get("threshold")
+        if raw is None:
+            raw = request.headers.get("x-threshold")
+        threshold = 0.6 if raw is None else float(raw)
+    except ValueError:
+        raise HTTPException(400, detail="threshold должен быть числом")
+    filters = parse_filters(fields.get("filters") or request.headers.get("x-search-filters"))
+
+    service = SearchService(
+        repo=repo,
+        pool=pool,
+        gallery=gallery,
+        cache=cache,
+        shards=shards,
+    )
+
+    return await service.search_by_image_bytes(img_bytes, threshold=threshold, filters=filters)
+
+
+@router.post("/batch")
+async def search_batch(
+    request: Request,
+    pool=Depends(get_inference_pool),
+    gallery=Depends(get_gallery_index),
+    repo=Depends(get_faceid_repo),
+    cache=Depends(get_embedding_cache),
+    shards=Depends(get_shard_gallery),
+):
+    """
+    Пакетный поиск. Принимает либо JSON {"photos_base64": [...], "threshold": 0.6, "filters": {...}},
+    либо multipart/form-data с несколькими полями files (+ необязательные threshold, filters).
+    Возвращает по одному результату на каждое фото в исходном порядке.
+    """
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        images = [("bytes", data) for data in await read_form_files(form, "files")]
+        raw = form.get("threshold")
+        try:
+            params = BatchSearchParams(
+                threshold=0.6 if raw is None else raw,
+                filters=parse_filters(form.get("filters")),
+            )
+        except PydanticValidationError as ve:
+            raise HTTPException(422, detail=ve.errors())
+        threshold = params.threshold
+        filters = params.filters
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(400, detail="Ожидается JSON или multipart/form-data")
+        try:
+            # не объект (список, строка) — тоже ошибка валидации, а не TypeError
+            data = BatchSearchRequest.model_validate(body)
+        except PydanticValidationError as ve:
+            raise HTTPException(422, detail=ve.errors())
+        images = [("b64", b64) for b64 in data.photos_base64]
+        threshold = data.threshold
+        filters = data.filters
+
+    if not images:
+        raise HTTPException(400, detail="Нет изображений")
+    if len(images) > SEARCH_BATCH_MAX_IMAGES:
+        raise HTTPException(413, detail=f"Не больше {SEARCH_BATCH_MAX_IMAGES} изображений за запрос")
+
+    service = SearchService(
+        repo=repo,
+        pool=pool,
+        gallery=gallery,
+        cache=cache,
+        shards=shards,
+    )
+
+    results = await service.search_batch(images, threshold=threshold, filters=filters)
+    return {
+        "status": "ok",
+        "results": results,
+    }
+
+
+@router.get("/gallery")
+async def gallery_status(refresher=Depends(get_gallery_refresher)):
+    """
+    Свежесть резидентного индекса: размер, водяной знак, лаг и строки за цикл
+    """
+    return refresher.stats()
+
+
+@router.get("/shards")
+async def shards_status(shards=Depends(get_shard_gallery)):
+    """
+    SEARCH_MODE=sharded: состояние шардов (ping) и счётчики координатора —
+    запросы, таймауты, доля partial-ответов
+    """
+    if shards is None:
+        return {"enabled": False}
+    return {"enabled": True, "ping": await shards.ping(), **shards.stats()}
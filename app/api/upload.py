@@ -0,0 +1,76 @@
+# app/api/upload.py
+
+from typing import Dict, List, Tuple, Union
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import FormData, UploadFile
+
+from app.core.config import UPLOAD_MAX_BYTES
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(413, detail=f"Фото больше {UPLOAD_MAX_BYTES} байт")
+
+
+async def read_binary_upload(
+    request: Request,
+    field: str = "file",
+) -> Tuple[Union[bytes, bytearray], Dict[str, str]]:
+    """
+    Фото из бинарной загрузки без base64 и JSON:
+
+      multipart/form-data       — файл в поле field, метаданные — остальные поля формы;
+      application/octet-stream  — тело целиком и есть фото, метаданные — в заголовках.
+
+    Возвращает (байты фото, текстовые поля формы). Размер ограничен UPLOAD_MAX_BYTES.
+    """
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get(field)
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(400, detail=f"Нет файла в поле {field}")
+        if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        fields = {k: v for k, v in form.items() if isinstance(v, str)}
+        return await upload.read(), fields
+
+    if content_type.startswith("application/octet-stream") or content_type.startswith("image/"):
+        declared = request.headers.get("content-length")
+        size = int(declared) if declared and declared.isdigit() else None
+        if size is not None and size > UPLOAD_MAX_BYTES:
+            raise _too_large()
+
+        # читаем потоком в один заранее выделенный буфер (без склейки кусков и лишних копий)
+        body = bytearray(size or 0)
+        n = 0
+        async for chunk in request.stream():
+            end = n + len(chunk)
+            if end > UPLOAD_MAX_BYTES:
+                raise _too_large()
+            body[n:end] = chunk
+            n = end
+        if n != len(body):
+            del body[n:]
+        return body, {}
+
+    raise HTTPException(415, detail="Ожидается multipart/form-data или application/octet-stream")
+
+
+async def read_form_files(form: FormData, field: str = "files") -> List[bytes]:
+    """
+    Все файлы поля field формы (пакетный поиск). Каждый — не больше UPLOAD_MAX_BYTES:
+    размер проверяется до чтения (если известен) и после.
+    """
+    images = []
+    for upload in form.getlist(field):
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(400, detail=f"Поле {field} должно содержать файлы")
+        if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        data = await upload.read()
+        if len(data) > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        images.append(data)
+    return images
@@ -0,0 +1,160 @@
+# app/core/config.py
+import os
+
+# ────────────────────────────────────────────────
+# Галерея embedding'ов (резидентный индекс)
+# ────────────────────────────────────────────────
+GALLERY_REFRESH_INTERVAL = float(os.getenv("GALLERY_REFRESH_INTERVAL", "2.0"))  # сек
+# окно перекрытия: каждый цикл перечитывает строки с created_at >= watermark - LAG —
+# INSERT, ставший видимым с опозданием (bulk, write-behind, второй писатель), не теряется
+GALLERY_REFRESH_LAG = float(os.getenv("GALLERY_REFRESH_LAG", "30"))  # сек
+
+# ────────────────────────────────────────────────
+# Снимок галереи на диске: воркеры uvicorn открывают матрицу через mmap
+# (общий page cache), на старте догружают из ClickHouse только строки новее снимка
+# ────────────────────────────────────────────────
+GALLERY_SNAPSHOT_DIR = os.getenv("GALLERY_SNAPSHOT_DIR", "")                   # пусто — без снимков
+GALLERY_SNAPSHOT_INTERVAL = float(os.getenv("GALLERY_SNAPSHOT_INTERVAL", "300"))  # сек между записями
+GALLERY_SNAPSHOT_HEADROOM = float(os.getenv("GALLERY_SNAPSHOT_HEADROOM", "0.1"))  # запас строк под дозапись в файле
+GALLERY_SNAPSHOT_KEEP = int(os.getenv("GALLERY_SNAPSHOT_KEEP", "2"))             # версий на диске
+
+# ────────────────────────────────────────────────
+# Где считается поиск: "local" — резидентный индекс в процессе,
+# "clickhouse" — cosineDistance + ORDER BY ... LIMIT на стороне ClickHouse,
+# "sharded" — галерея поделена по cityHash64(person_id) между процессами-шардами
+# (python -m app.services.shard_server), приложение рассылает запрос и сливает top-k
+# ────────────────────────────────────────────────
+SEARCH_MODE = os.getenv("SEARCH_MODE", "local")
+# HNSW vector_similarity индекс на face_snapshots.embedding (создаётся db_init.py)
+CLICKHOUSE_VECTOR_INDEX = os.getenv("CLICKHOUSE_VECTOR_INDEX", "0") == "1"
+
+# ────────────────────────────────────────────────
+# Шарды галереи (SEARCH_MODE=sharded)
+# ────────────────────────────────────────────────
+SEARCH_SHARDS = os.getenv("SEARCH_SHARDS", "")                     # "host:port,host:port" — шард i = i-й адрес
+SHARD_TIMEOUT_MS = float(os.getenv("SHARD_TIMEOUT_MS", "500"))     # ответ шарда на запрос
+SHARD_CONNECT_TIMEOUT = float(os.getenv("SHARD_CONNECT_TIMEOUT", "1.0"))  # сек на соединение
+SHARD_RETRY_SECONDS = float(os.getenv("SHARD_RETRY_SECONDS", "5"))  # упавший шард не опрашивается столько сек
+SHARD_AUTHKEY = os.getenv("SHARD_AUTHKEY", "")                       # общий секрет приложения и шардов; обязателен
+
+# ────────────────────────────────────────────────
+# ANN-бэкенд поиска: "exact" (полный скан) или "ivf"
+# ────────────────────────────────────────────────
+ANN_BACKEND = os.getenv("ANN_BACKEND", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))                  # 0 = авто (≈ 4·√N)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))               # сколько списков просматривать
+IVF_TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", "100000"))  # выборка для k-means
+IVF_KMEANS_ITERS = int(os.getenv("IVF_KMEANS_ITERS", "10"))
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "50000"))        # меньше — точный поиск
+IVF_REBUILD_TAIL_RATIO = float(os.getenv("IVF_REBUILD_TAIL_RATIO", "0.1"))
+# 1 — копия строк, упорядоченная по спискам (+1× память галереи, быстрее скан списка);
+# 0 — только перестановка строк (8 байт на строку), списки собираются из общей матрицы
+IVF_LIST_COPY = os.getenv("IVF_LIST_COPY", "0") == "1"
+
+# ────────────────────────────────────────────────
+# Шаблоны на человека: сколько строк галереи представляют одного person_id
+# ────────────────────────────────────────────────
+# all — каждый снимок; best — до N лучших по quality_score; centroid — один
+# взвешенный по quality_score центроид снимков
+GALLERY_TEMPLATES = os.getenv("GALLERY_TEMPLATES", "best")
+GALLERY_TEMPLATES_PER_PERSON = int(os.getenv("GALLERY_TEMPLATES_PER_PERSON", "3"))
+# доля выведенных из поиска строк, после которой галерея уплотняется
+GALLERY_COMPACT_RATIO = float(os.getenv("GALLERY_COMPACT_RATIO", "0.2"))
+# SEARCH_MODE=clickhouse: снимков на top_k, из которых выбирается лучший на человека
+CLICKHOUSE_PERSON_FANOUT = int(os.getenv("CLICKHOUSE_PERSON_FANOUT", "4"))
+
+# ────────────────────────────────────────────────
+# Компактное хранение embedding'ов в галерее
+# ────────────────────────────────────────────────
+# Уплотняется только резидентная галерея; в ClickHouse int8-копия хранится
+# рядом с float32 embedding (см. db_init.py) — таблица от этого растёт
+GALLERY_DTYPE = os.getenv("GALLERY_DTYPE", "float32")  # float32 | float16 | int8 (+ scale на строку)
+QUANT_RESCORE_FACTOR = int(os.getenv("QUANT_RESCORE_FACTOR", "4"))    # кандидатов на top_k для точного пересчёта
+QUANT_SCORE_SLACK = float(os.getenv("QUANT_SCORE_SLACK", "0.02"))     # запас к порогу для кандидатов
+
+# ────────────────────────────────────────────────
+# Фильтры поиска (citizenship / visa_type / entry_date / exit_date)
+# ────────────────────────────────────────────────
+# подмножество меньше этой доли строк, которые просмотрел бы бэкенд, скорится
+# отдельно (только его строки), больше — обычным сканом / IVF с маской
+FILTER_SUBSET_RATIO = float(os.getenv("FILTER_SUBSET_RATIO", "0.2"))
+# IVF с маской: nprobe растёт как 1 / доля подмножества, но не больше чем в N раз
+IVF_FILTER_NPROBE_FACTOR = float(os.getenv("IVF_FILTER_NPROBE_FACTOR", "4"))
+FILTER_DATE_TAIL_RATIO = float(os.getenv("FILTER_DATE_TAIL_RATIO", "0.1"))  # пересортировка дат после дозаписи
+
+# ────────────────────────────────────────────────
+# Пакетный поиск /search/batch
+# ────────────────────────────────────────────────
+SEARCH_BATCH_MAX_IMAGES = int(os.getenv("SEARCH_BATCH_MAX_IMAGES", "64"))
+
+# ────────────────────────────────────────────────
+# Bulk-регистрация /register/bulk
+# ────────────────────────────────────────────────
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", str(os.cpu_count() or 4)))  # фото в обработке
+BULK_INSERT_BATCH = int(os.getenv("BULK_INSERT_BATCH", "1000"))  # строк на один INSERT
+
+# ────────────────────────────────────────────────
+# Пул инференса (детекция + ArcFace)
+# ────────────────────────────────────────────────
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))    # 0 = модель в процессе приложения
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))    # intra-op потоков на сессию (0 = ORT default)
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "64"))  # ожидающих сверх числа воркеров
+INFERENCE_PIN_CPUS = os.getenv("INFERENCE_PIN_CPUS", "0") == "1"   # закреплять воркеры за ядрами
+
+# ────────────────────────────────────────────────
+# Холодный старт моделей: кэш оптимизированных ONNX-графов, параллельное
+# создание сессий, прогон на лице-образце до готовности (/ready)
+# ────────────────────────────────────────────────
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "")                 # пусто — графы оптимизируются на каждом старте
+MODEL_LOAD_THREADS = int(os.getenv("MODEL_LOAD_THREADS", "0"))   # сессий создаётся одновременно (0 = все сразу)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"          # прогрев детектора и ArcFace
+WARMUP_IMAGE = os.getenv("WARMUP_IMAGE", "")                     # пусто — app/assets/warmup_face.jpg
+
+# ────────────────────────────────────────────────
+# Micro-batching ArcFace между конкурентными запросами
+# ────────────────────────────────────────────────
+RECOGNITION_BATCH_MAX = int(os.getenv("RECOGNITION_BATCH_MAX", "32"))            # лиц в одном прогоне ONNX
+RECOGNITION_BATCH_WINDOW_MS = float(os.getenv("RECOGNITION_BATCH_WINDOW_MS", "2.0"))  # 0 = не ждать добора
+
+# ────────────────────────────────────────────────
+# Кэш embedding'ов запроса поиска (повторная отправка того же фото)
+# ────────────────────────────────────────────────
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "32"))  # 0 = кэш выключен
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "600"))        # сек жизни записи
+
+# ────────────────────────────────────────────────
+# Декодирование входных фото
+# ────────────────────────────────────────────────
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "1280"))  # длинная сторона кадра для детектора; 0 = без ограничения
+
+# ────────────────────────────────────────────────
+# Бинарная загрузка фото (/search/upload, /register/upload)
+# ────────────────────────────────────────────────
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))  # одно фото
+
+# ────────────────────────────────────────────────
+# Write-behind буфер face_snapshots (регистрация по одной)
+# ────────────────────────────────────────────────
+SNAPSHOT_FLUSH_ROWS = int(os.getenv("SNAPSHOT_FLUSH_ROWS", "1000"))              # строк в одном INSERT
+SNAPSHOT_FLUSH_DELAY_MS = float(os.getenv("SNAPSHOT_FLUSH_DELAY_MS", "200"))     # максимум ожидания строки в буфере
+REGISTER_WAIT_DURABLE = os.getenv("REGISTER_WAIT_DURABLE", "1") == "1"           # /register отвечает после INSERT
+
+# ────────────────────────────────────────────────
+# Кропы лиц регистрации: <CROP_DIR>/<ab>/<cd>/<хэш содержимого>.jpg,
+# кодирование JPEG и запись — в фоновых потоках, face_url возвращается сразу
+# ────────────────────────────────────────────────
+CROP_DIR = os.getenv("CROP_DIR", "images/persons")
+CROP_JPEG_QUALITY = int(os.getenv("CROP_JPEG_QUALITY", "85"))
+CROP_WRITE_WORKERS = int(os.getenv("CROP_WRITE_WORKERS", "2"))          # потоков кодирования / записи
+CROP_WRITE_MAX_QUEUE = int(os.getenv("CROP_WRITE_MAX_QUEUE", "256"))    # сверх — запрос ждёт записи своего кропа
+
+# ────────────────────────────────────────────────
+# Хранилище снимков: "clickhouse" или "memory" — face_snapshots в памяти процесса
+# (app/repositories/memory_repo.py; стенд без БД, нагрузочные прогоны tools/load_replay.py)
+# ────────────────────────────────────────────────
+FACEID_REPO = os.getenv("FACEID_REPO", "clickhouse")
+
+# ────────────────────────────────────────────────
+# Метрики (GET /metrics, формат Prometheus)
+# ────────────────────────────────────────────────
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # 0 = без замеров этапов
@@ -0,0 +1,310 @@
+# app/core/metrics.py
+"""
+Встроенные метрики в текстовом формате Prometheus (GET /metrics), без prometheus_client.
+
+  Histogram — гистограмма с фиксированными границами (секунды);
+  Counter   — монотонный счётчик;
+  Gauge     — значение, снимаемое функцией в момент scrape (размер галереи, очередь).
+
+Этапы запроса меряются одной гистограммой faceid_stage_seconds{stage=...}:
+
+    with stage("detect"):
+        ...
+
+    @timed("db_search")
+    def search_similar(...): ...
+
+Цена замера — perf_counter и bisect под блокировкой метрики (~1 мкс), можно
+держать включённым в проде; METRICS_ENABLED=0 отключает замеры совсем.
+
+Процессы-воркеры пула инференса свои замеры не публикуют: defer() копит их
+в буфер, воркер отдаёт буфер вместе с результатом, а replay() в процессе
+приложения применяет их к тем же метрикам.
+"""
+from __future__ import annotations
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import METRICS_ENABLED
+
+# секунды: от разбора base64 до полной загрузки галереи
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Labels, float]
+
+_registry: Dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+# буфер замеров процесса-воркера (см. defer / replay); None — пишем в метрики сразу
+_deferred: Optional[List[Sample]] = None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            if name in _registry:
+                raise ValueError(f"Метрика {name} уже зарегистрирована")
+            _registry[name] = self
+
+    def _apply(self, labels: Labels, value: float) -> None:
+        raise NotImplementedError
+
+    def _record(self, labels: Labels, value: float) -> None:
+        if _deferred is not None:
+            _deferred.append((self.name, labels, value))
+        else:
+            self._apply(labels, value)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Имя — сразу с суффиксом _total: под ним и HELP/TYPE, и значения."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        if not name.endswith("_total"):
+            raise ValueError(f"Имя счётчика {name} должно оканчиваться на _total")
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        if METRICS_ENABLED:
+            self._record(labels, amount)
+
+    def _apply(self, labels: Labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, v in values:
+            lines.append(f"{self.name}{_labels_text(self.labelnames, labels)} {_number(v)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels → [счётчики по корзинам (последняя — +Inf), сумма]
+        self._series: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if METRICS_ENABLED:
+            self._record(labels, value)
+
+    def _apply(self, labels: Labels, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение снимается fn() при каждом scrape; fn → число или {labels: число}."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], Any],
+        labelnames: Sequence[str] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            # метрика без значения лучше, чем упавший /metrics
+            return [f"# {self.name}: {type(e).__name__}: {e}"]
+        if value is None:
+            return []
+        lines = super().render()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            if v is None:
+                continue
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            lines.append(f"{self.name}{_labels_text(self.labelnames, labels)} {_number(v)}")
+        return lines
+
+
+# ────────────────────────────────────────────────
+# Общие метрики пайплайна
+# ────────────────────────────────────────────────
+STAGE_SECONDS = Histogram(
+    "faceid_stage_seconds",
+    "Длительность этапа обработки запроса (base64, декодирование, детекция, recognition, БД, скоринг)",
+    ("stage",),
+)
+QUALITY_GATES = Counter(
+    "faceid_quality_gate_total",
+    "Результаты quality gates по фото: pass или причина отказа (no_face, det_score, face_size, blur)",
+    ("result",),
+)
+HTTP_SECONDS = Histogram(
+    "faceid_http_request_seconds",
+    "Длительность HTTP-запроса по маршруту",
+    ("method", "route", "status"),
+)
+
+
+class stage:
+    """Замер этапа в faceid_stage_seconds{stage=name} (в том числе при исключении)."""
+
+    # класс, а не @contextmanager: без генератора на каждый замер
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "stage":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if METRICS_ENABLED:
+            STAGE_SECONDS._record((self.name,), time.perf_counter() - self.t0)
+
+
+def timed(name: str) -> Callable:
+    """Декоратор: вызов функции — этап name."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def gauge(name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> Gauge:
+    return Gauge(name, help, fn, labelnames)
+
+
+# ────────────────────────────────────────────────
+# Окна замеров для stats() компонентов (JSON-эндпоинты, не Prometheus)
+# ────────────────────────────────────────────────
+# сколько последних замеров держим для перцентилей: deque(maxlen=LATENCY_WINDOW)
+LATENCY_WINDOW = 2048
+
+
+def percentiles(samples: Sequence[float]) -> Dict[str, Optional[float]]:
+    """p50 / p95 / p99 окна замеров (мс); пустое окно — None."""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    a = np.asarray(samples)
+    return {
+        "p50": round(float(np.percentile(a, 50)), 3),
+        "p95": round(float(np.percentile(a, 95)), 3),
+        "p99": round(float(np.percentile(a, 99)), 3),
+    }
+
+
+def size_bucket(n: int) -> str:
+    """Корзина гистограммы размеров пакетов: 1, 2, 3-4, 5-8, 9-16, ..."""
+    if n <= 2:
+        return str(n)
+    hi = 1 << (n - 1).bit_length()
+    return f"{hi // 2 + 1}-{hi}"
+
+
+# ────────────────────────────────────────────────
+# Замеры из процессов-воркеров
+# ────────────────────────────────────────────────
+def defer() -> None:
+    """Процесс-воркер: копить замеры в буфер вместо своих (невидимых) метрик."""
+    global _deferred
+    _deferred = []
+
+
+def take_deferred() -> List[Sample]:
+    """Замеры, накопленные с прошлого вызова (в процессе без defer() — пусто)."""
+    global _deferred
+    if not _deferred:
+        return []
+    samples, _deferred = _deferred, []
+    return samples
+
+
+def replay(samples: Sequence[Sample]) -> None:
+    """Применить замеры воркера к метрикам этого процесса."""
+    for name, labels, value in samples:
+        metric = _registry.get(name)
+        if metric is not None:
+            metric._apply(labels, value)
+
+
+def render() -> str:
+    """Все метрики процесса — тело ответа GET /metrics (text/plain; version=0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
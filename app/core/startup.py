@@ -0,0 +1,64 @@
+# app/core/startup.py
+from __future__ import annotations
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+
+class StartupReport:
+    """
+    Этапы старта процесса и готовность к трафику (GET /ready).
+
+        with startup.phase("models"):
+            ...
+        startup.mark_ready()
+
+    Процесс готов, когда прошли все этапы старта: модели загружены
+    и прогреты, галерея в памяти. uvicorn не принимает соединения, пока
+    идёт startup, так что до готовности проба просто не проходит; 503
+    /ready отдаёт после mark_stopping — на остановке процесс снимается
+    с трафика раньше, чем закроются пулы.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready_seconds: Optional[float] = None
+        self.failed: Dict[str, str] = {}
+        self.stopping = False
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_seconds is not None and not self.stopping
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            # упавший необязательный этап (прогрев пула БД) не держит процесс неготовым
+            self.failed[name] = str(e)
+            raise
+        finally:
+            self.phases[name] = time.perf_counter() - t0
+
+    def mark_ready(self) -> None:
+        self.ready_seconds = time.perf_counter() - self.started
+
+    def mark_stopping(self) -> None:
+        self.stopping = True
+
+    def summary(self) -> str:
+        parts = [f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()]
+        total = self.ready_seconds if self.ready_seconds is not None else time.perf_counter() - self.started
+        return f"{total:.2f}s ({', '.join(parts)})" if parts else f"{total:.2f}s"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "stopping": self.stopping,
+            "ready_seconds": round(self.ready_seconds, 3) if self.ready_seconds is not None else None,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "failed": self.failed,
+        }
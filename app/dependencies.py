@@ -1,16 +1,104 @@
 # app/dependencies.py
-from fastapi import Depends, FastAPI
-from insightface.app import FaceAnalysis
-from app.services.database import get_clickhouse_client  # позже добавим
+import functools
+import threading
+from typing import Any, Callable
+
+from app.core.config import FACEID_REPO, GALLERY_SNAPSHOT_DIR, INFERENCE_THREADS, SEARCH_MODE
+from app.services.crop_store import CropStore
+from app.services.database import get_clickhouse_client, get_clickhouse_pool
+from app.services.face_models import load_face_models
+from app.services.inference_pool import InferencePool
+from app.services.embedding_cache import EmbeddingCache
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_refresher import GalleryRefresher
+from app.services.gallery_snapshot import GallerySnapshotStore
+from app.services.gallery_shards import ShardedGallery
+from app.repositories.faceid_repo import FaceIdRepo
+from app.repositories.memory_repo import MemoryFaceIdRepo
+from app.repositories.snapshot_buffer import SnapshotBuffer
 
 face_app = None
+_face_app_lock = threading.Lock()
+
+
+def _singleton(factory: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Один объект на процесс, создаётся при первом обращении, а не при импорте:
+    импорт модуля (инструменты, процессы-шарды) не открывает пулы и потоки.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
+
+# один репозиторий на процесс: соединения — из общего пула, не по одному на запрос.
+# FACEID_REPO=memory — без ClickHouse, снимки живут до перезапуска процесса
+@_singleton
+def get_faceid_repo():
+    return MemoryFaceIdRepo() if FACEID_REPO == "memory" else FaceIdRepo()
+
+# регистрации по одной копятся и пишутся в face_snapshots пакетами
+@_singleton
+def get_snapshot_buffer():
+    return SnapshotBuffer(get_faceid_repo().insert_document_snapshots)
+
+# кропы лиц регистрации: по хэшу содержимого, запись в фоновых потоках
+@_singleton
+def get_crop_store():
+    return CropStore()
+
+def _rescore_embeddings(person_ids):
+    # float32-строки кандидатов для компактной галереи (GALLERY_DTYPE = float16 / int8)
+    return get_faceid_repo().get_embeddings_by_person_ids(person_ids)
+
+# GALLERY_SNAPSHOT_DIR: воркеры uvicorn открывают одну матрицу галереи с диска (mmap)
+@_singleton
+def get_gallery_refresher():
+    return GalleryRefresher(
+        GalleryIndex(rescore=_rescore_embeddings),
+        repo_factory=get_faceid_repo,
+        snapshots=GallerySnapshotStore(GALLERY_SNAPSHOT_DIR) if GALLERY_SNAPSHOT_DIR else None,
+    )
 
 def get_face_app():
     global face_app
-    if face_app is None:
-        face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-        face_app.prepare(ctx_id=0)
+    with _face_app_lock:
+        if face_app is None:
+            face_app = load_face_models(INFERENCE_THREADS)
     return face_app
 
+@_singleton
+def get_inference_pool():
+    return InferencePool(get_face_app)
+
+# повторно присланное фото поиска не гоняет инференс заново
+@_singleton
+def get_embedding_cache():
+    return EmbeddingCache()
+
 def get_db_client():
-    return get_clickhouse_client()
\ No newline at end of file
+    return get_clickhouse_client()
+
+def get_db_pool():
+    return get_clickhouse_pool()
+
+def get_gallery_index():
+    # грузим галерею один раз; если БД была недоступна на старте — пробуем снова.
+    # В режимах SEARCH_MODE=clickhouse / sharded резидентная галерея не нужна
+    refresher = get_gallery_refresher()
+    if SEARCH_MODE == "local" and not refresher.index.loaded:
+        refresher.full_load()
+    return refresher.index
+
+# SEARCH_MODE=sharded: галерея — в процессах-шардах (SEARCH_SHARDS), здесь только клиенты
+@_singleton
+def get_shard_gallery():
+    return ShardedGallery() if SEARCH_MODE == "sharded" else None
@@ -1,15 +1,26 @@
 from fastapi import FastAPI, Request, File, UploadFile
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import base64
-import cv2
-import numpy as np
+import asyncio
+import time
 
 from app.api.router_register import router as register_router
 from app.api.router_search import router as search_router
-from app.services.face_pipeline import get_face_embedding_strict
-from app.dependencies import get_face_app
+from app.core import metrics
+from app.core.config import SEARCH_MODE
+from app.core.startup import StartupReport
+from app.dependencies import (
+    get_inference_pool,
+    get_embedding_cache,
+    get_gallery_index,
+    get_gallery_refresher,
+    get_db_pool,
+    get_snapshot_buffer,
+    get_shard_gallery,
+    get_crop_store,
+)
+from app.services.database import db_executor
 
 app = FastAPI(
     title="Face ID Boom",
@@ -28,10 +39,217 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Jinja2 шаблоны
 templates = Jinja2Templates(directory="app/templates")
 
+# этапы старта и готовность (GET /ready)
+startup = StartupReport()
+
+
+@app.middleware("http")
+async def http_timing(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # шаблон маршрута, а не путь: /static/<файл> не плодит серии
+        route = request.scope.get("route")
+        metrics.HTTP_SECONDS.observe(
+            time.perf_counter() - t0,
+            request.method,
+            getattr(route, "path", "unmatched"),
+            str(status),
+        )
+
+
+# Состояние снимается в момент scrape — на пути запроса ничего не стоит
+metrics.gauge(
+    "faceid_gallery_rows",
+    "Строк в резидентной галерее (SEARCH_MODE=local)",
+    lambda: get_gallery_refresher().index.size if SEARCH_MODE == "local" else None,
+)
+metrics.gauge(
+    "faceid_gallery_retired_rows",
+    "Вытесненных шаблонов галереи, ждущих уплотнения",
+    lambda: get_gallery_refresher().index.retired if SEARCH_MODE == "local" else None,
+)
+metrics.gauge(
+    "faceid_gallery_refresh_lag_seconds",
+    "Секунд с последнего обновления галереи из ClickHouse",
+    lambda: get_gallery_refresher().stats()["refresh_lag_seconds"] if SEARCH_MODE == "local" else None,
+)
+metrics.gauge(
+    "faceid_inference_in_flight",
+    "Запросов в пуле инференса (детекция)",
+    lambda: get_inference_pool().in_flight,
+)
+metrics.gauge(
+    "faceid_inference_queue_depth",
+    "Запросов инференса, ждущих свободного воркера",
+    lambda: get_inference_pool().stats()["queue_depth"],
+)
+metrics.gauge(
+    "faceid_recognition_pending",
+    "Кропов в очереди micro-batching ArcFace",
+    lambda: get_inference_pool().batcher.stats()["pending"],
+)
+metrics.gauge(
+    "faceid_inference_rejected",
+    "Запросов, отклонённых из-за переполнения очереди инференса (с запуска)",
+    lambda: get_inference_pool().rejected,
+)
+metrics.gauge(
+    "faceid_embedding_cache_entries",
+    "Записей в кэше embedding'ов поиска",
+    lambda: get_embedding_cache().stats()["entries"],
+)
+metrics.gauge(
+    "faceid_embedding_cache_hit_ratio",
+    "Доля запросов поиска, обслуженных кэшем embedding'ов",
+    lambda: get_embedding_cache().stats()["hit_ratio"],
+)
+metrics.gauge(
+    "faceid_snapshot_buffer_rows",
+    "Строк face_snapshots в write-behind буфере (включая пишущиеся)",
+    lambda: (lambda s: s["buffered_rows"] + s["flushing_rows"])(get_snapshot_buffer().stats()),
+)
+metrics.gauge(
+    "faceid_ready",
+    "1 — процесс прошёл старт и принимает трафик (GET /ready)",
+    lambda: int(startup.ready),
+)
+metrics.gauge(
+    "faceid_startup_phase_seconds",
+    "Длительность этапов старта процесса",
+    lambda: dict(startup.phases),
+    ("phase",),
+)
+metrics.gauge(
+    "faceid_crop_write_queue_depth",
+    "Кропов лиц в очереди фоновой записи",
+    lambda: get_crop_store().stats()["queue_depth"],
+)
+metrics.gauge(
+    "faceid_db_pool_connections",
+    "Соединения пула ClickHouse по состоянию",
+    lambda: (lambda s: {state: s[state] for state in ("in_use", "idle", "waiting")})(get_db_pool().stats()),
+    ("state",),
+)
+
 
 @app.on_event("startup")
 async def startup_event():
-    get_face_app()  # инициализация модели при старте
+    # инициализация моделей при старте: в процессе приложения или в воркерах пула
+    with startup.phase("models"):
+        await asyncio.to_thread(get_inference_pool().start)
+    for pid, loaded in get_inference_pool().models_loaded.items():
+        sessions = ", ".join(f"{name} {s['seconds']:.2f}s {s['source']}" for name, s in loaded["sessions"].items())
+        print(f"Face models [{pid}]: {loaded['timings']} — {sessions}")
+
+    # соединения с ClickHouse открываем заранее — не в латентности первых запросов
+    try:
+        with startup.phase("db_pool"):
+            opened = await asyncio.to_thread(get_db_pool().warmup)
+        print(f"ClickHouse pool: {opened} connections")
+    except Exception as e:
+        print(f"ClickHouse pool не прогрет (соединения откроются по запросу): {e}")
+
+    if SEARCH_MODE == "sharded":
+        with startup.phase("shards"):
+            shards = await get_shard_gallery().ping()
+        for shard in shards:
+            print(f"Gallery shard: {shard}")
+
+    if SEARCH_MODE != "local":
+        print(f"Search mode: {SEARCH_MODE} — резидентная галерея не загружается")
+    else:
+        # галерея embedding'ов в памяти — один раз на процесс
+        try:
+            with startup.phase("gallery"):
+                gallery = get_gallery_index()
+            print(f"Gallery index loaded: {gallery.size} embeddings")
+        except Exception as e:
+            print(f"Gallery index не загружен (будет загружен при первом поиске): {e}")
+
+        # фоновое инкрементальное обновление галереи по created_at
+        get_gallery_refresher().start()
+
+    startup.mark_ready()
+    print(f"Startup: ready in {startup.summary()}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # балансировщик снимает процесс с трафика до того, как закроются пулы
+    startup.mark_stopping()
+    await get_gallery_refresher().stop()
+    # дописываем буфер регистраций, пока пул соединений ещё жив
+    await get_snapshot_buffer().close()
+    await get_crop_store().close()
+    if get_shard_gallery() is not None:
+        get_shard_gallery().close()
+    get_inference_pool().shutdown()
+    db_executor.shutdown(wait=False)
+    get_db_pool().close()
+
+
+@app.get("/ready")
+async def readiness():
+    """
+    Готовность к трафику: 200 после загрузки и прогрева моделей и галереи,
+    503 — на остановке. Тело — длительность этапов старта (сек)
+    """
+    return JSONResponse(startup.stats(), status_code=200 if startup.ready else 503)
+
+
+@app.get("/inference/pool")
+async def inference_pool_stats():
+    """
+    Размер пула инференса, глубина очереди и метрики micro-batching ArcFace
+    """
+    return get_inference_pool().stats()
+
+
+@app.get("/inference/cache")
+async def embedding_cache_stats():
+    """
+    Кэш embedding'ов запроса поиска: записи, память, попадания / промахи / вытеснения
+    """
+    return get_embedding_cache().stats()
+
+
+@app.get("/db/pool")
+async def db_pool_stats():
+    """
+    Пул соединений ClickHouse: размер, занятые / свободные, ожидание соединения (мс)
+    """
+    return get_db_pool().stats()
+
+
+@app.get("/db/snapshot-buffer")
+async def snapshot_buffer_stats():
+    """
+    Write-behind буфер face_snapshots: строк в буфере, размер и длительность INSERT'ов
+    """
+    return get_snapshot_buffer().stats()
+
+
+@app.get("/crops")
+async def crop_store_stats():
+    """
+    Хранилище кропов лиц: глубина очереди записи, записано / дедуплицировано,
+    длительность кодирования + записи и задержка до файла на диске (мс)
+    """
+    return get_crop_store().stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Метрики в формате Prometheus: гистограммы этапов (faceid_stage_seconds),
+    HTTP-запросов, quality gates и текущее состояние галереи / очередей
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -1,11 +1,25 @@
-from typing import Optional, Dict, Any, List
-from uuid import uuid4
-from app.services.database import get_clickhouse_client
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+
+import numpy as np
+from clickhouse_driver.errors import ServerException
+
+from app.core.config import CLICKHOUSE_PERSON_FANOUT, CLICKHOUSE_VECTOR_INDEX
+from app.core.metrics import timed
+from app.schemas.search import SearchFilters
+from app.services.database import get_pooled_client
+from app.services.face_pipeline import EMB_SIZE
+from app.services.quantization import QuantizedRows
 
 
 class FaceIdRepo:
-    def __init__(self):
-        self.client = get_clickhouse_client()
+    # embedding галереи читается байтами через reinterpretAsString(Array);
+    # сбрасывается один раз на процесс, если сервер так не умеет
+    _raw_embeddings = True
+
+    def __init__(self, client=None):
+        # по умолчанию — общий пул соединений процесса (см. database.ClickHousePool)
+        self.client = client if client is not None else get_pooled_client()
 
     # ────────────────────────────────────────────────
     # Legacy / заглушки (оставляем)
@@ -27,6 +41,7 @@ class FaceIdRepo:
     # ────────────────────────────────────────────────
     # Используется при ingest
     # ────────────────────────────────────────────────
+    @timed("db_latest_face")
     def get_latest_face_payload(self, person_id: str) -> Optional[Dict[str, Any]]:
         query = """
         SELECT
@@ -54,6 +69,18 @@ class FaceIdRepo:
         }
 
     def insert_document_snapshot(self, row: Dict[str, Any]) -> None:
+        self.insert_document_snapshots([row])
+
+        print("Inserted document snapshot:", row.get("person_id"))
+
+    @timed("db_insert")
+    def insert_document_snapshots(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Пакетный INSERT: один part в ClickHouse на весь пакет, а не на строку.
+        """
+        if not rows:
+            return
+
         query = """
                 INSERT INTO face_id_boom.face_snapshots
                 (person_id, \
@@ -72,7 +99,8 @@ class FaceIdRepo:
                  det_score, \
                  blur, \
                  face_size, \
-                 faces_found)
+                 faces_found, \
+                 snapshot_id)
                 VALUES \
                 """
 
@@ -97,18 +125,19 @@ class FaceIdRepo:
                     row.get("blur"),
                     row.get("face_size"),
                     row.get("faces_found"),
+                    row.get("snapshot_id"),
                 )
+                for row in rows
             ],
         )
 
-        print("Inserted document snapshot:", row.get("person_id"))
-
     def insert_border_event(self, row: Dict[str, Any]) -> None:
         print("Inserted border event:", row)
 
     # ────────────────────────────────────────────────
     # 🔥 КЛЮЧЕВОЙ МЕТОД ДЛЯ SEARCH
     # ────────────────────────────────────────────────
+    @timed("db_gallery_rows")
     def get_all_face_embeddings(self):
         query = """
                 SELECT person_id, \
@@ -148,3 +177,343 @@ class FaceIdRepo:
 
         return results
 
+    # ────────────────────────────────────────────────
+    # Резидентный индекс галереи
+    # ────────────────────────────────────────────────
+    @timed("db_gallery_load")
+    def get_face_embedding_matrix(
+        self,
+        since: Optional[datetime] = None,
+        compact: bool = False,
+        shard: Optional[Tuple[int, int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Только person_id + embedding (+ snapshot_id строки и created_at) — для GalleryIndex.
+        Метаданные не тянем: они нужны лишь для итоговых совпадений
+        (get_faces_by_snapshot_ids). Исключение — четыре колонки фильтров поиска
+        (citizenship, visa_type, entry_date, exit_date) и три колонки качества
+        (det_score, blur, face_size) для отбора шаблонов на человека.
+        since — водяной знак по created_at: берём строки с created_at >= since.
+        compact — вместо float32 читаем embedding_i8 + embedding_scale
+        (см. db_init.py) и отдаём QuantizedRows: в 4 раза меньше по сети и в памяти.
+        shard = (i, n) — только строки шарда i из n: cityHash64(person_id) % n = i,
+        все снимки человека — в одном шарде.
+
+        Результат читается по колонкам, embedding — сырыми байтами
+        (reinterpretAsString): матрица собирается одним np.frombuffer, без
+        512 Python-float на строку. Сервер без reinterpretAsString для Array —
+        прежнее чтение массивов (см. _raw_embeddings).
+        """
+        raw = self._raw_embeddings
+        if compact:
+            columns = (
+                "reinterpretAsString(embedding_i8), embedding_scale" if raw
+                else "embedding_i8, embedding_scale"
+            )
+        else:
+            columns = "reinterpretAsString(embedding)" if raw else "embedding"
+        query = f"""
+                SELECT person_id, \
+                       snapshot_id, \
+                       created_at, \
+                       citizenship, \
+                       visa_type, \
+                       entry_date, \
+                       exit_date, \
+                       det_score, \
+                       blur, \
+                       face_size, \
+                       {columns}
+                FROM face_id_boom.face_snapshots
+                WHERE embedding IS NOT NULL \
+                  AND length(embedding) = %(dim)s \
+                """
+        params: Dict[str, Any] = {"dim": EMB_SIZE}
+        if since is not None:
+            query += " AND created_at >= %(since)s"
+            params["since"] = since
+        if shard is not None:
+            query += " AND cityHash64(person_id) %% %(shards)s = %(shard)s"
+            params["shard"], params["shards"] = shard
+        query += " ORDER BY created_at"
+
+        try:
+            # strings_as_bytes — только для этого запроса: байты embedding не UTF-8
+            cols = self.client.execute(
+                query, params, columnar=True, settings={"strings_as_bytes": raw},
+            )
+        except ServerException as e:
+            if not raw:
+                raise
+            print(f"reinterpretAsString(Array) не поддерживается сервером, читаем массивы: {e}")
+            FaceIdRepo._raw_embeddings = False
+            return self.get_face_embedding_matrix(since, compact, shard)
+
+        n_columns = 12 if compact else 11
+        if not cols:
+            # columnar-результат без строк — пустой список, а не пустые колонки
+            cols = [()] * n_columns
+
+        dtype = np.int8 if compact else np.float32
+        if raw:
+            embedding = _raw_matrix(cols[10], dtype)
+        else:
+            embedding = np.array(cols[10], dtype=dtype).reshape(-1, EMB_SIZE)
+        if compact:
+            embedding = QuantizedRows(embedding, np.asarray(cols[11], dtype=np.float32))
+
+        return {
+            "person_id": _text(cols[0]),
+            "snapshot_id": list(cols[1]),
+            "created_at": list(cols[2]),
+            "citizenship": _text(cols[3]),
+            "visa_type": _text(cols[4]),
+            "entry_date": _text(cols[5]),
+            "exit_date": _text(cols[6]),
+            "det_score": cols[7],
+            "blur": cols[8],
+            "face_size": cols[9],
+            "embedding": embedding,
+        }
+
+    @timed("db_rescore")
+    def get_embeddings_by_person_ids(
+        self, person_ids: Sequence[str],
+    ) -> Dict[str, Tuple[np.ndarray, List[int]]]:
+        """
+        float32-embedding'и всех снимков каждого person_id и их snapshot_id —
+        для точного пересчёта кандидатов компактной галереи.
+        """
+        if not person_ids:
+            return {}
+
+        query = """
+                SELECT person_id, \
+                       snapshot_id, \
+                       embedding
+                FROM face_id_boom.face_snapshots
+                WHERE person_id IN %(person_ids)s \
+                  AND length(embedding) = %(dim)s \
+                """
+        rows = self.client.execute(query, {"person_ids": list(set(person_ids)), "dim": EMB_SIZE})
+
+        grouped: Dict[str, Tuple[List[Any], List[int]]] = {}
+        for pid, sid, emb in rows:
+            embs, sids = grouped.setdefault(pid, ([], []))
+            embs.append(emb)
+            sids.append(sid)
+        return {pid: (np.asarray(embs, dtype=np.float32), sids) for pid, (embs, sids) in grouped.items()}
+
+    @timed("db_search")
+    def search_similar(
+        self,
+        query: Sequence[float],
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Поиск на стороне ClickHouse: cosine similarity, ORDER BY ... LIMIT top_k
+        и порог считаются сервером, по сети идут только top_k строк с метаданными.
+
+        Внутренний запрос — ровно ORDER BY cosineDistance(...) LIMIT k, поэтому
+        его может обслужить vector_similarity индекс (см. db_init.py); порог
+        применяется внешним запросом к уже отобранным строкам.
+        Строки с NaN / нулевой нормой дают NaN и отсекаются порогом.
+        Строки чужой длины отсекает WHERE; с индексом их нет по построению,
+        а лишний WHERE по embedding мешает индексу — фильтр снимаем.
+        filters — условия на атрибуты во внутреннем WHERE, до ORDER BY ... LIMIT.
+        У человека может быть много снимков: внутренний запрос берёт
+        top_k · CLICKHOUSE_PERSON_FANOUT ближайших, внешний оставляет лучший
+        снимок на person_id (LIMIT 1 BY) и top_k людей.
+        """
+        params: Dict[str, Any] = {
+            "q": [float(x) for x in query],
+            "dim": EMB_SIZE,
+            "top_k": int(top_k),
+            "fetch": int(top_k) * max(1, CLICKHOUSE_PERSON_FANOUT),
+            "threshold": float(threshold),
+        }
+        conditions = [] if CLICKHOUSE_VECTOR_INDEX else ["length(embedding) = %(dim)s"]
+        if filters is not None:
+            conditions += _filter_conditions(filters, params)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query_sql = f"""
+                SELECT person_id, \
+                       full_name, \
+                       passport, \
+                       citizenship, \
+                       birth_date, \
+                       visa_type, \
+                       visa_number, \
+                       entry_date, \
+                       exit_date, \
+                       face_url, \
+                       1 - distance AS score
+                FROM
+                (
+                    SELECT person_id, \
+                           full_name, \
+                           passport, \
+                           citizenship, \
+                           birth_date, \
+                           visa_type, \
+                           visa_number, \
+                           entry_date, \
+                           exit_date, \
+                           face_url, \
+                           cosineDistance(embedding, CAST(%(q)s, 'Array(Float32)')) AS distance
+                    FROM face_id_boom.face_snapshots
+                    {where}
+                    ORDER BY distance ASC
+                    LIMIT %(fetch)s
+                )
+                WHERE score >= %(threshold)s
+                ORDER BY score DESC
+                LIMIT 1 BY person_id
+                LIMIT %(top_k)s \
+                """
+        rows = self.client.execute(query_sql, params)
+
+        return [
+            {
+                "person_id": r[0],
+                "full_name": r[1],
+                "passport": r[2],
+                "citizenship": r[3],
+                "birth_date": r[4],
+                "visa_type": r[5],
+                "visa_number": r[6],
+                "entry_date": r[7],
+                "exit_date": r[8],
+                "face_url": r[9],
+                "score": float(r[10]),
+            }
+            for r in rows
+        ]
+
+    @timed("db_metadata")
+    def get_faces_by_snapshot_ids(self, snapshot_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Метаданные совпавших снимков по snapshot_id — одним запросом.
+        """
+        if not snapshot_ids:
+            return {}
+
+        query = """
+                SELECT snapshot_id, \
+                       person_id, \
+                       full_name, \
+                       passport, \
+                       citizenship, \
+                       birth_date, \
+                       visa_type, \
+                       visa_number, \
+                       entry_date, \
+                       exit_date, \
+                       face_url
+                FROM face_id_boom.face_snapshots
+                WHERE snapshot_id IN %(snapshot_ids)s
+                LIMIT 1 BY snapshot_id \
+                """
+        rows = self.client.execute(query, {"snapshot_ids": list(set(snapshot_ids))})
+
+        return {
+            r[0]: {
+                "person_id": r[1],
+                "full_name": r[2],
+                "passport": r[3],
+                "citizenship": r[4],
+                "birth_date": r[5],
+                "visa_type": r[6],
+                "visa_number": r[7],
+                "entry_date": r[8],
+                "exit_date": r[9],
+                "face_url": r[10],
+            }
+            for r in rows
+        }
+
+    @timed("db_metadata")
+    def get_faces_by_person_ids(self, person_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Метаданные последнего снимка для каждого person_id — одним запросом
+        (совпадения без snapshot_id, см. get_faces_by_snapshot_ids).
+        """
+        if not person_ids:
+            return {}
+
+        query = """
+                SELECT person_id, \
+                       full_name, \
+                       passport, \
+                       citizenship, \
+                       birth_date, \
+                       visa_type, \
+                       visa_number, \
+                       entry_date, \
+                       exit_date, \
+                       face_url
+                FROM face_id_boom.face_snapshots
+                WHERE person_id IN %(person_ids)s
+                ORDER BY created_at DESC
+                LIMIT 1 BY person_id \
+                """
+        rows = self.client.execute(query, {"person_ids": list(set(person_ids))})
+
+        return {
+            r[0]: {
+                "person_id": r[0],
+                "full_name": r[1],
+                "passport": r[2],
+                "citizenship": r[3],
+                "birth_date": r[4],
+                "visa_type": r[5],
+                "visa_number": r[6],
+                "entry_date": r[7],
+                "exit_date": r[8],
+                "face_url": r[9],
+            }
+            for r in rows
+        }
+
+
+def _text(values: Sequence[Any]) -> List[Any]:
+    """Колонка из запроса со strings_as_bytes → str (даты и None — как есть)."""
+    return [v.decode("utf-8", "replace") if isinstance(v, bytes) else v for v in values]
+
+
+def _raw_matrix(values: Sequence[bytes], dtype) -> np.ndarray:
+    """
+    Байты embedding по строкам → (N, EMB_SIZE) матрица одним буфером.
+    Длина строк гарантирована WHERE length(embedding) = dim.
+    Матрица только для чтения (поверх bytes): нормировка всё равно делает новую.
+    """
+    if not values:
+        return np.empty((0, EMB_SIZE), dtype=dtype)
+    # ClickHouse пишет числа little-endian; на x86 / ARM это и есть родной порядок
+    raw = np.frombuffer(b"".join(values), dtype=np.dtype(dtype).newbyteorder("<"))
+    return raw.astype(dtype, copy=False).reshape(-1, EMB_SIZE)
+
+
+def _filter_conditions(filters: SearchFilters, params: Dict[str, Any]) -> List[str]:
+    """
+    SearchFilters → условия WHERE (+ параметры в params). Сравнение — как у
+    AttributeIndex: категории без регистра и пробелов, даты по первым 10 символам,
+    пустые / нераспознанные даты не проходят ни один диапазон.
+    """
+    conditions = []
+    for name in ("citizenship", "visa_type"):
+        values = getattr(filters, name)
+        if values is not None:
+            conditions.append(f"lowerUTF8(trimBoth(ifNull(toString({name}), ''))) IN %({name})s")
+            params[name] = [v.strip().lower() for v in values]
+    for name in ("entry_date", "exit_date"):
+        for bound, op in (("from", ">="), ("to", "<=")):
+            value = getattr(filters, f"{name}_{bound}")
+            if value is not None:
+                conditions.append(
+                    f"toDate32OrNull(substring(toString({name}), 1, 10)) {op} %({name}_{bound})s"
+                )
+                params[f"{name}_{bound}"] = value
+    return conditions
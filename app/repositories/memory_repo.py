@@ -0,0 +1,297 @@
+# app/repositories/memory_repo.py
+from __future__ import annotations
+import itertools
+import threading
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import CLICKHOUSE_PERSON_FANOUT
+from app.schemas.search import SearchFilters
+from app.services.ann_index import top_k_desc
+from app.services.face_pipeline import EMB_SIZE
+from app.services.gallery_filters import ATTRIBUTES, AttributeIndex
+from app.services.quantization import quantize
+
+# колонки face_snapshots, которые хранит репозиторий (кроме embedding)
+COLUMNS = (
+    "person_id",
+    "full_name",
+    "passport",
+    "sex",
+    "citizenship",
+    "birth_date",
+    "visa_type",
+    "visa_number",
+    "entry_date",
+    "exit_date",
+    "face_url",
+    "embedding_status",
+    "det_score",
+    "blur",
+    "face_size",
+    "faces_found",
+    "created_at",
+    "snapshot_id",
+)
+
+# метаданные снимка в ответах поиска — как у FaceIdRepo
+_FACE_FIELDS = (
+    "person_id",
+    "full_name",
+    "passport",
+    "citizenship",
+    "birth_date",
+    "visa_type",
+    "visa_number",
+    "entry_date",
+    "exit_date",
+    "face_url",
+)
+
+_CHUNK = 65536  # строк на один GEMV в search_similar
+
+
+class MemoryFaceIdRepo:
+    """
+    FaceIdRepo без ClickHouse: face_snapshots в памяти процесса.
+
+    Та же поверхность, что у FaceIdRepo (вставка снимков, матрица галереи,
+    метаданные по snapshot_id / person_id, search_similar), — для офлайн-бенчмарков
+    (tools/bench_search.py) и стенда без БД. embedding'и — одна float32-матрица
+    с запасом ёмкости, остальные колонки — списки; created_at проставляется
+    при вставке, если его нет. search_similar — точный скан numpy, как
+    ClickHouse без индекса: лучший снимок на человека, порог, filters.
+    """
+
+    def __init__(self, dim: int = EMB_SIZE):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._emb = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._cols: Dict[str, List[Any]] = {name: [] for name in COLUMNS}
+        self._attrs: Optional[AttributeIndex] = None   # для filters в search_similar
+        self._latest: Optional[Dict[str, int]] = None  # person_id → строка последнего снимка
+        self._by_sid: Optional[Dict[int, int]] = None  # snapshot_id → строка
+        self._clock = datetime(2026, 1, 1)
+        self._next_id = itertools.count(1)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._emb[:self._size]
+
+    # ────────────────────────────────────────────────
+    # Запись
+    # ────────────────────────────────────────────────
+    def extend(self, embeddings: np.ndarray, columns: Dict[str, Sequence[Any]]) -> None:
+        """
+        Пакетная вставка по колонкам: embeddings (k, dim) + колонки длины k
+        (отсутствующие — None). Быстрый путь для синтетических галерей.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        k = embeddings.shape[0]
+        if k == 0:
+            return
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {sorted(unknown)}")
+
+        with self._lock:
+            if "created_at" not in columns:
+                columns = {**columns, "created_at": self._stamps(k)}
+            ids = columns.get("snapshot_id")
+            if ids is None or any(v is None for v in ids):
+                ids = [v if v is not None else next(self._next_id) for v in (ids or [None] * k)]
+                columns = {**columns, "snapshot_id": ids}
+            need = self._size + k
+            if self._size == 0 and embeddings.flags.c_contiguous and embeddings.base is None:
+                # первая вставка большой матрицы — без копии (вызывающий её больше не меняет)
+                self._emb = embeddings
+            elif need > self._emb.shape[0]:
+                grown = np.empty((max(need, 2 * self._emb.shape[0]), self.dim), dtype=np.float32)
+                grown[:self._size] = self._emb[:self._size]
+                self._emb = grown
+            if self._emb is not embeddings:
+                self._emb[self._size:need] = embeddings
+            for name in COLUMNS:
+                values = columns.get(name)
+                self._cols[name].extend(values if values is not None else [None] * k)
+            self._size = need
+            self._attrs = None
+            self._latest = None
+            self._by_sid = None
+
+    def _stamps(self, k: int) -> List[datetime]:
+        # по миллисекунде на строку: порядок вставки = порядок created_at
+        out = [self._clock + timedelta(milliseconds=i) for i in range(k)]
+        self._clock += timedelta(milliseconds=k)
+        return out
+
+    def insert_document_snapshots(self, rows: List[Dict[str, Any]]) -> None:
+        rows = [r for r in rows if r.get("embedding") is not None]
+        if not rows:
+            return
+        self.extend(
+            np.asarray([r["embedding"] for r in rows], dtype=np.float32),
+            {name: [r.get(name) for r in rows] for name in COLUMNS if any(name in r for r in rows)},
+        )
+
+    def insert_document_snapshot(self, row: Dict[str, Any]) -> None:
+        self.insert_document_snapshots([row])
+
+    # ── заглушки, как у FaceIdRepo ──
+    def get_person_id_by_sgb(self, sgb_person_id: int) -> Optional[str]:
+        return None
+
+    def insert_person(self, person_id: str) -> None:
+        pass
+
+    def upsert_sgb_map(self, sgb_person_id: int, person_id: str, is_active: int = 1) -> None:
+        pass
+
+    def insert_border_event(self, row: Dict[str, Any]) -> None:
+        pass
+
+    # ────────────────────────────────────────────────
+    # Чтение
+    # ────────────────────────────────────────────────
+    def _face(self, row: int) -> Dict[str, Any]:
+        return {name: self._cols[name][row] for name in _FACE_FIELDS}
+
+    def _latest_rows(self) -> Dict[str, int]:
+        latest = self._latest
+        if latest is None:
+            # строки упорядочены по created_at: последняя запись побеждает
+            latest = self._latest = {pid: row for row, pid in enumerate(self._cols["person_id"][:self._size])}
+        return latest
+
+    def get_latest_face_payload(self, person_id: str) -> Optional[Dict[str, Any]]:
+        row = self._latest_rows().get(person_id)
+        if row is None:
+            return None
+        return {
+            "person_id": person_id,
+            "embedding": self._emb[row].tolist(),
+            "full_name": self._cols["full_name"][row],
+            "passport": self._cols["passport"][row],
+            "face_url": self._cols["face_url"][row],
+        }
+
+    def get_all_face_embeddings(self) -> List[Dict[str, Any]]:
+        """Прежний путь поиска: все строки со всеми метаданными и embedding списком."""
+        return [
+            {**self._face(row), "embedding": self._emb[row].tolist()}
+            for row in range(self._size)
+        ]
+
+    def get_face_embedding_matrix(
+        self,
+        since: Optional[datetime] = None,
+        compact: bool = False,
+        shard: Optional[Tuple[int, int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Колонки как у FaceIdRepo.get_face_embedding_matrix. shard делит по
+        crc32(person_id) (в ClickHouse — cityHash64): целиком человек в одном шарде.
+        """
+        n = self._size
+        created = self._cols["created_at"]
+        # строки упорядочены по created_at — водяной знак ищется бинарным поиском
+        lo = bisect_left(created, since, 0, n) if since is not None else 0
+        rows = np.arange(lo, n)
+        if shard is not None:
+            i, shards = shard
+            pids = self._cols["person_id"]
+            rows = rows[[zlib.crc32(str(pids[r]).encode()) % shards == i for r in rows]] if rows.size else rows
+
+        def column(name: str) -> List[Any]:
+            values = self._cols[name]
+            return values[lo:n] if rows.shape[0] == n - lo else [values[r] for r in rows]
+
+        embedding = self._emb[lo:n] if rows.shape[0] == n - lo else self._emb[rows]
+        if compact:
+            embedding = quantize(embedding, "int8")
+        return {
+            **{name: column(name) for name in ("person_id", "snapshot_id", "created_at", *ATTRIBUTES)},
+            "det_score": column("det_score"),
+            "blur": column("blur"),
+            "face_size": column("face_size"),
+            "embedding": embedding,
+        }
+
+    def get_embeddings_by_person_ids(self, person_ids: Sequence[str]) -> Dict[str, Tuple[np.ndarray, List[int]]]:
+        wanted = set(person_ids)
+        grouped: Dict[str, List[int]] = {}
+        for row, pid in enumerate(self._cols["person_id"][:self._size]):
+            if pid in wanted:
+                grouped.setdefault(pid, []).append(row)
+        sids = self._cols["snapshot_id"]
+        return {pid: (self._emb[rows], [sids[r] for r in rows]) for pid, rows in grouped.items()}
+
+    def get_faces_by_snapshot_ids(self, snapshot_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        by_sid = self._by_sid
+        if by_sid is None:
+            by_sid = self._by_sid = {sid: row for row, sid in enumerate(self._cols["snapshot_id"][:self._size])}
+        return {sid: self._face(by_sid[sid]) for sid in set(snapshot_ids) if sid in by_sid}
+
+    def get_faces_by_person_ids(self, person_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        latest = self._latest_rows()
+        return {pid: self._face(latest[pid]) for pid in set(person_ids) if pid in latest}
+
+    def search_similar(
+        self,
+        query: Sequence[float],
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Точный cosine-скан по всем строкам (NaN / нулевая норма — отсекаются порогом),
+        top_k · CLICKHOUSE_PERSON_FANOUT ближайших, лучший снимок на человека.
+        """
+        n = self._size
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        q_norm = float(np.linalg.norm(q))
+        if n == 0 or top_k <= 0 or not np.isfinite(q_norm) or q_norm == 0.0:
+            return []
+        q = q / q_norm
+
+        scores = np.empty(n, dtype=np.float32)
+        for lo in range(0, n, _CHUNK):
+            block = self._emb[lo:min(n, lo + _CHUNK)]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                scores[lo:lo + block.shape[0]] = (block @ q) / np.linalg.norm(block, axis=1)
+        if filters is not None and not filters.empty:
+            selection = self._attributes().select(filters, n, n)
+            mask = np.zeros(n, dtype=bool)
+            mask[selection] = True
+            scores[~mask] = np.nan
+        scores[~np.isfinite(scores)] = -np.inf
+
+        pids = self._cols["person_id"]
+        found: List[Dict[str, Any]] = []
+        seen = set()
+        for row in top_k_desc(scores, int(top_k) * max(1, CLICKHOUSE_PERSON_FANOUT)):
+            score = float(scores[row])
+            if score < threshold or len(found) >= top_k:
+                break
+            if pids[row] in seen:
+                continue
+            seen.add(pids[row])
+            found.append({**self._face(int(row)), "score": score})
+        return found
+
+    def _attributes(self) -> AttributeIndex:
+        attrs = self._attrs
+        if attrs is None:
+            attrs = AttributeIndex()
+            attrs.extend({name: self._cols[name][:self._size] for name in ATTRIBUTES}, self._size)
+            self._attrs = attrs
+        return attrs
@@ -0,0 +1,173 @@
+# app/repositories/snapshot_buffer.py
+from __future__ import annotations
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import SNAPSHOT_FLUSH_ROWS, SNAPSHOT_FLUSH_DELAY_MS
+from app.core.metrics import LATENCY_WINDOW, percentiles, size_bucket
+from app.services.database import run_db
+
+_Pending = Tuple[Dict[str, Any], asyncio.Future, float]
+
+
+class SnapshotBuffer:
+    """
+    Write-behind буфер строк face_snapshots.
+
+    Строки копятся в памяти и уходят одним INSERT, как только набралось
+    max_rows или истекло max_delay_ms с момента постановки самой старой.
+    Пока идёт INSERT, новые строки продолжают копиться — под нагрузкой
+    пакеты крупнеют сами. Вставки идут по одной: ClickHouse лучше
+    переносит редкие крупные part'ы, чем параллельные мелкие.
+
+    add() возвращает future строки: результат — после успешного INSERT,
+    исключение — если пакет не записался. Ждать его не обязательно.
+
+    insert_rows: блокирующий (список строк) -> None, обычно
+    FaceIdRepo.insert_document_snapshots; выполняется в db_executor.
+    """
+
+    def __init__(
+        self,
+        insert_rows: Callable[[List[Dict[str, Any]]], None],
+        max_rows: int = SNAPSHOT_FLUSH_ROWS,
+        max_delay_ms: float = SNAPSHOT_FLUSH_DELAY_MS,
+    ):
+        self.insert_rows = insert_rows
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max(0.0, max_delay_ms) / 1000.0
+
+        self._pending: Deque[_Pending] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._insert_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._flushing = 0  # строк во время INSERT
+
+        # метрики
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.errors = 0
+        self.full_flushes = 0  # ушли по max_rows, а не по времени
+        self._size_hist: Counter = Counter()
+        self._flush_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)   # длительность INSERT
+        self._delay_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)   # постановка → запись
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            # примитивы создаём в работающем loop'е, а не при импорте
+            self._wakeup = asyncio.Event()
+            self._insert_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    def add(self, row: Dict[str, Any]) -> asyncio.Future:
+        """Ставит строку в буфер. Future завершается, когда строка записана."""
+        self._ensure_started()
+        fut = asyncio.get_running_loop().create_future()
+        # ошибка увидится в логе и метриках, даже если future никто не ждёт
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._pending.append((row, fut, time.perf_counter()))
+        self._wakeup.set()
+        return fut
+
+    async def _loop(self) -> None:
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # задержка считается от самой старой строки, а не от начала итерации
+            deadline = self._pending[0][2] + self.max_delay
+            while len(self._pending) < self.max_rows and not self._closing:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush_batch()
+
+    async def _flush_batch(self) -> None:
+        async with self._insert_lock:
+            await self._insert_batch()
+
+    async def _insert_batch(self) -> None:
+        batch: List[_Pending] = []
+        while self._pending and len(batch) < self.max_rows:
+            batch.append(self._pending.popleft())
+        if not batch:
+            return
+
+        self._flushing = len(batch)
+        t0 = time.perf_counter()
+        try:
+            await run_db(self.insert_rows, [row for row, _, _ in batch])
+        except Exception as e:
+            self.errors += 1
+            self.rows_failed += len(batch)
+            print(f"Snapshot buffer: INSERT {len(batch)} строк не удался: {e}")
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            self.rows_written += len(batch)
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_result(None)
+        finally:
+            self._flushing = 0
+
+        t1 = time.perf_counter()
+        n = len(batch)
+        self.flushes += 1
+        if n >= self.max_rows:
+            self.full_flushes += 1
+        self._size_hist[size_bucket(n)] += 1
+        self._flush_ms.append((t1 - t0) * 1000)
+        for _, _, enq in batch:
+            self._delay_ms.append((t1 - enq) * 1000)
+
+    async def flush(self) -> None:
+        """Записывает всё, что накоплено, не дожидаясь max_rows / max_delay_ms."""
+        if not self._pending:
+            return
+        self._ensure_started()
+        while self._pending:
+            await self._flush_batch()
+
+    async def close(self) -> None:
+        """
+        Дописывает остаток и останавливает фоновый цикл (shutdown).
+        Цикл не отменяется посреди INSERT — он сам выходит, когда буфер пуст.
+        """
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            self._wakeup.set()
+            await self._task
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_rows": self.max_rows,
+            "max_delay_ms": round(self.max_delay * 1000, 3),
+            "buffered_rows": len(self._pending),
+            "flushing_rows": self._flushing,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "errors": self.errors,
+            "full_flushes": self.full_flushes,
+            "avg_flush_size": round((self.rows_written + self.rows_failed) / self.flushes, 2) if self.flushes else None,
+            "flush_size_hist": dict(sorted(self._size_hist.items(), key=lambda kv: int(kv[0].split("-")[0]))),
+            "flush_ms": percentiles(self._flush_ms),
+            "row_delay_ms": percentiles(self._delay_ms),
+        }
@@ -1,12 +1,15 @@
 # app/schemas/register.py
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
 class RegisterInput(BaseModel):
+    # Фото: base64 из JSON или сырые байты из бинарной загрузки (одно из двух)
+    photos_base64: Optional[str] = None
+    photo_bytes: Optional[bytes] = Field(None, exclude=True, repr=False)
+
     # Обязательные данные
-    photos_base64: str
     full_name: str
     passport: str
     sex: int  # 1 или 2
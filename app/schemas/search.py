@@ -0,0 +1,37 @@
+# app/schemas/search.py
+
+from datetime import date
+from typing import List, Optional, Union
+
+from pydantic import BaseModel, field_validator
+
+
+class SearchFilters(BaseModel):
+    """
+    Ограничение кандидатов поиска по атрибутам face_snapshots.
+    Значения внутри списка — ИЛИ, разные поля — И; границы дат включительно.
+    """
+
+    citizenship: Optional[List[str]] = None
+    visa_type: Optional[List[str]] = None
+    entry_date_from: Optional[date] = None
+    entry_date_to: Optional[date] = None
+    exit_date_from: Optional[date] = None
+    exit_date_to: Optional[date] = None
+
+    model_config = {"extra": "forbid"}
+
+    @field_validator("citizenship", "visa_type", mode="before")
+    @classmethod
+    def split_values(cls, v: Union[None, str, List[str]]):
+        # одно значение строкой или через запятую ("UZB,KAZ") — как список
+        if isinstance(v, str):
+            v = v.split(",")
+        if v is None:
+            return None
+        values = [str(x).strip() for x in v if str(x).strip()]
+        return values or None
+
+    @property
+    def empty(self) -> bool:
+        return not any(getattr(self, name) is not None for name in type(self).model_fields)
@@ -0,0 +1,372 @@
+# app/services/ann_index.py
+from __future__ import annotations
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import (
+    ANN_BACKEND,
+    IVF_NLIST,
+    IVF_NPROBE,
+    IVF_TRAIN_SAMPLE,
+    IVF_KMEANS_ITERS,
+    IVF_MIN_ROWS,
+    IVF_REBUILD_TAIL_RATIO,
+    IVF_FILTER_NPROBE_FACTOR,
+    IVF_LIST_COPY,
+)
+from app.services.quantization import QuantizedRows, as_float32
+
+_CHUNK = 65536  # строк за один GEMM при назначении кластеров
+_GATHER_CHUNK = 2048  # строк подмножества, собираемых в буфер за раз (≈ 4 МБ при dim=512)
+
+
+def exact_search(
+    embeddings: np.ndarray,
+    q: np.ndarray,
+    k: int,
+    mask: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    scores = embeddings @ q
+    if mask is not None:
+        # строки вне фильтра не могут попасть в top-k (и отсекаются любым порогом)
+        scores[~mask] = -np.inf
+    idx = top_k_desc(scores, k)
+    return idx, scores[idx]
+
+
+def exact_search_batch(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    mask: Optional[np.ndarray] = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Точный поиск для пачки запросов: матрица × матрица по кускам строк галереи,
+    чтобы не держать полную (N, M) матрицу score'ов.
+    """
+    m = queries.shape[0]
+    best_idx = [np.empty(0, dtype=np.int64) for _ in range(m)]
+    best_scores = [np.empty(0, dtype=np.float32) for _ in range(m)]
+
+    for lo in range(0, embeddings.shape[0], _CHUNK):
+        scores = embeddings[lo:lo + _CHUNK] @ queries.T  # (chunk, M)
+        if mask is not None:
+            scores[~mask[lo:lo + _CHUNK]] = -np.inf
+        for j in range(m):
+            top = top_k_desc(scores[:, j], k)
+            idx = np.concatenate((best_idx[j], top + lo))
+            sc = np.concatenate((best_scores[j], scores[top, j]))
+            keep = top_k_desc(sc, k)
+            best_idx[j], best_scores[j] = idx[keep], sc[keep]
+
+    return list(zip(best_idx, best_scores))
+
+
+def subset_search(
+    embeddings: np.ndarray,
+    rows: np.ndarray,
+    q: np.ndarray,
+    k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Точный поиск только по строкам rows (номера строк галереи).
+    float32-строки собираются кусками в один буфер — без копии всего подмножества.
+    """
+    if isinstance(embeddings, QuantizedRows):
+        scores = embeddings[rows] @ q
+    else:
+        scores = np.empty(rows.shape[0], dtype=np.float32)
+        scratch = np.empty((min(rows.shape[0], _GATHER_CHUNK), embeddings.shape[1]), dtype=np.float32)
+        for lo in range(0, rows.shape[0], _GATHER_CHUNK):
+            part = rows[lo:lo + _GATHER_CHUNK]
+            block = scratch[:part.shape[0]]
+            np.take(embeddings, part, axis=0, out=block)
+            scores[lo:lo + part.shape[0]] = block @ q
+    idx = top_k_desc(scores, k)
+    return rows[idx], scores[idx]
+
+
+def top_k_desc(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Индексы k наибольших значений по убыванию (argpartition + сортировка только k).
+    """
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if n > k:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+# ────────────────────────────────────────────────
+# Точный поиск (brute force)
+# ────────────────────────────────────────────────
+class ExactBackend:
+    name = "exact"
+    ready = True
+
+    def reset(self) -> None:
+        pass
+
+    def scan_rows(self, n: int, filtered: bool = False) -> int:
+        return n
+
+    def build(self, embeddings: np.ndarray) -> None:
+        pass
+
+    def add(self, start: int, embeddings: np.ndarray) -> bool:
+        return False
+
+    def rebuild_async(self, embeddings: np.ndarray) -> None:
+        pass
+
+    def search(self, embeddings: np.ndarray, q: np.ndarray, k: int, mask=None) -> Tuple[np.ndarray, np.ndarray]:
+        return exact_search(embeddings, q, k, mask)
+
+    def search_batch(self, embeddings: np.ndarray, queries: np.ndarray, k: int, mask=None):
+        return exact_search_batch(embeddings, queries, k, mask)
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+# ────────────────────────────────────────────────
+# IVF-Flat: k-means разбиение + просмотр nprobe ближайших списков
+# ────────────────────────────────────────────────
+class IVFBackend:
+    """
+    Inverted file index поверх нормированных embedding'ов.
+
+    Списки — перестановка строк общей матрицы (rows, offsets): номера строк
+    каждого списка лежат непрерывным срезом, сами векторы не копируются —
+    матрица галереи (в т.ч. mmap-снимок, общий для воркеров) остаётся одна.
+    Запрос собирает строки nprobe списков из матрицы и скорит их одним GEMV.
+
+    list_copy (IVF_LIST_COPY) — держать копию строк, упорядоченную по спискам:
+    каждый список — непрерывный срез, скан без сборки, но ещё одна галерея
+    в памяти процесса (для компактных строк — в том же формате).
+
+    Строки, дописанные после построения, лежат в «хвосте» и сканируются точно;
+    когда хвост превышает rebuild_tail_ratio, индекс перестраивается в фоне.
+    Пока индекс не построен (или строк меньше min_rows) — точный поиск.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        nlist: int = IVF_NLIST,
+        nprobe: int = IVF_NPROBE,
+        train_sample: int = IVF_TRAIN_SAMPLE,
+        kmeans_iters: int = IVF_KMEANS_ITERS,
+        min_rows: int = IVF_MIN_ROWS,
+        rebuild_tail_ratio: float = IVF_REBUILD_TAIL_RATIO,
+        list_copy: bool = IVF_LIST_COPY,
+        seed: int = 0,
+    ):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self.kmeans_iters = kmeans_iters
+        self.min_rows = min_rows
+        self.rebuild_tail_ratio = rebuild_tail_ratio
+        self.list_copy = list_copy
+        self.seed = seed
+
+        # (centroids, vecs | None, rows, offsets, built_n) — подменяется целиком;
+        # vecs = None — списки собираются из матрицы по rows
+        self._state: Optional[tuple] = None
+        self._building = threading.Lock()
+        # поколение матрицы: построение для устаревшей матрицы не публикуется
+        self._generation = 0
+        self.build_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._state is not None
+
+    # ── построение ──
+    def reset(self) -> None:
+        self._generation += 1
+        self._state = None
+
+    def scan_rows(self, n: int, filtered: bool = False) -> int:
+        """
+        Сколько строк в среднем просматривает один запрос (nprobe списков + хвост);
+        filtered — с маской, когда nprobe расширяется до IVF_FILTER_NPROBE_FACTOR раз.
+        """
+        state = self._state
+        if state is None:
+            return n
+        nlist, built_n = state[0].shape[0], state[4]
+        nprobe = self.nprobe * (IVF_FILTER_NPROBE_FACTOR if filtered else 1.0)
+        return int(built_n * min(nprobe, nlist) / nlist) + max(0, n - built_n)
+
+    def _nlist_for(self, n: int) -> int:
+        if self.nlist > 0:
+            return min(self.nlist, n)
+        return max(1, min(n, int(4 * np.sqrt(n))))
+
+    def _kmeans(self, sample: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iters):
+            assign = _assign(sample, centroids)
+            counts = np.bincount(assign, minlength=nlist)
+
+            # суммы по кластерам: сортировка + reduceat вместо медленного np.add.at
+            order = np.argsort(assign, kind="stable")
+            nonempty = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+            sums = np.zeros_like(centroids)
+            sums[nonempty] = np.add.reduceat(sample[order], starts, axis=0)
+
+            # пустые кластеры пересеиваем случайными точками
+            empty = np.flatnonzero(counts == 0)
+            if empty.size:
+                sums[empty] = sample[rng.choice(sample.shape[0], empty.size, replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0.0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        return centroids
+
+    def build(self, embeddings: np.ndarray) -> None:
+        n = embeddings.shape[0]
+        if n < self.min_rows:
+            self._state = None
+            return
+
+        generation = self._generation
+        with self._building:
+            t0 = time.perf_counter()
+            rng = np.random.default_rng(self.seed)
+            nlist = self._nlist_for(n)
+
+            m = min(n, max(self.train_sample, 39 * nlist))
+            sample = embeddings[np.sort(rng.choice(n, m, replace=False))] if m < n else embeddings
+            # k-means — по float32-выборке, даже если строки хранятся компактно
+            centroids = self._kmeans(np.ascontiguousarray(as_float32(sample)), nlist, rng)
+
+            assign = _assign(embeddings, centroids)
+            rows = np.argsort(assign, kind="stable")
+            offsets = np.zeros(nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+            vecs = None
+            if self.list_copy:
+                vecs = embeddings[rows] if isinstance(embeddings, QuantizedRows) else np.ascontiguousarray(embeddings[rows])
+
+            if generation != self._generation:
+                return
+            self._state = (centroids, vecs, rows, offsets, n)
+            self.build_seconds = time.perf_counter() - t0
+
+    def add(self, start: int, embeddings: np.ndarray) -> bool:
+        """
+        Новые строки попадают в хвост. Возвращает True, если пора перестроить индекс.
+        """
+        state = self._state
+        if state is None:
+            return start + embeddings.shape[0] >= self.min_rows
+        built_n = state[4]
+        tail = start + embeddings.shape[0] - built_n
+        return tail > self.rebuild_tail_ratio * built_n
+
+    def rebuild_async(self, embeddings: np.ndarray) -> None:
+        if self._building.locked():
+            return
+        threading.Thread(target=self.build, args=(embeddings,), daemon=True).start()
+
+    # ── поиск ──
+    def search(self, embeddings: np.ndarray, q: np.ndarray, k: int, mask=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        mask — булева маска строк (фильтры поиска): строки вне маски
+        отбрасываются из просмотренных списков до выбора top-k.
+        """
+        state = self._state
+        if state is None:
+            return exact_search(embeddings, q, k, mask)
+
+        centroids, vecs, rows, offsets, built_n = state
+        nprobe = self.nprobe
+        if mask is not None:
+            # в просмотренных списках проходит лишь доля строк — смотрим больше списков
+            selectivity = max(float(np.count_nonzero(mask)) / max(mask.shape[0], 1), 1e-9)
+            nprobe = int(np.ceil(nprobe * min(1.0 / selectivity, IVF_FILTER_NPROBE_FACTOR)))
+        nprobe = min(nprobe, centroids.shape[0])
+        probes = top_k_desc(centroids @ q, nprobe)
+
+        parts_idx, parts_scores = [], []
+        if vecs is None:
+            # строки просмотренных списков — из общей матрицы, одной выборкой;
+            # отфильтрованные маской не собираются вовсе
+            cand = np.concatenate([rows[offsets[p]:offsets[p + 1]] for p in probes])
+            if mask is not None:
+                cand = cand[mask[cand]]
+            if cand.size:
+                parts_idx.append(cand)
+                parts_scores.append(embeddings[cand] @ q)
+        else:
+            for p in probes:
+                lo, hi = offsets[p], offsets[p + 1]
+                if hi > lo:
+                    parts_idx.append(rows[lo:hi])
+                    parts_scores.append(vecs[lo:hi] @ q)
+
+        # хвост: строки, дописанные после построения
+        n = embeddings.shape[0]
+        if n > built_n:
+            parts_idx.append(np.arange(built_n, n))
+            parts_scores.append(embeddings[built_n:n] @ q)
+
+        if not parts_idx:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        cand = np.concatenate(parts_idx)
+        scores = np.concatenate(parts_scores)
+        if mask is not None:
+            keep = mask[cand]
+            cand, scores = cand[keep], scores[keep]
+        top = top_k_desc(scores, k)
+        return cand[top], scores[top]
+
+    def search_batch(self, embeddings: np.ndarray, queries: np.ndarray, k: int, mask=None):
+        if self._state is None:
+            return exact_search_batch(embeddings, queries, k, mask)
+        # у каждого запроса свои списки — пакетный GEMM здесь не помогает
+        return [self.search(embeddings, q, k, mask) for q in queries]
+
+    def stats(self) -> dict:
+        state = self._state
+        return {
+            "backend": self.name,
+            "ready": state is not None,
+            "nlist": int(state[0].shape[0]) if state else None,
+            "nprobe": self.nprobe,
+            "built_rows": int(state[4]) if state else 0,
+            "list_copy": self.list_copy,
+            "index_bytes": int(sum(a.nbytes for a in state[:4] if a is not None)) if state else 0,
+            "build_seconds": round(self.build_seconds, 3),
+        }
+
+
+def _assign(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(embeddings.shape[0], dtype=np.int64)
+    for lo in range(0, embeddings.shape[0], _CHUNK):
+        hi = lo + _CHUNK
+        out[lo:hi] = np.argmax(embeddings[lo:hi] @ centroids.T, axis=1)
+    return out
+
+
+def make_backend(name: str = ANN_BACKEND):
+    if name == "exact":
+        return ExactBackend()
+    if name == "ivf":
+        return IVFBackend()
+    raise ValueError(f"Неизвестный ANN_BACKEND: {name}")
@@ -0,0 +1,157 @@
+# app/services/crop_store.py
+from __future__ import annotations
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.core.config import CROP_DIR, CROP_JPEG_QUALITY, CROP_WRITE_MAX_QUEUE, CROP_WRITE_WORKERS
+from app.core.metrics import LATENCY_WINDOW, percentiles, stage
+
+
+class CropStore:
+    """
+    Кропы лиц на диске, адресуемые содержимым.
+
+    Имя файла — blake2b пикселей кропа (и его формы): одинаковые кропы
+    (повторная регистрация того же фото) ложатся в один файл. Файлы
+    разложены по двум уровням каталогов из первых байт хэша —
+    <root>/ab/cd/abcd….jpg, — чтобы ни в одном каталоге не копились
+    миллионы записей.
+
+    put() считает хэш в event loop'е (доли миллисекунды) и сразу отдаёт
+    face_url; кодирование JPEG и запись идут в фоновых потоках (cv2 и
+    файловый ввод-вывод отпускают GIL). Файл пишется во временный и
+    публикуется os.replace — читатель не увидит недописанный JPEG.
+    Пока запись в полёте, строка в БД уже может ссылаться на face_url.
+
+    Очередь ограничена max_queue: сверх неё put() ждёт записи своего
+    кропа — обратное давление на регистрацию вместо роста памяти.
+    Ошибка записи не роняет регистрацию: она в логе и в stats()["errors"].
+    """
+
+    def __init__(
+        self,
+        root: str = CROP_DIR,
+        quality: int = CROP_JPEG_QUALITY,
+        workers: int = CROP_WRITE_WORKERS,
+        max_queue: int = CROP_WRITE_MAX_QUEUE,
+    ):
+        self.root = root
+        self.quality = quality
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crop-write")
+        self._pending: Dict[str, asyncio.Future] = {}  # хэш → запись в полёте
+
+        # метрики
+        self.written = 0
+        self.deduplicated = 0   # файл уже был на диске или в очереди
+        self.errors = 0
+        self.waited = 0         # put() ждал записи из-за переполненной очереди
+        self.bytes_written = 0
+        self._write_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)   # кодирование + запись
+        self._delay_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)   # постановка → файл на диске
+
+    @staticmethod
+    def digest(crop: np.ndarray) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{crop.shape}{crop.dtype}".encode())
+        h.update(np.ascontiguousarray(crop).data)
+        return h.hexdigest()
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.jpg")
+
+    async def put(self, crop: np.ndarray) -> str:
+        """
+        Ставит кроп в очередь записи и возвращает face_url. crop после вызова
+        не должен меняться (пишется в фоне).
+        """
+        digest = self.digest(crop)
+        path = self.path_for(digest)
+        if digest in self._pending:
+            self.deduplicated += 1
+            return path
+
+        enqueued = time.perf_counter()
+        fut = asyncio.get_running_loop().run_in_executor(self._executor, self._write, crop, path)
+        self._pending[digest] = fut
+        fut.add_done_callback(lambda f: self._done(digest, f, enqueued))
+
+        if len(self._pending) > self.max_queue:
+            self.waited += 1
+            await asyncio.wait([fut])
+        return path
+
+    def _write(self, crop: np.ndarray, path: str) -> Optional[Tuple[int, float]]:
+        """В потоке записи. None — такой файл уже есть (дедупликация)."""
+        if os.path.exists(path):
+            return None
+        t0 = time.perf_counter()
+        with stage("crop_write"):
+            ok, buf = cv2.imencode(".jpg", crop, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            if not ok:
+                raise ValueError("cv2.imencode не смог закодировать кроп")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(buf.tobytes())
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return buf.nbytes, (time.perf_counter() - t0) * 1000
+
+    def _done(self, digest: str, fut: asyncio.Future, enqueued: float) -> None:
+        self._pending.pop(digest, None)
+        if fut.cancelled():
+            return
+        error = fut.exception()
+        if error is not None:
+            self.errors += 1
+            print(f"Crop store: кроп {digest} не записан: {error}")
+            return
+        result = fut.result()
+        if result is None:
+            self.deduplicated += 1
+            return
+        nbytes, write_ms = result
+        self.written += 1
+        self.bytes_written += nbytes
+        self._write_ms.append(write_ms)
+        self._delay_ms.append((time.perf_counter() - enqueued) * 1000)
+
+    async def flush(self) -> None:
+        """Дожидается всех поставленных записей."""
+        while self._pending:
+            await asyncio.wait(list(self._pending.values()))
+
+    async def close(self) -> None:
+        """Дописывает очередь и останавливает потоки (shutdown)."""
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": len(self._pending),
+            "written": self.written,
+            "deduplicated": self.deduplicated,
+            "errors": self.errors,
+            "waited": self.waited,
+            "written_mb": round(self.bytes_written / 2 ** 20, 2),
+            "write_ms": percentiles(self._write_ms),
+            "delay_ms": percentiles(self._delay_ms),
+        }
@@ -1,6 +1,16 @@
 # app/services/database.py
 from clickhouse_driver import Client
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import asyncio
 import os
+import threading
+import time
+
+from app.core.metrics import LATENCY_WINDOW, percentiles
 
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "localhost")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "9000"))
@@ -8,6 +18,11 @@ CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
 CLICKHOUSE_DATABASE = os.getenv("CLICKHOUSE_DATABASE", "face_id_boom")
 
+# Пул соединений на процесс
+CLICKHOUSE_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "8"))            # максимум открытых соединений
+CLICKHOUSE_POOL_TIMEOUT = float(os.getenv("CLICKHOUSE_POOL_TIMEOUT", "10"))   # сек ожидания свободного
+CLICKHOUSE_POOL_PING_AFTER = float(os.getenv("CLICKHOUSE_POOL_PING_AFTER", "30"))  # проверять простоявшее дольше, сек
+
 def get_clickhouse_client():
     return Client(
         host=CLICKHOUSE_HOST,
@@ -15,5 +30,219 @@ def get_clickhouse_client():
         user=CLICKHOUSE_USER,
         password=CLICKHOUSE_PASSWORD,
         database=CLICKHOUSE_DATABASE
-        # settings={'use_numpy': True}  ← закомментировать или удалить
-    )
\ No newline at end of file
+        # use_numpy не включаем: Array-колонки он всё равно читает в Python-объекты
+        # (и требует pandas). Галерея читается по колонкам с embedding байтами —
+        # см. FaceIdRepo.get_face_embedding_matrix
+    )
+
+
+class PoolTimeout(Exception):
+    """Все соединения заняты дольше CLICKHOUSE_POOL_TIMEOUT"""
+
+
+class ClickHousePool:
+    """
+    Ограниченный пул clickhouse_driver.Client на весь процесс.
+
+    Client не потокобезопасен, поэтому соединение выдаётся одному потоку
+    на время вызова и возвращается обратно. Новые соединения открываются
+    лениво, пока их меньше size; дальше — ожидание свободного (не дольше timeout).
+    Соединение, простоявшее дольше ping_after, перед выдачей проверяется ping'ом
+    и при необходимости переоткрывается. После сетевой ошибки драйвер сам
+    закрывает сокет — следующий вызов на этом Client переподключится.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Client] = get_clickhouse_client,
+        size: int = CLICKHOUSE_POOL_SIZE,
+        timeout: float = CLICKHOUSE_POOL_TIMEOUT,
+        ping_after: float = CLICKHOUSE_POOL_PING_AFTER,
+    ):
+        self.factory = factory
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle: Deque[Tuple[Client, float]] = deque()  # (client, когда вернули)
+        self._all: List[Client] = []
+        self._opening = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        # метрики
+        self.checkouts = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.reconnects = 0
+        self._wait_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)  # ожидание соединения
+        self._hold_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)  # соединение занято запросом
+
+    # ────────────────────────────────────────────
+    # Выдача / возврат
+    # ────────────────────────────────────────────
+    def _checkout(self) -> Client:
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        client, idle_since = None, 0.0
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO: самое «тёплое» соединение
+                    client, idle_since = self._idle.pop()
+                    break
+                if len(self._all) + self._opening < self.size:
+                    self._opening += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"Нет свободного соединения ClickHouse за {self.timeout} с")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+            self.checkouts += 1
+            self._wait_ms.append((time.perf_counter() - t0) * 1000)
+
+        if client is None:
+            try:
+                client = self.factory()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._all.append(client)
+        elif time.monotonic() - idle_since > self.ping_after:
+            self._check(client)
+
+        return client
+
+    def _check(self, client: Client) -> None:
+        connection = client.connection
+        try:
+            if connection.connected and not connection.ping():
+                raise ConnectionError("ping failed")
+        except Exception:
+            # переоткроется при следующем execute
+            self.reconnects += 1
+            client.disconnect()
+
+    def _checkin(self, client: Client) -> None:
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((client, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Client]:
+        client = self._checkout()
+        t0 = time.perf_counter()
+        try:
+            yield client
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._hold_ms.append((time.perf_counter() - t0) * 1000)
+            self._checkin(client)
+
+    def execute(self, *args, **kwargs):
+        with self.connection() as client:
+            return client.execute(*args, **kwargs)
+
+    # ────────────────────────────────────────────
+    # Старт / остановка
+    # ────────────────────────────────────────────
+    def warmup(self, n: Optional[int] = None) -> int:
+        """
+        Открывает до n соединений заранее: установка соединения уходит
+        из латентности первых запросов. Возвращает число открытых.
+        """
+        n = min(self.size, n if n is not None else self.size)
+        taken: List[Client] = []
+        try:
+            for _ in range(n):
+                client = self._checkout()
+                taken.append(client)
+                client.connection.force_connect()
+        finally:
+            for client in taken:
+                self._checkin(client)
+        return len(taken)
+
+    def close(self) -> None:
+        with self._cond:
+            clients, self._all = self._all, []
+            self._idle.clear()
+        for client in clients:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            opened = len(self._all)
+            idle = len(self._idle)
+            in_use = self._in_use
+            waiting = self._waiting
+        return {
+            "size": self.size,
+            "open": opened,
+            "idle": idle,
+            "in_use": in_use,
+            "waiting": waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+            "wait_ms": {**percentiles(self._wait_ms), "max": round(max(self._wait_ms, default=0.0), 3)},
+            "hold_ms": percentiles(self._hold_ms),
+        }
+
+
+class PooledClient:
+    """
+    То же, что Client.execute, но соединение берётся из пула на время одного
+    вызова — репозиторий можно держать одним экземпляром на процесс и звать из потоков.
+    """
+
+    def __init__(self, pool: ClickHousePool):
+        self.pool = pool
+
+    def execute(self, *args, **kwargs):
+        return self.pool.execute(*args, **kwargs)
+
+
+_pool: Optional[ClickHousePool] = None
+_pool_lock = threading.Lock()
+
+# запросы к ClickHouse — в своих потоках, не в event loop и не в общем to_thread-пуле
+db_executor = ThreadPoolExecutor(max_workers=CLICKHOUSE_POOL_SIZE, thread_name_prefix="clickhouse")
+
+
+def get_clickhouse_pool() -> ClickHousePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ClickHousePool()
+    return _pool
+
+
+def get_pooled_client() -> PooledClient:
+    return PooledClient(get_clickhouse_pool())
+
+
+async def run_db(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Блокирующий вызов репозитория в db_executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(fn, *args, **kwargs))
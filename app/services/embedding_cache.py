@@ -0,0 +1,230 @@
+# app/services/embedding_cache.py
+from __future__ import annotations
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.core.config import EMBEDDING_CACHE_MAX_MB, EMBEDDING_CACHE_TTL
+from app.services.face_pipeline import FaceEmbeddingResult, FaceMeta
+
+# ключ: (хэш байтов фото, пороги quality gates)
+CacheKey = Tuple[bytes, Tuple[Tuple[str, Any], ...]]
+Embedder = Callable[[bytes, Dict[str, Any]], Awaitable[Optional[FaceEmbeddingResult]]]
+BatchEmbedder = Callable[
+    [List[Optional[bytes]], Dict[str, Any]],
+    Awaitable[List[Union[FaceEmbeddingResult, Exception, None]]],
+]
+
+# примерная цена записи сверх embedding: ключ, FaceMeta, узел OrderedDict
+_ENTRY_OVERHEAD = 512
+# фото крупнее хэшируется в потоке, чтобы не держать event loop
+_HASH_INLINE_BYTES = 256 * 1024
+
+
+class _Entry:
+    __slots__ = ("embedding", "meta", "expires", "nbytes")
+
+    def __init__(self, embedding: Optional[np.ndarray], meta: Optional[FaceMeta], expires: float):
+        self.embedding = embedding  # None — лицо не прошло quality gates
+        self.meta = meta
+        self.expires = expires
+        self.nbytes = _ENTRY_OVERHEAD + (embedding.nbytes if embedding is not None else 0)
+
+    def result(self) -> Optional[FaceEmbeddingResult]:
+        if self.embedding is None:
+            return None
+        return FaceEmbeddingResult(embedding=self.embedding.tolist(), meta=self.meta)
+
+
+class EmbeddingCache:
+    """
+    LRU + TTL кэш embedding'ов запроса поиска по содержимому фото.
+
+    Киоски и операторские экраны часто присылают тот же кадр повторно
+    (ретрай, другой порог, тот же кадр с нескольких экранов): повтор берёт
+    embedding и FaceMeta из кэша и идёт сразу в скоринг, минуя декодирование,
+    детекцию и ArcFace. Отказ quality gates тоже кэшируется. Ключ — blake2b
+    байтов фото + пороги gates: то же фото с другими порогами считается заново.
+
+    Память ограничена max_mb (embedding float32 + оценка накладных расходов),
+    вытесняется самая давно использованная запись; запись старше ttl
+    не отдаётся. Одинаковые запросы, пришедшие одновременно, ждут один
+    общий прогон инференса. Кэш — только для event loop'а, без блокировок.
+    """
+
+    def __init__(self, max_mb: float = EMBEDDING_CACHE_MAX_MB, ttl: float = EMBEDDING_CACHE_TTL):
+        self.max_bytes = int(max(0.0, max_mb) * 1024 * 1024)
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self.nbytes = 0
+
+        # метрики
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0   # дождались прогона такого же конкурентного запроса
+        self.evictions = 0   # вытеснены по памяти
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _digest(img_bytes: bytes) -> bytes:
+        return hashlib.blake2b(img_bytes, digest_size=16).digest()
+
+    async def _key(self, img_bytes: bytes, gates: Dict[str, Any]) -> CacheKey:
+        if len(img_bytes) > _HASH_INLINE_BYTES:
+            digest = await asyncio.to_thread(self._digest, img_bytes)
+        else:
+            digest = self._digest(img_bytes)
+        return digest, tuple(sorted(gates.items()))
+
+    # ────────────────────────────────────────────
+    # Чтение / запись
+    # ────────────────────────────────────────────
+    def _get(self, key: CacheKey) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: CacheKey, result: Optional[FaceEmbeddingResult]) -> None:
+        if result is not None and not result.embedding:
+            return
+        entry = _Entry(
+            None if result is None else np.asarray(result.embedding, dtype=np.float32),
+            None if result is None else result.meta,
+            time.monotonic() + self.ttl,
+        )
+        if entry.nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key: CacheKey) -> None:
+        self.nbytes -= self._entries.pop(key).nbytes
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+    # ────────────────────────────────────────────
+    # Embedding через кэш
+    # ────────────────────────────────────────────
+    async def embed(
+        self,
+        img_bytes: bytes,
+        gates: Dict[str, Any],
+        compute: Embedder,
+    ) -> Optional[FaceEmbeddingResult]:
+        """
+        Embedding фото из кэша; промах — compute(img_bytes, gates) (обычно
+        InferencePool.embed) и запись результата. Ошибки не кэшируются.
+        """
+        if not self.enabled:
+            return await compute(img_bytes, gates)
+
+        key = await self._key(img_bytes, gates)
+        entry = self._get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry.result()
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        # ошибку получат только ждущие; без них — не «never retrieved»
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = fut
+        try:
+            result = await compute(img_bytes, gates)
+        except BaseException as e:
+            fut.set_exception(e if isinstance(e, Exception) else RuntimeError("embedding отменён"))
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        self._put(key, result)
+        fut.set_result(result)
+        return result
+
+    async def embed_batch(
+        self,
+        images: List[Optional[bytes]],
+        gates: Dict[str, Any],
+        compute: BatchEmbedder,
+    ) -> List[Union[FaceEmbeddingResult, Exception, None]]:
+        """
+        То же для пакета: из кэша — попадания, в compute (InferencePool.embed_batch)
+        одним пакетом — только промахи (и пустые позиции, как раньше).
+        """
+        if not self.enabled:
+            return await compute(images, gates)
+
+        results: List[Union[FaceEmbeddingResult, Exception, None]] = [None] * len(images)
+        keys: List[Optional[CacheKey]] = [None] * len(images)
+        todo: List[int] = []
+        first: Dict[CacheKey, int] = {}  # одинаковые фото внутри пакета считаются один раз
+        for i, img in enumerate(images):
+            if img:
+                keys[i] = await self._key(img, gates)
+                entry = self._get(keys[i])
+                if entry is not None:
+                    self.hits += 1
+                    results[i] = entry.result()
+                    continue
+                if keys[i] in first:
+                    self.coalesced += 1
+                    continue
+                first[keys[i]] = i
+                self.misses += 1
+            todo.append(i)
+
+        if todo:
+            computed = await compute([images[i] for i in todo], gates)
+            for i, result in zip(todo, computed):
+                results[i] = result
+                if keys[i] is not None and not isinstance(result, Exception):
+                    self._put(keys[i], result)
+            for i, key in enumerate(keys):
+                if key is not None and results[i] is None and first.get(key, i) != i:
+                    results[i] = results[first[key]]
+
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "max_mb": round(self.max_bytes / 1024 / 1024, 3),
+            "ttl_seconds": self.ttl,
+            "entries": len(self._entries),
+            "mb": round(self.nbytes / 1024 / 1024, 3),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,260 @@
+# app/services/face_models.py
+from __future__ import annotations
+import glob
+import json
+import os
+import os.path as osp
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.model_zoo.attribute import Attribute
+from insightface.model_zoo.inswapper import INSwapper
+from insightface.model_zoo.landmark import Landmark
+from insightface.model_zoo.model_zoo import ModelRouter, PickableInferenceSession
+from insightface.model_zoo.retinaface import RetinaFace
+from insightface.utils import ensure_available, face_align
+
+from app.core.config import MODEL_LOAD_THREADS, ONNX_CACHE_DIR, STARTUP_WARMUP, WARMUP_IMAGE
+from app.services.face_pipeline import REQUIRED_MODULES
+
+# лицо-образец для прогрева: лежит в пакете, не зависит от рабочего каталога
+DEFAULT_WARMUP_IMAGE = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), "assets", "warmup_face.jpg")
+
+
+def make_session_options(threads: int = 0) -> onnxruntime.SessionOptions:
+    """
+    threads > 0 — фиксированный бюджет intra-op потоков на сессию;
+    0 — по умолчанию ONNX Runtime (все ядра).
+    """
+    so = onnxruntime.SessionOptions()
+    if threads > 0:
+        so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+        so.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    return so
+
+
+def _route(model_file: str, session: onnxruntime.InferenceSession):
+    """
+    Тип модели по входам/выходам сессии — правила insightface ModelRouter.get_model,
+    но сессия создаётся снаружи (в т.ч. из кэша), а model_file остаётся исходным:
+    ArcFaceONNX определяет нормализацию входа по именам узлов исходного графа.
+    """
+    inputs = session.get_inputs()
+    shape = inputs[0].shape
+    if len(session.get_outputs()) >= 5:
+        return RetinaFace(model_file=model_file, session=session)
+    if shape[2] == 192 and shape[3] == 192:
+        return Landmark(model_file=model_file, session=session)
+    if shape[2] == 96 and shape[3] == 96:
+        return Attribute(model_file=model_file, session=session)
+    if len(inputs) == 2 and shape[2] == 128 and shape[3] == 128:
+        return INSwapper(model_file=model_file, session=session)
+    if shape[2] == shape[3] and shape[2] >= 112 and shape[2] % 16 == 0:
+        return ArcFaceONNX(model_file=model_file, session=session)
+    return None
+
+
+class OnnxGraphCache:
+    """
+    Каталог уже оптимизированных ONNX-графов: на старте сессия создаётся из
+    сериализованного графа, а не оптимизирует исходный заново.
+
+    Граф сохраняется с ORT_ENABLE_EXTENDED — это уровень, который ONNX Runtime
+    сериализует переносимо; аппаратно-зависимые преобразования (раскладка
+    NCHWc) сессия из кэша делает сама при загрузке, они дешёвые. Ключ записи —
+    имя, размер и mtime исходного файла, версия ONNX Runtime и провайдеры:
+    новая модель или обновлённый ORT дают новую запись.
+
+    Рядом с графом — <ключ>.json с taskname модели: ненужные пайплайну модели
+    (landmark, genderage) на следующих стартах пропускаются без создания сессии.
+    Записи пишутся через временный файл и os.replace — воркеры, стартующие
+    одновременно, не видят недописанный граф.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def key(self, onnx_file: str, providers: List[str]) -> str:
+        st = os.stat(onnx_file)
+        stem = osp.splitext(osp.basename(onnx_file))[0]
+        return f"{stem}-{st.st_size}-{int(st.st_mtime)}-ort{onnxruntime.__version__}-{'+'.join(providers)}"
+
+    def graph_path(self, key: str) -> str:
+        return osp.join(self.directory, f"{key}.onnx")
+
+    def taskname(self, key: str) -> Optional[str]:
+        """taskname из прошлого старта; None — модель ещё не встречалась (или не распознана)."""
+        try:
+            with open(osp.join(self.directory, f"{key}.json")) as f:
+                return json.load(f).get("taskname")
+        except (OSError, ValueError):
+            return None
+
+    def temp_path(self, key: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return osp.join(self.directory, f".{key}.{os.getpid()}.{threading.get_ident()}.onnx")
+
+    def publish(self, key: str, taskname: Optional[str], graph: Optional[str]) -> None:
+        """graph — временный файл с оптимизированным графом (None — граф не нужен)."""
+        if graph is not None:
+            os.replace(graph, self.graph_path(key))
+        tmp = osp.join(self.directory, f".{key}.{os.getpid()}.{threading.get_ident()}.json")
+        with open(tmp, "w") as f:
+            json.dump({"taskname": taskname}, f)
+        os.replace(tmp, osp.join(self.directory, f"{key}.json"))
+
+
+class FaceModels:
+    """
+    Замена FaceAnalysis только с нужными модулями (detection + recognition)
+    и собственными SessionOptions — FaceAnalysis не даёт передать бюджет потоков.
+    Интерфейс совместим с тем, что использует face_pipeline: det_model, models, prepare().
+
+    Сессии ONNX создаются параллельно (ONNX Runtime отпускает GIL на загрузке
+    и оптимизации графа), с cache_dir — из уже оптимизированных графов
+    (OnnxGraphCache). timings — длительность этапов старта, сек.
+    """
+
+    def __init__(
+        self,
+        name: str = 'buffalo_l',
+        root: str = '~/.insightface',
+        allowed_modules: Optional[List[str]] = None,
+        threads: int = 0,
+        providers: Optional[List[str]] = None,
+        cache_dir: str = ONNX_CACHE_DIR,
+        load_threads: int = MODEL_LOAD_THREADS,
+    ):
+        onnxruntime.set_default_logger_severity(3)
+        t0 = time.perf_counter()
+        self.allowed = allowed_modules or REQUIRED_MODULES
+        self.threads = threads
+        self.providers = providers or ['CPUExecutionProvider']
+        self.cache = OnnxGraphCache(cache_dir) if cache_dir else None
+        self.model_dir = ensure_available('models', name, root=root)
+        self.models: Dict[str, object] = {}
+        # файл модели → {seconds, source}: cache — из кэша, optimized — оптимизирован и
+        # положен в кэш, skipped — не нужен пайплайну, model — без кэша
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.timings: Dict[str, float] = {}
+
+        files = sorted(glob.glob(osp.join(self.model_dir, '*.onnx')))
+        workers = load_threads if load_threads > 0 else max(1, len(files))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onnx-load") as pool:
+            loaded = list(pool.map(self._load, files))
+
+        # порядок файлов, а не завершения потоков: при двух моделях одной задачи побеждает первая
+        for onnx_file, (model, info) in zip(files, loaded):
+            self.sessions[osp.basename(onnx_file)] = info
+            if model is None or model.taskname not in self.allowed or model.taskname in self.models:
+                continue
+            self.models[model.taskname] = model
+        self.timings["sessions"] = time.perf_counter() - t0
+
+        # не assert: под python -O проверка пропала бы, и ошибка всплыла бы на первом запросе
+        if 'detection' not in self.models:
+            raise RuntimeError(
+                f"В {self.model_dir} нет модели детекции: загружены {sorted(self.models) or 'ничего'}, "
+                f"файлы {sorted(self.sessions) or 'не найдены'}"
+            )
+        self.det_model = self.models['detection']
+
+    def _load(self, onnx_file: str) -> Tuple[Optional[object], Dict[str, Any]]:
+        t0 = time.perf_counter()
+        if self.cache is None:
+            model = ModelRouter(onnx_file).get_model(
+                providers=self.providers,
+                sess_options=make_session_options(self.threads),
+            )
+            return model, {"seconds": round(time.perf_counter() - t0, 3), "source": "model"}
+
+        key = self.cache.key(onnx_file, self.providers)
+        taskname = self.cache.taskname(key)
+        cached = self.cache.graph_path(key)
+        if taskname is not None and taskname not in self.allowed:
+            return None, {"seconds": round(time.perf_counter() - t0, 3), "source": "skipped"}
+
+        source = "cache"
+        if taskname is None or not osp.exists(cached):
+            # промах: сессия над исходным графом только ради сериализации оптимизированного
+            source = "optimized"
+            so = make_session_options(self.threads)
+            so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            so.optimized_model_filepath = self.cache.temp_path(key)
+            try:
+                probe = _route(onnx_file, onnxruntime.InferenceSession(
+                    onnx_file, sess_options=so, providers=self.providers,
+                ))
+                taskname = probe.taskname if probe is not None else None
+                keep = taskname in self.allowed
+                self.cache.publish(key, taskname, so.optimized_model_filepath if keep else None)
+            finally:
+                if osp.exists(so.optimized_model_filepath):
+                    os.remove(so.optimized_model_filepath)
+            if not keep:
+                return None, {"seconds": round(time.perf_counter() - t0, 3), "source": "skipped"}
+
+        session = PickableInferenceSession(
+            cached,
+            sess_options=make_session_options(self.threads),
+            providers=self.providers,
+        )
+        model = _route(onnx_file, session)
+        return model, {"seconds": round(time.perf_counter() - t0, 3), "source": source}
+
+    def prepare(self, ctx_id: int = 0, det_thresh: float = 0.5, det_size=(640, 640)) -> None:
+        t0 = time.perf_counter()
+        self.det_thresh = det_thresh
+        self.det_size = det_size
+        for taskname, model in self.models.items():
+            if taskname == 'detection':
+                model.prepare(ctx_id, input_size=det_size, det_thresh=det_thresh)
+            else:
+                model.prepare(ctx_id)
+        self.timings["prepare"] = time.perf_counter() - t0
+
+    def warmup(self, image_path: str = "") -> None:
+        """
+        Прогон детектора и ArcFace на лице-образце: первые Run сессий выделяют
+        арены и буферы — это должно случиться до /ready, а не на первом запросе.
+        Модели вызываются напрямую, мимо face_pipeline: прогрев не попадает
+        в метрики этапов и quality gates.
+        """
+        t0 = time.perf_counter()
+        image = cv2.imread(image_path or WARMUP_IMAGE or DEFAULT_WARMUP_IMAGE)
+        if image is None:
+            image = np.full((self.det_size[1], self.det_size[0], 3), 127, dtype=np.uint8)
+
+        bboxes, kpss = self.det_model.detect(image, max_num=0, metric='default')
+        rec_model = self.models.get('recognition')
+        if rec_model is not None:
+            size = rec_model.input_size[0]
+            if bboxes.shape[0] > 0 and kpss is not None:
+                aligned = face_align.norm_crop(image, landmark=kpss[int(np.argmax(bboxes[:, 4]))], image_size=size)
+            else:
+                aligned = cv2.resize(image, (size, size))
+            rec_model.get_feat([aligned])
+        self.timings["warmup"] = time.perf_counter() - t0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": sorted(self.models),
+            "sessions": self.sessions,
+            "cache_dir": self.cache.directory if self.cache is not None else None,
+            "timings": {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+        }
+
+
+def load_face_models(threads: int = 0) -> FaceModels:
+    models = FaceModels(name='buffalo_l', threads=threads)
+    models.prepare(ctx_id=0)
+    if STARTUP_WARMUP:
+        models.warmup()
+    return models
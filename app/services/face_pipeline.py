@@ -1,14 +1,25 @@
 # app/services/face_pipeline.py
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Sequence, Tuple, Union
 
 import cv2
 import numpy as np
 from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+
+from app.core.config import DECODE_MAX_SIDE
+from app.core.metrics import QUALITY_GATES, stage
+from app.services.utils import decode_image_bytes, decode_image_reduced, fit_max_side
 
 EMB_SIZE = 512
 
+# Модули buffalo_l, которые реально нужны пайплайну (landmark/genderage не грузим)
+REQUIRED_MODULES = ['detection', 'recognition']
+
+# причины отказа quality gates по порядку проверок (метрика faceid_quality_gate_total)
+_GATE_ORDER = ("no_face", "det_score", "face_size", "blur")
+
 @dataclass
 class FaceMeta:
     det_score: float
@@ -17,10 +28,28 @@ class FaceMeta:
     blur: float
     faces_found: int
 
+def snapshot_quality(det_score: float, blur: float, face_size: int) -> float:
+    """
+    Скор качества снимка: уверенность детектора, резкость и размер лица.
+    Им сравниваются снимки при регистрации и отбираются шаблоны галереи.
+    """
+    return (
+        (det_score * 100.0)
+        + (min(blur, 300.0) * 0.2)
+        + (min(face_size, 200) * 0.5)
+    )
+
 @dataclass
 class FaceEmbeddingResult:
     embedding: list[float]
     meta: FaceMeta
+    crop: Optional[np.ndarray] = None  # кроп лица для сохранения (по запросу)
+
+@dataclass
+class FaceCandidate:
+    aligned: np.ndarray  # выровненный кроп — вход ArcFace
+    meta: FaceMeta
+    crop: Optional[np.ndarray] = None  # кроп лица для сохранения (по запросу)
 
 def _blur_score(image_bgr: np.ndarray) -> float:
     gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
@@ -35,71 +64,256 @@ def _clamp_bbox(b: Tuple[float, float, float, float], w: int, h: int) -> Tuple[i
         max(0, min(y2, h))
     )
 
-def add_margin(image: np.ndarray, margin_ratio: float = 0.05) -> np.ndarray:
-    h, w = image.shape[:2]
-    top = bottom = int(h * margin_ratio)
-    left = right = int(w * margin_ratio)
-    color = [255, 255, 255]
-    return cv2.copyMakeBorder(image, top, bottom, left, right,
-                              borderType=cv2.BORDER_CONSTANT, value=color)
+def align_face(image: np.ndarray, landmark: np.ndarray, image_size: int) -> np.ndarray:
+    """
+    norm_crop insightface, но часть кропа за краем кадра — белая, как раньше
+    давали белые поля вокруг кадра: поле добавляется только выровненному кропу,
+    а не копией всего кадра.
+    """
+    M = face_align.estimate_norm(landmark, image_size)
+    return cv2.warpAffine(image, M, (image_size, image_size), borderValue=(255, 255, 255))
 
-def get_face_embedding_strict(
+# ────────────────────────────────────────────────
+# Поэтапный пайплайн: детекция → quality gates → выравнивание → recognition
+# ────────────────────────────────────────────────
+def detect_best_face(
     image_bgr: np.ndarray,
     face_app: FaceAnalysis,
     *,
+    scale: float = 1.0,
+    original: Optional[Callable[[], np.ndarray]] = None,
     min_det_score: float = 0.60,
     min_face_size: int = 80,
     min_blur: float = 60.0
-) -> Optional[FaceEmbeddingResult]:
+) -> Optional[FaceCandidate]:
     """
-    Извлекает лучшее лицо с жёсткими проверками качества.
-    Возвращает embedding + метаданные или None, если качество не прошло.
+    Только детектор + quality gates. Recognition не запускается:
+    возвращается выровненный кроп лучшего лица (по det_score) или None.
+
+    scale — во сколько раз image_bgr меньше исходного кадра (см. decode_image_reduced):
+    min_face_size, meta.face_size и meta.bbox — в пикселях исходного кадра.
+    original — исходный кадр (лениво): blur считается по кропу лица в исходном
+    разрешении — у уменьшенного кадра дисперсия Laplacian'а выше, и размытое
+    фото прошло бы порог. Вызывается, только если кадр уменьшен и лицо дошло
+    до проверки резкости; без original — кроп уменьшенного кадра.
     """
-    image_bgr = add_margin(image_bgr)
-    faces = face_app.get(image_bgr)
-    if not faces:
-        return None
+    h, w = image_bgr.shape[:2]
+    w0, h0 = int(round(w / scale)), int(round(h / scale))
+    frame: List[np.ndarray] = []
 
-    best_face = None
-    best_score = -1.0
+    def original_crop(bbox: Tuple[int, int, int, int]) -> np.ndarray:
+        x1, y1, x2, y2 = bbox
+        if scale == 1.0 or original is None:
+            return image_bgr[y1:y2, x1:x2]
+        if not frame:
+            with stage("decode_original"):
+                frame.append(original())
+        full = frame[0]
+        x1, y1, x2, y2 = _clamp_bbox(
+            (x1 / scale, y1 / scale, x2 / scale, y2 / scale), full.shape[1], full.shape[0],
+        )
+        return full[y1:y2, x1:x2]
 
-    h, w = image_bgr.shape[:2]
+    with stage("detect"):
+        bboxes, kpss = face_app.det_model.detect(image_bgr, max_num=0, metric='default')
+    if bboxes.shape[0] == 0 or kpss is None:
+        QUALITY_GATES.inc("no_face")
+        return None
 
-    for face in faces:
-        det_score = float(face.det_score)
-        bbox_raw = face.bbox
-        bbox = _clamp_bbox(bbox_raw, w, h)
+    best = None
+    best_score = -1.0
+    # отказ того лица, что прошло больше всех проверок: «почему фото не подошло»
+    rejected = 0
 
-        x1, y1, x2, y2 = bbox
-        face_w, face_h = x2 - x1, y2 - y1
-        face_size = min(face_w, face_h)
+    with stage("quality_gates"):
+        for i in range(bboxes.shape[0]):
+            det_score = float(bboxes[i, 4])
+            # дешёвые проверки раньше Laplacian: лицо с меньшим det_score всё равно не победит
+            if det_score <= best_score:
+                continue
+            if det_score < min_det_score:
+                rejected = max(rejected, 1)
+                continue
 
-        if face_w <= 0 or face_h <= 0:
-            continue
+            bbox = _clamp_bbox(bboxes[i, :4], w, h)
+            x1, y1, x2, y2 = bbox
+            face_w, face_h = x2 - x1, y2 - y1
+            face_size = int(round(min(face_w, face_h) / scale))
+            if face_w <= 0 or face_h <= 0 or face_size < min_face_size:
+                rejected = max(rejected, 2)
+                continue
 
-        crop = image_bgr[y1:y2, x1:x2]
-        blur = _blur_score(crop)
+            crop = original_crop(bbox)
+            if crop.size == 0:
+                rejected = max(rejected, 2)
+                continue
+            blur = _blur_score(crop)
+            if blur < min_blur:
+                rejected = max(rejected, 3)
+                continue
 
-        if (det_score >= min_det_score and
-            face_size >= min_face_size and
-            blur >= min_blur and
-            det_score > best_score):
             best_score = det_score
-            best_face = face
+            best = (i, bbox, face_size, blur)
 
-    if best_face is None:
+    if best is None:
+        QUALITY_GATES.inc(_GATE_ORDER[rejected])
         return None
+    QUALITY_GATES.inc("pass")
 
-    embedding = best_face.normed_embedding.tolist()
-    if len(embedding) != EMB_SIZE:
-        return None
+    i, bbox, face_size, blur = best
+    rec_model = face_app.models['recognition']
+    with stage("align"):
+        aligned = align_face(image_bgr, kpss[i], rec_model.input_size[0])
+
+    # в координаты исходного кадра
+    x1, y1, x2, y2 = bbox
+    bbox = _clamp_bbox((x1 / scale, y1 / scale, x2 / scale, y2 / scale), w0, h0)
 
     meta = FaceMeta(
         det_score=best_score,
         bbox=bbox,
         face_size=face_size,
         blur=blur,
-        faces_found=len(faces)
+        faces_found=int(bboxes.shape[0])
     )
+    return FaceCandidate(aligned=aligned, meta=meta)
 
-    return FaceEmbeddingResult(embedding=embedding, meta=meta)
\ No newline at end of file
+def embed_aligned(face_app: FaceAnalysis, aligned: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    ArcFace на пачке выровненных кропов одним прогоном ONNX.
+    Возвращает (N, EMB_SIZE) float32, L2-нормированные (как normed_embedding).
+    """
+    if not aligned:
+        return np.empty((0, EMB_SIZE), dtype=np.float32)
+
+    with stage("recognize"):
+        feats = face_app.models['recognition'].get_feat(list(aligned)).astype(np.float32)
+    norms = np.linalg.norm(feats, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return feats / norms
+
+# ────────────────────────────────────────────────
+# Точки входа «байты → результат» (для пула воркеров: байты дешевле пиклить, чем кадр)
+# ────────────────────────────────────────────────
+def detect_image_bytes(
+    img_bytes: bytes,
+    face_app: FaceAnalysis,
+    *,
+    with_crop: bool = False,
+    min_det_score: float = 0.60,
+    min_face_size: int = 80,
+    min_blur: float = 60.0
+) -> Optional[FaceCandidate]:
+    """
+    Декодирование + детекция + gates + выравнивание, без recognition.
+    Выровненный кроп дальше уходит в общий batch ArcFace (RecognitionBatcher).
+
+    Детектор работает на кадре не больше DECODE_MAX_SIDE. Без with_crop JPEG
+    сразу декодируется в уменьшенном разрешении (целиком — только если лицо
+    дошло до проверки резкости); с with_crop кадр декодируется целиком, а кроп
+    для сохранения режется из него по bbox исходного кадра.
+    """
+    full = None
+    with stage("decode"):
+        if with_crop:
+            full = decode_image_bytes(img_bytes)
+            img, scale = fit_max_side(full, DECODE_MAX_SIDE)
+        else:
+            img, scale = decode_image_reduced(img_bytes, DECODE_MAX_SIDE)
+
+    candidate = detect_best_face(
+        img,
+        face_app,
+        scale=scale,
+        original=(lambda: full) if full is not None else (lambda: decode_image_bytes(img_bytes)),
+        min_det_score=min_det_score,
+        min_face_size=min_face_size,
+        min_blur=min_blur,
+    )
+    if candidate is not None and with_crop:
+        x1, y1, x2, y2 = candidate.meta.bbox
+        candidate.crop = full[y1:y2, x1:x2].copy()
+    return candidate
+
+def detect_images_bytes(
+    images: Sequence[Optional[bytes]],
+    face_app: FaceAnalysis,
+    *,
+    min_det_score: float = 0.60,
+    min_face_size: int = 80,
+    min_blur: float = 60.0
+) -> List[Union[FaceCandidate, Exception, None]]:
+    """
+    Пакетный вариант detect_image_bytes. Для нераскодируемого изображения
+    на его месте — ValueError (возвращается, а не бросается).
+    """
+    out: List[Union[FaceCandidate, Exception, None]] = []
+    for b in images:
+        try:
+            if not b:
+                raise ValueError("Не удалось декодировать изображение")
+            with stage("decode"):
+                img, scale = decode_image_reduced(b, DECODE_MAX_SIDE)
+        except ValueError as e:
+            out.append(e)
+            continue
+        out.append(detect_best_face(
+            img,
+            face_app,
+            scale=scale,
+            original=lambda b=b: decode_image_bytes(b),
+            min_det_score=min_det_score,
+            min_face_size=min_face_size,
+            min_blur=min_blur,
+        ))
+    return out
+
+def embed_image_bytes(
+    img_bytes: bytes,
+    face_app: FaceAnalysis,
+    *,
+    with_crop: bool = False,
+    min_det_score: float = 0.60,
+    min_face_size: int = 80,
+    min_blur: float = 60.0
+) -> Optional[FaceEmbeddingResult]:
+    candidate = detect_image_bytes(
+        img_bytes,
+        face_app,
+        with_crop=with_crop,
+        min_det_score=min_det_score,
+        min_face_size=min_face_size,
+        min_blur=min_blur,
+    )
+    if candidate is None:
+        return None
+    embedding = embed_aligned(face_app, [candidate.aligned])[0]
+    return FaceEmbeddingResult(embedding=embedding.tolist(), meta=candidate.meta, crop=candidate.crop)
+
+def embed_images_bytes(
+    images: Sequence[Optional[bytes]],
+    face_app: FaceAnalysis,
+    *,
+    min_det_score: float = 0.60,
+    min_face_size: int = 80,
+    min_blur: float = 60.0
+) -> List[Union[FaceEmbeddingResult, Exception, None]]:
+    """
+    Пакетный вариант: детекция по каждому фото, один batch recognition.
+    Для нераскодируемого изображения на его месте — ValueError
+    (исключение возвращается, а не бросается: остальной пакет не страдает).
+    """
+    candidates = detect_images_bytes(
+        images,
+        face_app,
+        min_det_score=min_det_score,
+        min_face_size=min_face_size,
+        min_blur=min_blur,
+    )
+    chosen = [c for c in candidates if isinstance(c, FaceCandidate)]
+    feats = iter(embed_aligned(face_app, [c.aligned for c in chosen]))
+    return [
+        FaceEmbeddingResult(embedding=next(feats).tolist(), meta=c.meta)
+        if isinstance(c, FaceCandidate) else c
+        for c in candidates
+    ]
@@ -0,0 +1,310 @@
+# app/services/gallery_filters.py
+from __future__ import annotations
+from datetime import date, datetime
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import FILTER_DATE_TAIL_RATIO
+from app.schemas.search import SearchFilters
+
+CATEGORICAL = ("citizenship", "visa_type")
+DATES = ("entry_date", "exit_date")
+ATTRIBUTES = CATEGORICAL + DATES
+
+NO_DATE = int(np.iinfo(np.int32).min)  # пустая / нераспознанная дата — не входит ни в один диапазон
+MAX_DATE = int(np.iinfo(np.int32).max)
+
+
+def category_key(value: Any) -> Optional[str]:
+    """Значение citizenship / visa_type → ключ сравнения (без регистра и пробелов по краям)."""
+    if value is None:
+        return None
+    key = str(value).strip().lower()
+    return key or None
+
+
+def day_number(value: Any) -> int:
+    """Дата (date / datetime / 'YYYY-MM-DD...') → номер дня; пусто или мусор → NO_DATE."""
+    if value is None or value == "":
+        return NO_DATE
+    if isinstance(value, datetime):
+        return value.date().toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    try:
+        return date.fromisoformat(str(value).strip()[:10]).toordinal()
+    except ValueError:
+        return NO_DATE
+
+
+class _Growable:
+    """
+    Одномерный массив с запасом ёмкости. values — опубликованный срез:
+    дозапись пишет за его пределы, читатели со старой ссылкой её не видят.
+    """
+
+    __slots__ = ("_buf", "values")
+
+    def __init__(self, dtype=np.int32):
+        self._buf = np.empty(0, dtype=dtype)
+        self.values = self._buf
+
+    def extend(self, values: np.ndarray) -> None:
+        n, k = self.values.shape[0], values.shape[0]
+        if n + k > self._buf.shape[0]:
+            buf = np.empty(max(n + k, 2 * self._buf.shape[0], 16), dtype=self._buf.dtype)
+            buf[:n] = self.values
+            self._buf = buf
+        self._buf[n:n + k] = values
+        self.values = self._buf[:n + k]
+
+
+class _CategoryColumn:
+    """
+    Код значения на строку (0 — пусто) + заранее собранные списки строк
+    на каждое значение (posting lists, по возрастанию номера строки).
+    """
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.codes = _Growable(np.int32)
+        self.postings: List[_Growable] = [_Growable(np.int32)]  # [0] — пустые значения
+
+    def extend(self, values: Sequence[Any], start: int) -> None:
+        codes = np.empty(len(values), dtype=np.int32)
+        cache: Dict[Any, int] = {}
+        for i, v in enumerate(values):
+            code = cache.get(v)
+            if code is None:
+                key = category_key(v)
+                code = 0 if key is None else self.vocab.setdefault(key, len(self.vocab) + 1)
+                if code == len(self.postings):
+                    self.postings.append(_Growable(np.int32))
+                cache[v] = code
+            codes[i] = code
+        self._add_codes(codes, start)
+
+    def _add_codes(self, codes: np.ndarray, start: int) -> None:
+        # группировка строк по коду одной сортировкой
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        for chunk in np.split(order, bounds):
+            if chunk.size:
+                self.postings[codes[chunk[0]]].extend((chunk + start).astype(np.int32))
+        self.codes.extend(codes)
+
+    def take(self, rows: np.ndarray) -> "_CategoryColumn":
+        """Колонка только из строк rows (перенумерованных с нуля), словарь — общий."""
+        column = _CategoryColumn()
+        column.vocab = dict(self.vocab)
+        column.postings = [_Growable(np.int32) for _ in self.postings]
+        column._add_codes(self.codes.values[rows], 0)
+        return column
+
+    def wanted(self, values: Sequence[str]) -> np.ndarray:
+        return np.array(
+            sorted({self.vocab[k] for k in map(category_key, values) if k in self.vocab}),
+            dtype=np.int32,
+        )
+
+    def count(self, codes: np.ndarray) -> int:
+        return sum(self.postings[c].values.shape[0] for c in codes)
+
+    def rows(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.postings[c].values for c in codes]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def match(self, rows: Optional[np.ndarray], codes: np.ndarray, n: int) -> np.ndarray:
+        column = self.codes.values[:n] if rows is None else self.codes.values[rows]
+        # таблица «код → подходит» вместо np.isin: один gather по колонке
+        lut = np.zeros(len(self.postings), dtype=bool)
+        lut[codes] = True
+        return lut[column]
+
+
+class _DateColumn:
+    """
+    Номер дня на строку + отсортированная копия (значения, строки) для
+    диапазонов через searchsorted. Дописанные строки лежат несортированным
+    хвостом и проверяются напрямую; вырос хвост — сортировка пересобирается.
+    """
+
+    def __init__(self, tail_ratio: float = FILTER_DATE_TAIL_RATIO):
+        self.tail_ratio = tail_ratio
+        self.days = _Growable(np.int32)
+        # (значения по возрастанию, номера строк, сколько строк отсортировано) — подменяется целиком
+        self._sorted: Tuple[np.ndarray, np.ndarray, int] = (
+            np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), 0,
+        )
+
+    def extend(self, values: Sequence[Any]) -> None:
+        cache: Dict[Any, int] = {}
+        days = np.empty(len(values), dtype=np.int32)
+        for i, v in enumerate(values):
+            d = cache.get(v)
+            if d is None:
+                d = cache[v] = day_number(v)
+            days[i] = d
+        self._add_days(days)
+
+    def _add_days(self, days: np.ndarray) -> None:
+        self.days.extend(days)
+
+        n, built_n = self.days.values.shape[0], self._sorted[2]
+        if n - built_n > self.tail_ratio * built_n:
+            days = self.days.values
+            order = np.argsort(days, kind="stable").astype(np.int32)
+            self._sorted = (days[order], order, n)
+
+    def take(self, rows: np.ndarray) -> "_DateColumn":
+        column = _DateColumn(self.tail_ratio)
+        column._add_days(self.days.values[rows])
+        return column
+
+    def _bounds(self, lo: int, hi: int) -> Tuple[int, int]:
+        values = self._sorted[0]
+        return int(np.searchsorted(values, lo, "left")), int(np.searchsorted(values, hi, "right"))
+
+    def count(self, lo: int, hi: int, n: int) -> int:
+        a, b = self._bounds(lo, hi)
+        # хвост не отсортирован — считаем его целиком (верхняя оценка)
+        return b - a + max(0, n - self._sorted[2])
+
+    def rows(self, lo: int, hi: int, n: int) -> np.ndarray:
+        values, order, built_n = self._sorted
+        a, b = self._bounds(lo, hi)
+        rows = order[a:b]
+        if built_n > n:
+            rows = rows[rows < n]
+        elif built_n < n:
+            tail = self.days.values[built_n:n]
+            hit = np.flatnonzero((tail >= lo) & (tail <= hi)).astype(np.int32) + built_n
+            rows = np.concatenate((rows, hit))
+        return np.sort(rows)
+
+    def match(self, rows: Optional[np.ndarray], lo: int, hi: int, n: int) -> np.ndarray:
+        column = self.days.values[:n] if rows is None else self.days.values[rows]
+        return (column >= lo) & (column <= hi)
+
+
+class AttributeIndex:
+    """
+    Атрибуты строк галереи (citizenship, visa_type, entry_date, exit_date)
+    в порядке строк GalleryIndex + заранее собранные структуры отбора:
+    списки строк на значение для категорий, отсортированные массивы для дат.
+
+    select() берёт самый избирательный фильтр как источник строк, остальные
+    проверяет по колонкам только на этих строках — стоимость пропорциональна
+    размеру подмножества, а не галереи.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.categories = {name: _CategoryColumn() for name in CATEGORICAL}
+        self.dates = {name: _DateColumn() for name in DATES}
+
+    def extend(self, attributes: Optional[Mapping[str, Sequence[Any]]], k: int) -> None:
+        """Дописывает атрибуты k новых строк (нет колонки — значения пустые)."""
+        attributes = attributes or {}
+        for name, column in self.categories.items():
+            column.extend(attributes.get(name) or [None] * k, self.size)
+        for name, column in self.dates.items():
+            column.extend(attributes.get(name) or [None] * k)
+        self.size += k
+
+    def take(self, rows: np.ndarray) -> "AttributeIndex":
+        """Индекс только строк rows (по возрастанию) — для уплотнения галереи."""
+        out = AttributeIndex()
+        out.size = int(rows.shape[0])
+        out.categories = {name: c.take(rows) for name, c in self.categories.items()}
+        out.dates = {name: c.take(rows) for name, c in self.dates.items()}
+        return out
+
+    def export(self, n: int, rows: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """
+        Колонки строк [0, n) (или только rows) для снимка галереи на диске:
+        коды категорий + словари (ключ кода c — vocab[c - 1]) и номера дней.
+        """
+        def pick(values: np.ndarray) -> np.ndarray:
+            values = values[:n]
+            return values if rows is None else values[rows]
+
+        return {
+            "vocab": {name: list(c.vocab) for name, c in self.categories.items()},
+            "columns": {
+                **{name: pick(c.codes.values) for name, c in self.categories.items()},
+                **{name: pick(c.days.values) for name, c in self.dates.items()},
+            },
+        }
+
+    @classmethod
+    def restore(cls, vocab: Mapping[str, Sequence[str]], columns: Mapping[str, np.ndarray]) -> "AttributeIndex":
+        """Обратно к export: структуры отбора собираются по готовым кодам, без разбора значений."""
+        out = cls()
+        for name, column in out.categories.items():
+            column.vocab = {key: code for code, key in enumerate(vocab.get(name, ()), 1)}
+            column.postings = [_Growable(np.int32) for _ in range(len(column.vocab) + 1)]
+            column._add_codes(np.asarray(columns[name], dtype=np.int32), 0)
+        for name, column in out.dates.items():
+            column._add_days(np.asarray(columns[name], dtype=np.int32))
+        out.size = int(np.asarray(columns[CATEGORICAL[0]]).shape[0])
+        return out
+
+    def select(self, filters: SearchFilters, n: int, max_rows: int) -> np.ndarray:
+        """
+        Строки [0, n), проходящие все фильтры. Если их заведомо не больше
+        max_rows — отсортированные номера строк, иначе булева маска длины n.
+        """
+        # (оценка размера, строки источника, проверка на строках / на всей колонке)
+        preds = []
+        for name, column in self.categories.items():
+            values = getattr(filters, name)
+            if values is None:
+                continue
+            codes = column.wanted(values)
+            preds.append((
+                column.count(codes),
+                lambda c=column, w=codes: c.rows(w),
+                lambda rows, c=column, w=codes: c.match(rows, w, n),
+            ))
+        for name, column in self.dates.items():
+            lo, hi = getattr(filters, f"{name}_from"), getattr(filters, f"{name}_to")
+            if lo is None and hi is None:
+                continue
+            lo = NO_DATE + 1 if lo is None else day_number(lo)
+            hi = MAX_DATE if hi is None else day_number(hi)
+            preds.append((
+                column.count(lo, hi, n),
+                lambda c=column, a=lo, b=hi: c.rows(a, b, n),
+                lambda rows, c=column, a=lo, b=hi: c.match(rows, a, b, n),
+            ))
+
+        if not preds:
+            return np.ones(n, dtype=bool)
+
+        preds.sort(key=lambda p: p[0])
+        if preds[0][0] > max_rows:
+            # ни один фильтр сам по себе не мал — пересечение считаем по колонкам целиком,
+            # оно ещё может оказаться подмножеством
+            mask = np.ones(n, dtype=bool)
+            for _, _, match in preds:
+                mask &= match(None)
+            return mask if np.count_nonzero(mask) > max_rows else np.flatnonzero(mask)
+
+        rows = preds[0][1]()
+        rows = rows[:np.searchsorted(rows, n)]  # строки, дописанные после снимка читателя
+        for _, _, match in preds[1:]:
+            if rows.size == 0:
+                break
+            rows = rows[match(rows)]
+        return rows.astype(np.int64)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows": self.size,
+            **{f"{name}_values": len(c.vocab) for name, c in self.categories.items()},
+        }
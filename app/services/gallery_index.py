@@ -0,0 +1,724 @@
+# app/services/gallery_index.py
+from __future__ import annotations
+import threading
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.core.config import (
+    FILTER_SUBSET_RATIO,
+    GALLERY_COMPACT_RATIO,
+    GALLERY_DTYPE,
+    QUANT_RESCORE_FACTOR,
+    QUANT_SCORE_SLACK,
+)
+from app.schemas.search import SearchFilters
+from app.services.face_pipeline import EMB_SIZE
+from app.services.ann_index import exact_search_batch, make_backend, subset_search
+from app.services.gallery_filters import AttributeIndex
+from app.services.gallery_templates import PersonTemplates, best_rows, group_rows
+from app.services.quantization import DTYPES, QuantizedRows, as_float32, quantize
+
+# строк float32 за один проход при сборке центроидов
+_CENTROID_CHUNK = 65536
+
+# person_id → (float32-строки всех его снимков, их snapshot_id) — точный пересчёт кандидатов
+Rescorer = Callable[[Sequence[str]], Dict[str, Tuple[np.ndarray, Sequence[int]]]]
+
+# совпадение поиска: (person_id, cosine score, snapshot_id совпавшей строки)
+Hit = Tuple[str, float, int]
+
+# колонка атрибута → значения по строкам (citizenship, visa_type, entry_date, exit_date)
+Attributes = Mapping[str, Sequence[Any]]
+
+
+def normalize_rows(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    L2-нормирует строки матрицы.
+    Возвращает (нормированные строки, маска валидных строк):
+    строки с NaN / Inf / нулевой нормой отбрасываются — как и в старом цикле поиска.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[0] == 0:
+        return np.empty((0, EMB_SIZE), dtype=np.float32), np.zeros(0, dtype=bool)
+
+    # NaN / Inf в строке делают нечисловой и её норму — без временных
+    # матриц размером с галерею (np.isfinite / np.where по всем элементам)
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+    valid = np.isfinite(norms) & (norms > 0.0)
+
+    if valid.all():
+        # обычный случай: одна новая матрица, без копии выборки строк
+        normed = embeddings / norms[:, None]
+    else:
+        normed = embeddings[valid] / norms[valid, None]
+    return np.ascontiguousarray(normed, dtype=np.float32), valid
+
+
+class GalleryIndex:
+    """
+    Резидентный индекс галереи: непрерывная float32-матрица
+    предварительно нормированных embedding'ов + параллельный массив person_id.
+    Поиск — одно произведение матрица × вектор и argpartition для top-k,
+    либо ANN-бэкенд (IVF) поверх той же матрицы — см. ANN_BACKEND.
+
+    dtype = float16 / int8 — строки хранятся компактно (QuantizedRows, в 2 / 4 раза
+    меньше памяти). Тогда поиск отбирает top_k · QUANT_RESCORE_FACTOR кандидатов
+    по приближённым score'ам, а rescore (float32-строки из БД) точно пересчитывает
+    их и оставляет лучший снимок на человека.
+
+    filters (SearchFilters) ограничивают кандидатов до скоринга: AttributeIndex
+    отдаёт строки подмножества — если их меньше FILTER_SUBSET_RATIO от строк,
+    которые просмотрел бы бэкенд, скорятся только они, иначе поиск бэкендом с маской.
+
+    templates (PersonTemplates, GALLERY_TEMPLATES) — сколько строк на человека:
+    лучшие снимки по quality_score или один центроид. Строка, вытесненная более
+    качественным снимком, выводится из поиска маской живых строк; когда таких
+    больше GALLERY_COMPACT_RATIO, compact() пересобирает матрицу без них.
+    Поиск возвращает одну строку на человека — лучшую, вместе с её snapshot_id:
+    метаданные ответа — этого снимка, а не последнего снимка человека.
+    У центроида snapshot_id — последнего снимка (он же источник атрибутов).
+    """
+
+    def __init__(
+        self,
+        dim: int = EMB_SIZE,
+        backend=None,
+        dtype: str = GALLERY_DTYPE,
+        rescore: Optional[Rescorer] = None,
+        templates: Optional[PersonTemplates] = None,
+    ):
+        if dtype not in DTYPES:
+            raise ValueError(f"Неизвестный GALLERY_DTYPE: {dtype}")
+        self.dim = dim
+        self.dtype = dtype
+        self.rescore = rescore
+        self.backend = backend if backend is not None else make_backend()
+        self.templates = templates if templates is not None else PersonTemplates()
+        self._lock = threading.Lock()
+        # буферы с запасом ёмкости: дозапись без копирования всей матрицы
+        self._emb_buf = np.empty((0, dim), dtype=np.int8 if dtype == "int8" else dtype)
+        self._scale_buf = np.empty(0, dtype=np.float32) if dtype == "int8" else None
+        self._ids_buf = np.empty(0, dtype=object)
+        self._sid_buf = np.empty(0, dtype=np.uint64)
+        self._size = 0
+        self._attrs = AttributeIndex()
+        # живые строки; выведенные (вытесненные шаблоны) ждут compact()
+        self._alive_buf = np.ones(0, dtype=bool)
+        self._dead = 0
+        self.compactions = 0
+        # опубликованное представление (матрица, ids, атрибуты, маска живых | None,
+        # snapshot_id) — читается без блокировки
+        self._view = (self._rows(self._emb_buf, self._scale_buf), self._ids_buf, self._attrs, None, self._sid_buf)
+        self.loaded = False
+        # версия снимка на диске, чья матрица (mmap) сейчас под индексом; None — своя память
+        self.mapped_version: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        return int(self._view[0].shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._view[0].nbytes)
+
+    @property
+    def attributes(self) -> AttributeIndex:
+        return self._view[2]
+
+    @property
+    def retired(self) -> int:
+        return self._dead
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._dead > GALLERY_COMPACT_RATIO * max(self._size, 1)
+
+    @property
+    def approximate(self) -> bool:
+        return self.dtype != "float32" and self.rescore is not None
+
+    def _rows(self, codes: np.ndarray, scales: Optional[np.ndarray]):
+        return codes if self.dtype == "float32" else QuantizedRows(codes, scales)
+
+    def _prepare(self, embeddings: Union[np.ndarray, QuantizedRows]):
+        """Нормировка + перевод в формат хранения. Возвращает (codes, scales | None, valid)."""
+        if isinstance(embeddings, QuantizedRows):
+            if embeddings.kind == self.dtype:
+                # уже компактные (например, int8 прямо из ClickHouse) — без float32-копии
+                rows, valid = embeddings.normalized()
+                return rows.codes, rows.scales, valid
+            embeddings = embeddings.to_float32()
+
+        normed, valid = normalize_rows(embeddings)
+        rows = quantize(normed, self.dtype)
+        if isinstance(rows, QuantizedRows):
+            return rows.codes, rows.scales, valid
+        return rows, None, valid
+
+    # ────────────────────────────────────────────
+    # Загрузка / дозапись
+    # ────────────────────────────────────────────
+    def replace(
+        self,
+        person_ids: Sequence[str],
+        embeddings: Union[np.ndarray, QuantizedRows],
+        attributes: Optional[Attributes] = None,
+        quality: Optional[Sequence[float]] = None,
+        snapshot_ids: Optional[Sequence[int]] = None,
+    ) -> None:
+        """
+        Полная загрузка. quality — quality_score снимков (для отбора шаблонов);
+        нет — все снимки равноценны. snapshot_ids — идентификаторы строк
+        face_snapshots (нет — 0: метаданные совпадения по person_id).
+        """
+        total = len(person_ids)
+        quality = _quality(quality, total)
+        sids = _snapshot_ids(snapshot_ids, total)
+        if self.templates.mode == "centroid":
+            person_ids, embeddings, source, quality = self._centroids(person_ids, embeddings, quality)
+            attributes = _take(attributes, source)
+            sids = sids[source]
+
+        codes, scales, valid = self._prepare(embeddings)
+        rows = np.flatnonzero(valid)
+        if self.templates.mode == "best" and rows.shape[0]:
+            inv, _ = group_rows([person_ids[i] for i in rows])
+            best = best_rows(inv, quality[rows], self.templates.per_person)
+            if best.shape[0] < rows.shape[0]:
+                codes = codes[best]
+                scales = scales[best] if scales is not None else None
+                rows = rows[best]
+
+        ids = np.asarray(person_ids, dtype=object)[rows] if rows.shape[0] else np.empty(0, dtype=object)
+        view_rows = self._rows(codes, scales)
+        attrs = AttributeIndex()
+        attrs.extend(_take(attributes, rows), codes.shape[0])
+
+        with self._lock:
+            # старые номера строк бэкенда к новой матрице не относятся
+            self.backend.reset()
+            self.templates.load(ids, quality[rows], total)
+            self._install(codes, scales, ids, sids[rows], attrs)
+            self.loaded = True
+
+        # строим вне блокировки индекса: параллельные поиски до готовности идут
+        # точным сканом, а вызывающий (полная загрузка, до /ready) ждёт построения
+        self.backend.build(view_rows)
+
+    def _install(
+        self,
+        codes: np.ndarray,
+        scales: Optional[np.ndarray],
+        ids: np.ndarray,
+        sids: np.ndarray,
+        attrs: AttributeIndex,
+        size: Optional[int] = None,
+        mapped: Optional[int] = None,
+    ) -> None:
+        """
+        Новые буферы целиком (под блокировкой): полная загрузка, уплотнение или
+        снимок с диска. size — сколько строк занято (у снимка буферы с запасом).
+        """
+        n = codes.shape[0] if size is None else size
+        self._emb_buf = codes
+        self._scale_buf = scales
+        self._ids_buf = ids
+        self._sid_buf = sids
+        self._size = n
+        self._attrs = attrs
+        self._alive_buf = np.ones(codes.shape[0], dtype=bool)
+        self._dead = 0
+        self.mapped_version = mapped
+        # подменяем ссылку целиком — читатели видят либо старое, либо новое представление
+        self._view = (self._rows(codes[:n], None if scales is None else scales[:n]), ids[:n], attrs, None, sids[:n])
+
+    def load_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        """
+        Установка снимка с диска (GallerySnapshotStore.load): строки уже нормированы
+        и отобраны шаблонами, codes / scales — буферы с запасом под дозапись
+        (np.memmap copy-on-write). Матрица не копируется и не пересчитывается.
+        """
+        n = snapshot["size"]
+        codes, scales = snapshot["codes"], snapshot["scales"]
+        ids = np.empty(codes.shape[0], dtype=object)
+        ids[:n] = snapshot["ids"]
+        sids = np.zeros(codes.shape[0], dtype=np.uint64)
+        sids[:n] = snapshot["snapshot_ids"]
+
+        with self._lock:
+            self.backend.reset()
+            self.templates.load(ids[:n], snapshot["values"], snapshot["snapshots"])
+            self._install(codes, scales, ids, sids, snapshot["attributes"], size=n, mapped=snapshot["version"])
+            self.loaded = True
+            view = self._view[0]
+
+        self.backend.build(view)
+
+    def export(self) -> Dict[str, Any]:
+        """
+        Состояние для снимка на диске: строки в формате хранения, person_id,
+        атрибуты, учёт шаблонов; выведенные строки (rows) не попадают.
+        Под блокировкой снимаются только ссылки и учёт — строки [0, size)
+        опубликованных буферов не меняются, их пишут уже без блокировки.
+        """
+        with self._lock:
+            n = self._size
+            rows = np.flatnonzero(self._alive_buf[:n]) if self._dead else None
+            values = self.templates.row_values(n)
+            return {
+                "dtype": self.dtype,
+                "dim": self.dim,
+                "templates": self.templates.mode,
+                "per_person": self.templates.per_person,
+                "snapshots": self.templates.snapshots,
+                "size": n if rows is None else int(rows.shape[0]),
+                "rows": rows,
+                "codes": self._emb_buf[:n],
+                "scales": None if self._scale_buf is None else self._scale_buf[:n],
+                "ids": self._ids_buf[:n],
+                "snapshot_ids": self._sid_buf[:n],
+                "values": values if rows is None else values[rows],
+                "attributes": self._attrs.export(n, rows),
+            }
+
+    def _centroids(
+        self,
+        person_ids: Sequence[str],
+        embeddings: Union[np.ndarray, QuantizedRows],
+        quality: np.ndarray,
+    ) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Снимки → один центроид на человека: Σ w·x по нормированным снимкам,
+        w = quality_score. Кусками по _CENTROID_CHUNK строк — без float32-копии
+        всей галереи. Возвращает (person_id, центроиды, строка-источник атрибутов —
+        последний снимок человека, |Σ w·x|).
+        """
+        inv, persons = group_rows(person_ids)
+        sums = np.zeros((len(persons), self.dim), dtype=np.float32)
+        weights = np.maximum(quality, 1.0)
+        for lo in range(0, inv.shape[0], _CENTROID_CHUNK):
+            block, valid = normalize_rows(as_float32(embeddings[lo:lo + _CENTROID_CHUNK]))
+            groups = inv[lo:lo + _CENTROID_CHUNK][valid]
+            block *= weights[lo:lo + _CENTROID_CHUNK][valid, None]
+            # суммы по группам куска: сортировка + reduceat, группы в куске уникальны
+            order = np.argsort(groups, kind="stable")
+            grouped = groups[order]
+            starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]]) if grouped.size else grouped
+            if grouped.size:
+                sums[grouped[starts]] += np.add.reduceat(block[order], starts, axis=0)
+
+        last = np.zeros(len(persons), dtype=np.int64)
+        np.maximum.at(last, inv, np.arange(inv.shape[0]))
+        norms = np.linalg.norm(sums, axis=1)
+        return persons, sums, last, norms.astype(np.float32)
+
+    def append(
+        self,
+        person_ids: Sequence[str],
+        embeddings: Union[np.ndarray, QuantizedRows],
+        attributes: Optional[Attributes] = None,
+        quality: Optional[Sequence[float]] = None,
+        snapshot_ids: Optional[Sequence[int]] = None,
+    ) -> int:
+        """
+        Дописывает снимки: новые строки в конец индекса, вытесненные шаблоны
+        выводятся из поиска. Возвращает число учтённых (валидных) снимков.
+        """
+        quality = _quality(quality, len(person_ids))
+        sids = _snapshot_ids(snapshot_ids, len(person_ids))
+        if self.templates.mode == "centroid":
+            return self._append_centroids(person_ids, embeddings, attributes, quality, sids)
+
+        codes, scales, valid = self._prepare(embeddings)
+        if codes.shape[0] == 0:
+            return 0
+        rows = np.flatnonzero(valid)
+        ids = np.asarray(person_ids, dtype=object)[rows]
+
+        with self._lock:
+            keep, retire = self.templates.plan_best(ids, quality[rows], self._size)
+            if keep:
+                keep = np.asarray(keep)
+                self._write(
+                    codes[keep],
+                    scales[keep] if scales is not None else None,
+                    ids[keep],
+                    sids[rows[keep]],
+                    _take(attributes, rows[keep]),
+                    retire,
+                )
+
+        return int(rows.shape[0])
+
+    def _append_centroids(
+        self,
+        person_ids: Sequence[str],
+        embeddings: Union[np.ndarray, QuantizedRows],
+        attributes: Optional[Attributes],
+        quality: np.ndarray,
+        sids: np.ndarray,
+    ) -> int:
+        """Центроид человека: S' = c·|S| + Σ w·x новых снимков, старая строка выводится."""
+        x, valid = normalize_rows(as_float32(embeddings))
+        if x.shape[0] == 0:
+            return 0
+        rows = np.flatnonzero(valid)
+        ids = [person_ids[i] for i in rows]
+        x *= np.maximum(quality[rows], 1.0)[:, None]
+
+        groups: Dict[str, List[int]] = {}
+        for j, pid in enumerate(ids):
+            groups.setdefault(pid, []).append(j)
+
+        with self._lock:
+            persons = list(groups)
+            sums = np.stack([x[groups[pid]].sum(axis=0) for pid in persons])
+            old_rows: List[Optional[int]] = []
+            for g, pid in enumerate(persons):
+                old = self.templates.centroid_of(pid)
+                old_rows.append(None if old is None else old[1])
+                if old is not None:
+                    norm, r = old
+                    sums[g] += as_float32(self._row(r)) * norm
+            norms = np.linalg.norm(sums, axis=1)
+            codes, scales, ok = self._prepare(sums)
+            last = rows[[groups[pid][-1] for pid in persons]]
+
+            kept = [g for g in range(len(persons)) if ok[g]]
+            retire = [old_rows[g] for g in kept if old_rows[g] is not None]
+            for i, g in enumerate(kept):
+                self.templates.set_centroid(persons[g], float(norms[g]), self._size + i)
+            self.templates.snapshots += int(rows.shape[0])
+            if kept:
+                ids_new = np.asarray([persons[g] for g in kept], dtype=object)
+                self._write(codes, scales, ids_new, sids[last[ok]], _take(attributes, last[ok]), retire)
+
+        return int(rows.shape[0])
+
+    def _row(self, r: int) -> np.ndarray:
+        """Строка r как float32-вектор (для компактной галереи — раскодированная)."""
+        scales = None if self._scale_buf is None else self._scale_buf[r:r + 1]
+        return as_float32(self._rows(self._emb_buf[r:r + 1], scales))[0]
+
+    def _write(
+        self,
+        codes: np.ndarray,
+        scales: Optional[np.ndarray],
+        ids: np.ndarray,
+        sids: np.ndarray,
+        attributes: Optional[Dict[str, List[Any]]],
+        retire: Sequence[int] = (),
+    ) -> None:
+        """
+        Дописывает k строк и публикует представление (под блокировкой), затем
+        выводит строки retire: человек не пропадает из поиска ни на миг —
+        в худшем случае читатель видит и старую, и новую строку.
+        """
+        n, k = self._size, codes.shape[0]
+
+        if n + k > self._emb_buf.shape[0]:
+            capacity = max(n + k, 2 * self._emb_buf.shape[0], 1024)
+            emb_buf = np.empty((capacity, self.dim), dtype=self._emb_buf.dtype)
+            ids_buf = np.empty(capacity, dtype=object)
+            sid_buf = np.zeros(capacity, dtype=np.uint64)
+            alive_buf = np.ones(capacity, dtype=bool)
+            emb_buf[:n] = self._emb_buf[:n]
+            ids_buf[:n] = self._ids_buf[:n]
+            sid_buf[:n] = self._sid_buf[:n]
+            alive_buf[:n] = self._alive_buf[:n]
+            if self._scale_buf is not None:
+                scale_buf = np.empty(capacity, dtype=np.float32)
+                scale_buf[:n] = self._scale_buf[:n]
+                self._scale_buf = scale_buf
+            self._emb_buf, self._ids_buf, self._sid_buf, self._alive_buf = emb_buf, ids_buf, sid_buf, alive_buf
+            # запас снимка кончился — матрица теперь в памяти процесса, не в общем page cache
+            self.mapped_version = None
+
+        # пишем за пределы опубликованного среза — текущие читатели его не видят
+        self._emb_buf[n:n + k] = codes
+        self._ids_buf[n:n + k] = ids
+        self._sid_buf[n:n + k] = sids
+        self._alive_buf[n:n + k] = True
+        if self._scale_buf is not None:
+            self._scale_buf[n:n + k] = scales
+        # атрибуты — до публикации: строки [n, n + k) читатели увидят уже с ними
+        self._attrs.extend(attributes, k)
+        self._size = n + k
+        self._view = (
+            self._rows(self._emb_buf[:n + k], None if self._scale_buf is None else self._scale_buf[:n + k]),
+            self._ids_buf[:n + k],
+            self._attrs,
+            self._alive_buf[:n + k] if (self._dead or retire) else None,
+            self._sid_buf[:n + k],
+        )
+        if retire:
+            self._alive_buf[list(retire)] = False
+            self._dead += len(retire)
+        view = self._view[0]
+
+        if self.backend.add(n, self._rows(codes, scales)):
+            self.backend.rebuild_async(view)
+
+    def compact(self) -> int:
+        """
+        Пересобирает галерею без выведенных строк. Возвращает число удалённых.
+        Бэкенд перестраивается вне блокировки, как при полной загрузке.
+        """
+        with self._lock:
+            if not self._dead:
+                return 0
+            n = self._size
+            keep = np.flatnonzero(self._alive_buf[:n])
+            new_row = np.full(n, -1, dtype=np.int64)
+            new_row[keep] = np.arange(keep.shape[0])
+
+            codes = self._emb_buf[keep]
+            scales = self._scale_buf[keep] if self._scale_buf is not None else None
+            attrs = self._attrs.take(keep)
+            self.backend.reset()
+            self.templates.remap(new_row)
+            self._install(codes, scales, self._ids_buf[keep], self._sid_buf[keep], attrs)
+            self.compactions += 1
+            view = self._view[0]
+
+        self.backend.build(view)
+        return n - keep.shape[0]
+
+    def template_stats(self) -> Dict[str, Any]:
+        return {
+            **self.templates.stats(),
+            "rows": self.size,
+            "retired_rows": self._dead,
+            "compactions": self.compactions,
+        }
+
+    # ────────────────────────────────────────────
+    # Поиск
+    # ────────────────────────────────────────────
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[Hit]:
+        """
+        Возвращает до top_k совпадений (person_id, cosine score, snapshot_id)
+        с score >= threshold, отсортированных по убыванию схожести, по одному
+        на человека. filters — только строки, прошедшие фильтры.
+        """
+        view = self._view
+        embeddings, person_ids, _, _, sids = view
+        n = embeddings.shape[0]
+        if n == 0 or top_k <= 0:
+            return []
+
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        q_norm = np.linalg.norm(q)
+        if not np.isfinite(q_norm) or q_norm == 0.0:
+            return []
+        q = q / q_norm
+        selection = self._select(view, filters)
+        # несколько строк на человека: берём с запасом, чтобы после дедупликации осталось top_k
+        fanout = self.templates.fanout
+
+        if self.approximate:
+            k = top_k * QUANT_RESCORE_FACTOR
+            hits = self._persons(view, q, k, threshold - QUANT_SCORE_SLACK, selection, k * fanout)
+            return self._rescore(q[None, :], [hits], top_k, threshold)[0]
+
+        return self._persons(view, q, top_k, threshold, selection, top_k * fanout)
+
+    def search_many(
+        self,
+        queries: np.ndarray,
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[List[Hit]]:
+        """
+        Пакетный поиск: (M, dim) запросов → M списков совпадений (как у search)
+        в порядке запросов. Точный бэкенд считает всё одним GEMM.
+        filters — общие для всех запросов пакета.
+        """
+        view = self._view
+        embeddings, person_ids, _, _, sids = view
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        m = queries.shape[0]
+        if m == 0:
+            return []
+        if embeddings.shape[0] == 0 or top_k <= 0:
+            return [[] for _ in range(m)]
+
+        norms = np.linalg.norm(queries, axis=1)
+        valid = np.isfinite(norms) & (norms > 0.0)
+        results: List[List[Hit]] = [[] for _ in range(m)]
+        if not valid.any():
+            return results
+
+        q = queries[valid] / norms[valid, None]
+        k = top_k * QUANT_RESCORE_FACTOR if self.approximate else top_k
+        cutoff = threshold - QUANT_SCORE_SLACK if self.approximate else threshold
+        selection = self._select(view, filters)
+        limit = k * self.templates.fanout
+        # запросы, которым страницы пакета не хватило на k людей, добираются по одному
+        hits = [
+            self._persons(view, q[j], k, cutoff, selection, limit, found)
+            for j, found in enumerate(self._search_batch(embeddings, q, limit, selection))
+        ]
+        if self.approximate:
+            hits = self._rescore(q, hits, top_k, threshold)
+
+        for j, per_query in zip(np.flatnonzero(valid), hits):
+            results[j] = per_query
+
+        return results
+
+    def _persons(
+        self,
+        view,
+        q: np.ndarray,
+        k: int,
+        cutoff: float,
+        selection: Optional[np.ndarray],
+        limit: int,
+        found: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> List[Hit]:
+        """
+        До k людей по страницам бэкенда из limit строк. fanout — только оценка:
+        в режиме all строк на человека не ограничено, и почти одинаковые снимки
+        одного человека могут занять всю страницу. Пока людей меньше k, а
+        страница полная и её последний score не ниже cutoff, она растёт
+        вчетверо — до k людей или конца галереи. found — уже найденная
+        страница из limit строк (пакетный поиск).
+        """
+        embeddings, person_ids, _, _, sids = view
+        n = embeddings.shape[0]
+        while True:
+            idx, scores = found if found is not None else self._search_one(embeddings, q, limit, selection)
+            hits = _per_person(person_ids, sids, idx, scores, k, cutoff)
+            if len(hits) >= k or idx.shape[0] < limit or limit >= n or scores[-1] < cutoff:
+                return hits
+            limit *= 4
+            found = None
+
+    def _select(self, view, filters: Optional[SearchFilters]) -> Optional[np.ndarray]:
+        """
+        None — без фильтров и выведенных строк; иначе номера строк подмножества (int)
+        или маска (bool), см. AttributeIndex.select. Выведенные шаблоны в выборку не входят.
+        """
+        embeddings, _, attrs, alive, _ = view
+        if filters is None or filters.empty:
+            return alive
+        n = embeddings.shape[0]
+        selection = attrs.select(filters, n, int(FILTER_SUBSET_RATIO * self.backend.scan_rows(n, filtered=True)))
+        if alive is None:
+            return selection
+        if selection.dtype == bool:
+            return selection & alive
+        return selection[alive[selection]]
+
+    def _search_one(self, embeddings, q: np.ndarray, k: int, selection: Optional[np.ndarray]):
+        if selection is None:
+            return self.backend.search(embeddings, q, k)
+        if selection.dtype == bool:
+            return self.backend.search(embeddings, q, k, mask=selection)
+        # малое подмножество: скорим только его строки
+        return subset_search(embeddings, selection, q, k)
+
+    def _search_batch(self, embeddings, queries: np.ndarray, k: int, selection: Optional[np.ndarray]):
+        if selection is None:
+            return self.backend.search_batch(embeddings, queries, k)
+        if selection.dtype == bool:
+            return self.backend.search_batch(embeddings, queries, k, mask=selection)
+        if selection.size == 0:
+            return [(selection, np.empty(0, dtype=np.float32)) for _ in range(queries.shape[0])]
+        # подмножество собираем один раз на весь пакет, номера — обратно в номера галереи
+        return [
+            (selection[idx], scores)
+            for idx, scores in exact_search_batch(embeddings[selection], queries, k)
+        ]
+
+    def _rescore(
+        self,
+        queries: np.ndarray,
+        hits: List[List[Hit]],
+        top_k: int,
+        threshold: float,
+    ) -> List[List[Hit]]:
+        """
+        Точный float32-пересчёт кандидатов: одним запросом строки всех снимков
+        кандидатов, score человека — максимум по его снимкам, совпавший снимок —
+        тот, на котором максимум. Если строк нет (ещё не записаны) или БД
+        недоступна — остаются приближённый score и строка индекса.
+        """
+        exact: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        candidates = list({hit[0] for per_query in hits for hit in per_query})
+        if candidates:
+            try:
+                for pid, (rows, row_sids) in self.rescore(candidates).items():
+                    normed, valid = normalize_rows(rows)
+                    exact[pid] = (normed, np.asarray(row_sids, dtype=np.uint64)[valid])
+            except Exception as e:
+                print(f"Точный пересчёт недоступен, score приближённые: {e}")
+
+        out: List[List[Hit]] = []
+        for q, per_query in zip(queries, hits):
+            best: Dict[str, Hit] = {}
+            for pid, approx, sid in per_query:
+                hit = (pid, approx, sid)
+                rows, row_sids = exact.get(pid, (None, None))
+                if rows is not None and rows.shape[0]:
+                    scores = rows @ q
+                    top = int(np.argmax(scores))
+                    hit = (pid, float(scores[top]), int(row_sids[top]))
+                if pid not in best or hit[1] > best[pid][1]:
+                    best[pid] = hit
+            ranked = sorted(best.values(), key=lambda h: h[1], reverse=True)
+            out.append([h for h in ranked[:top_k] if h[1] >= threshold])
+        return out
+
+
+def _take(attributes: Optional[Attributes], rows: np.ndarray) -> Optional[Dict[str, List[Any]]]:
+    """Атрибуты строк rows (номера входных строк) — в том же порядке, что и строки индекса."""
+    if not attributes:
+        return None
+    # строки — возрастающее подмножество: та же длина — значит, все
+    return {
+        name: list(values) if len(rows) == len(values) else [values[i] for i in rows]
+        for name, values in attributes.items()
+    }
+
+
+def _per_person(
+    person_ids: np.ndarray,
+    sids: np.ndarray,
+    idx: np.ndarray,
+    scores: np.ndarray,
+    top_k: int,
+    cutoff: float,
+) -> List[Hit]:
+    """Кандидаты бэкенда (по убыванию score) → до top_k совпадений, лучшая строка на человека."""
+    hits: List[Hit] = []
+    seen = set()
+    for i, s in zip(idx, scores):
+        if s < cutoff or len(hits) == top_k:
+            break
+        pid = person_ids[i]
+        if pid not in seen:
+            seen.add(pid)
+            hits.append((pid, float(s), int(sids[i])))
+    return hits
+
+
+def _snapshot_ids(snapshot_ids: Optional[Sequence[int]], n: int) -> np.ndarray:
+    if snapshot_ids is None:
+        return np.zeros(n, dtype=np.uint64)
+    return np.asarray(snapshot_ids, dtype=np.uint64).reshape(n)
+
+
+def _quality(quality: Optional[Sequence[float]], n: int) -> np.ndarray:
+    if quality is None:
+        return np.zeros(n, dtype=np.float32)
+    return np.asarray(quality, dtype=np.float32).reshape(n)
@@ -0,0 +1,402 @@
+# app/services/gallery_refresher.py
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.config import (
+    GALLERY_REFRESH_INTERVAL,
+    GALLERY_REFRESH_LAG,
+    GALLERY_SNAPSHOT_INTERVAL,
+)
+from app.repositories.faceid_repo import FaceIdRepo
+from app.services.gallery_filters import ATTRIBUTES
+from app.services.face_pipeline import snapshot_quality
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_snapshot import GallerySnapshotStore
+from app.services.gallery_templates import quality_weights
+
+
+class GalleryRefresher:
+    """
+    Инкрементальное обновление GalleryIndex из ClickHouse.
+
+    Держит водяной знак по created_at и раз в interval секунд забирает
+    строки с created_at >= watermark - lag. Окно перекрытия lag ловит INSERT'ы,
+    ставшие видимыми позже строк новее их (bulk, write-behind буфер, второй
+    писатель): строка окна, уже загруженная раньше, узнаётся по snapshot_id.
+    Строки, вставленные этим же процессом, применяются сразу (apply_local)
+    и не дублируются, когда приходят из ClickHouse — сколько бы INSERT ни
+    шёл до видимости: ожидающий snapshot_id не забывается по времени.
+
+    snapshots (GallerySnapshotStore, GALLERY_SNAPSHOT_DIR) — полная загрузка
+    берёт последний снимок с диска (матрица через mmap) и догружает из
+    ClickHouse только строки новее его водяного знака. Один процесс-писатель
+    раз в snapshot_interval записывает новую версию, если галерея изменилась;
+    увидев новую версию, каждый процесс переходит на неё — воркеры снова
+    делят одну матрицу, а не держат по копии с дозаписанными строками.
+    """
+
+    def __init__(
+        self,
+        index: GalleryIndex,
+        repo_factory: Callable[[], FaceIdRepo] = FaceIdRepo,
+        interval: float = GALLERY_REFRESH_INTERVAL,
+        lag: float = GALLERY_REFRESH_LAG,
+        shard: Optional[Tuple[int, int]] = None,
+        snapshots: Optional[GallerySnapshotStore] = None,
+        snapshot_interval: float = GALLERY_SNAPSHOT_INTERVAL,
+    ):
+        self.index = index
+        self.shard = shard  # (i, n) — только строки шарда i из n (процесс-шард)
+        self.snapshots = snapshots
+        self.snapshot_interval = snapshot_interval
+        self.repo_factory = repo_factory
+        self.interval = interval
+        self.lag = timedelta(seconds=max(0.0, lag))
+        self._repo: Optional[FaceIdRepo] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.watermark: Optional[datetime] = None
+        # snapshot_id → created_at строк окна перекрытия, уже лежащих в индексе:
+        # следующий цикл вернёт их снова
+        self._seen: Dict[int, datetime] = {}
+        # snapshot_id строк, вставленных локально и ещё не пришедших из ClickHouse;
+        # снимаются приходом строки или полной загрузкой, не по времени
+        self._local: Set[int] = set()
+
+        # ── метрики свежести ──
+        self.cycles = 0
+        self.last_refresh_at: Optional[float] = None
+        self.last_cycle_rows = 0
+        self.last_cycle_seconds = 0.0
+        self.total_rows_applied = 0
+        self.local_rows_applied = 0
+        self.last_error: Optional[str] = None
+
+        # ── снимки на диске ──
+        self.snapshot_version: Optional[int] = None  # загруженная версия
+        self.snapshot_loads = 0
+        self.last_snapshot_error: Optional[str] = None
+        self._snapshot_due = 0.0  # первая запись — в первом же цикле (если снимка ещё нет)
+        self._snapshot_mark: Optional[Tuple[int, int]] = None  # счётчики строк при последней записи / загрузке
+        self._snapshot_skipped: Optional[int] = None  # версия, которая не подошла
+
+    @property
+    def repo(self) -> FaceIdRepo:
+        if self._repo is None:
+            self._repo = self.repo_factory()
+        return self._repo
+
+    @property
+    def _compact(self) -> bool:
+        # int8-галерея читает готовые int8-колонки: в 4 раза меньше трафика, без float32-копии
+        return self.index.dtype == "int8"
+
+    # ────────────────────────────────────────────
+    # Полная загрузка (один раз на процесс)
+    # ────────────────────────────────────────────
+    def full_load(self) -> int:
+        if self.snapshots is not None and self.load_snapshot():
+            # снимок есть — из ClickHouse только строки новее его водяного знака;
+            # БД недоступна — поиск уже работает по снимку, догонит фоновый цикл
+            try:
+                self.refresh_once()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Gallery catch-up after snapshot failed: {e}")
+            return self.index.size
+
+        cols = self.repo.get_face_embedding_matrix(compact=self._compact, shard=self.shard)
+        with self._lock:
+            self.index.replace(
+                cols["person_id"],
+                cols["embedding"],
+                {name: cols[name] for name in ATTRIBUTES},
+                quality_weights(cols["det_score"], cols["blur"], cols["face_size"]),
+                cols["snapshot_id"],
+            )
+            self._seen.clear()
+            self._local.clear()
+            self._advance_watermark(cols)
+            self.last_refresh_at = time.time()
+        return self.index.size
+
+    # ────────────────────────────────────────────
+    # Снимки на диске
+    # ────────────────────────────────────────────
+    def load_snapshot(self, version: Optional[int] = None) -> bool:
+        """
+        Индекс и водяной знак — из снимка (по умолчанию последнего). False —
+        снимка нет, он не читается или снят с другими параметрами галереи.
+        """
+        try:
+            snap = self.snapshots.load(version)
+        except Exception as e:
+            self.last_snapshot_error = f"load: {type(e).__name__}: {e}"
+            print(f"Снимок галереи не прочитан: {e}")
+            return False
+        if snap is None:
+            return False
+
+        meta = snap["meta"]
+        expected = {
+            "dim": self.index.dim,
+            "dtype": self.index.dtype,
+            "templates": self.index.templates.mode,
+            "per_person": self.index.templates.per_person,
+            "shard": list(self.shard) if self.shard is not None else None,
+        }
+        mismatch = {k: meta.get(k) for k, v in expected.items() if meta.get(k) != v}
+        if "seen" not in meta:
+            # снимок до snapshot_id: строки окна перекрытия не узнать — полная загрузка
+            mismatch["seen"] = None
+        if mismatch:
+            self.last_snapshot_error = f"версия {snap['version']}: другие параметры {mismatch}"
+            print(f"Снимок галереи не подходит: {self.last_snapshot_error}")
+            return False
+
+        with self._lock:
+            self.index.load_snapshot(snap)
+            self.watermark = datetime.fromisoformat(meta["watermark"]) if meta["watermark"] else None
+            self._seen = {sid: datetime.fromisoformat(ts) for sid, ts in meta["seen"]}
+            # локальные строки писателя, ещё не пришедшие из ClickHouse, — уже в снимке
+            self._local = set(meta["local"])
+            self.snapshot_version = snap["version"]
+            self.snapshot_loads += 1
+            # содержимое = снимок: писать его заново незачем, пока не придут новые строки
+            self._snapshot_mark = (self.total_rows_applied, self.local_rows_applied)
+            self.last_refresh_at = time.time()
+        print(
+            f"Gallery snapshot {snap['version']} loaded: {snap['size']} rows "
+            f"in {self.snapshots.last_load_seconds:.2f}s, watermark {meta['watermark']}"
+        )
+        return True
+
+    def maybe_write_snapshot(self) -> Optional[int]:
+        """
+        Раз в snapshot_interval: новая версия снимка, если этот процесс —
+        писатель и галерея изменилась с прошлой записи. Номер версии или None.
+        """
+        if self.snapshots is None or not self.index.loaded or time.monotonic() < self._snapshot_due:
+            return None
+        self._snapshot_due = time.monotonic() + self.snapshot_interval
+        if not self.snapshots.acquire_writer():
+            return None
+
+        with self._lock:
+            mark = (self.total_rows_applied, self.local_rows_applied)
+            if mark == self._snapshot_mark:
+                return None
+            state = self.index.export()
+            meta = {
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+                "seen": sorted([sid, ts.isoformat()] for sid, ts in self._seen.items()),
+                "local": sorted(self._local),
+                "shard": list(self.shard) if self.shard is not None else None,
+            }
+
+        # строки опубликованных буферов не меняются — пишем без блокировки
+        version = self.snapshots.write(state, meta)
+        self._snapshot_mark = mark
+        print(
+            f"Gallery snapshot {version} written: {state['size']} rows "
+            f"in {self.snapshots.last_write_seconds:.2f}s"
+        )
+        return version
+
+    def maybe_remap_snapshot(self) -> bool:
+        """Появилась версия новее загруженной — перейти на неё и догнать ClickHouse."""
+        if self.snapshots is None or not self.index.loaded:
+            return False
+        latest = self.snapshots.latest()
+        if latest is None or latest in (self.snapshot_version, self._snapshot_skipped):
+            return False
+        if not self.load_snapshot(latest):
+            # не подходит / не читается — не пробуем эту версию каждый цикл
+            self._snapshot_skipped = latest
+            return False
+        self.refresh_once()
+        return True
+
+    # ────────────────────────────────────────────
+    # Инкрементальный цикл
+    # ────────────────────────────────────────────
+    def refresh_once(self) -> int:
+        """
+        Забирает строки окна [watermark - lag, ...) и дописывает в индекс те,
+        которых в нём ещё нет. Возвращает число применённых строк.
+        """
+        if not self.index.loaded:
+            return self.full_load()
+
+        t0 = time.perf_counter()
+        since = self.watermark - self.lag if self.watermark is not None else None
+        # запрос — вне блокировки, чтобы apply_local не ждал ClickHouse
+        cols = self.repo.get_face_embedding_matrix(since=since, compact=self._compact, shard=self.shard)
+
+        with self._lock:
+            keep = []
+            for i, sid in enumerate(cols["snapshot_id"]):
+                if sid in self._seen:
+                    continue
+                # пришла строка, уже применённая apply_local: в индексе она есть
+                if sid in self._local:
+                    self._local.discard(sid)
+                    continue
+                keep.append(i)
+
+            applied = 0
+            if keep:
+                applied = self.index.append(
+                    [cols["person_id"][i] for i in keep],
+                    cols["embedding"][keep],
+                    {name: [cols[name][i] for i in keep] for name in ATTRIBUTES},
+                    quality_weights(cols["det_score"], cols["blur"], cols["face_size"])[keep],
+                    [cols["snapshot_id"][i] for i in keep],
+                )
+
+            self._advance_watermark(cols)
+
+            self.cycles += 1
+            self.last_cycle_rows = applied
+            self.total_rows_applied += applied
+            self.last_refresh_at = time.time()
+            self.last_cycle_seconds = time.perf_counter() - t0
+            self.last_error = None
+
+        # вытесненные шаблоны копятся маской; накопилось — пересобираем без них
+        if self.index.needs_compaction:
+            removed = self.index.compact()
+            print(f"Gallery compacted: {removed} retired rows removed")
+
+        return applied
+
+    def apply_local(self, snapshot: Dict[str, Any]) -> None:
+        """
+        Сразу применяет снимок, только что вставленный этим процессом:
+        человек, зарегистрированный на этом узле, находится следующим же поиском.
+        Строка узнаётся по snapshot_id — когда она придёт из ClickHouse,
+        цикл обновления её не продублирует. Без snapshot_id строку не узнать:
+        она не применяется и придёт обычным циклом.
+        """
+        sid = snapshot.get("snapshot_id")
+        if sid is None or not self.index.loaded or not snapshot.get("embedding"):
+            return
+
+        with self._lock:
+            # строку мог уже применить цикл обновления, отработавший сразу после INSERT
+            if sid in self._seen or sid in self._local:
+                return
+            added = self.index.append(
+                [snapshot.get("person_id")],
+                np.asarray([snapshot["embedding"]], dtype=np.float32),
+                {name: [snapshot.get(name)] for name in ATTRIBUTES},
+                [snapshot_quality(
+                    snapshot.get("det_score") or 0.0,
+                    snapshot.get("blur") or 0.0,
+                    snapshot.get("face_size") or 0,
+                )],
+                [sid],
+            )
+            if added:
+                self._local.add(sid)
+                self.local_rows_applied += added
+
+    def _advance_watermark(self, cols: Dict[str, Any]) -> None:
+        """
+        Сдвигает водяной знак и запоминает строки окна перекрытия; строки,
+        вышедшие из окна, забываются — набор ограничен строками последних lag секунд.
+
+        _local здесь не чистится: apply_local вызывается только после успешного
+        INSERT, так что строка придёт из ClickHouse и снимет свою запись. Запись
+        остаётся до полной загрузки, лишь если INSERT стал виден позже окна
+        перекрытия (тогда цикл его не вернёт) — это snapshot_id в множестве,
+        а не дубль в индексе.
+        """
+        created = cols["created_at"]
+        if created:
+            top = max(created)
+            if self.watermark is None or top > self.watermark:
+                self.watermark = top
+
+        if self.watermark is not None:
+            start = self.watermark - self.lag
+            self._seen.update((sid, ts) for sid, ts in zip(cols["snapshot_id"], created) if ts >= start)
+            self._seen = {sid: ts for sid, ts in self._seen.items() if ts >= start}
+
+    # ────────────────────────────────────────────
+    # Фоновая задача
+    # ────────────────────────────────────────────
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh_once)
+            except Exception as e:
+                self.last_error = str(e)
+                # репозиторий пересоздаётся через repo_factory (общий пул сам переподключается)
+                self._repo = None
+                print(f"Gallery refresh error: {e}")
+            if self.snapshots is not None:
+                try:
+                    await asyncio.to_thread(self._snapshot_cycle)
+                except Exception as e:
+                    self.last_snapshot_error = f"{type(e).__name__}: {e}"
+                    print(f"Gallery snapshot error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _snapshot_cycle(self) -> None:
+        # писатель сразу открывает свою же версию: его матрица тоже в общем page cache
+        self.maybe_write_snapshot()
+        self.maybe_remap_snapshot()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "size": self.index.size,
+            "loaded": self.index.loaded,
+            "dtype": self.index.dtype,
+            "embedding_bytes": self.index.nbytes,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "refresh_lag_seconds": (
+                round(now - self.last_refresh_at, 3) if self.last_refresh_at else None
+            ),
+            "refresh_interval_seconds": self.interval,
+            "cycles": self.cycles,
+            "last_cycle_rows": self.last_cycle_rows,
+            "last_cycle_seconds": round(self.last_cycle_seconds, 4),
+            "total_rows_applied": self.total_rows_applied,
+            "local_rows_applied": self.local_rows_applied,
+            "pending_local_rows": len(self._local),
+            "overlap_seconds": self.lag.total_seconds(),
+            "overlap_rows": len(self._seen),
+            "last_error": self.last_error,
+            "ann": self.index.backend.stats(),
+            "filters": self.index.attributes.stats(),
+            "templates": self.index.template_stats(),
+            "snapshot": None if self.snapshots is None else {
+                **self.snapshots.stats(),
+                "loaded_version": self.snapshot_version,
+                "mapped_version": self.index.mapped_version,
+                "loads": self.snapshot_loads,
+                "last_error": self.last_snapshot_error,
+            },
+        }
@@ -0,0 +1,320 @@
+# app/services/gallery_shards.py
+from __future__ import annotations
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import (
+    SEARCH_SHARDS,
+    SHARD_AUTHKEY,
+    SHARD_CONNECT_TIMEOUT,
+    SHARD_RETRY_SECONDS,
+    SHARD_TIMEOUT_MS,
+)
+from app.schemas.search import SearchFilters
+from app.services.shard_protocol import MAX_MESSAGE_BYTES, decode, encode, require_authkey
+
+Hits = List[Tuple[str, float, int]]  # (person_id, score, snapshot_id), как GalleryIndex.search
+
+
+class ShardUnavailable(RuntimeError):
+    """Шард не ответил: нет соединения, таймаут или ошибка на стороне шарда."""
+
+
+def parse_addresses(spec: str) -> List[Tuple[str, int]]:
+    """"host:port,host:port" → [(host, port), ...]; шард i — i-й адрес."""
+    addresses = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        host, _, port = part.rpartition(":")
+        addresses.append((host or "127.0.0.1", int(port)))
+    return addresses
+
+
+class ShardClient:
+    """
+    Клиент одного процесса-шарда: пул долгоживущих соединений.
+    Соединение, на котором случился таймаут или ошибка, закрывается —
+    поздний ответ не достанется следующему запросу. После отказа соединения
+    шард не опрашивается retry_seconds, чтобы не ждать connect на каждом поиске.
+    """
+
+    def __init__(
+        self,
+        shard: int,
+        address: Tuple[str, int],
+        authkey: str = SHARD_AUTHKEY,
+        connect_timeout: float = SHARD_CONNECT_TIMEOUT,
+        retry_seconds: float = SHARD_RETRY_SECONDS,
+    ):
+        self.shard = shard
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.connect_timeout = connect_timeout
+        self.retry_seconds = retry_seconds
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+
+        # метрики
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0  # запросы, пропущенные, пока шард помечен упавшим
+        self.total_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def down(self) -> bool:
+        return time.monotonic() < self._down_until
+
+    def _connect(self) -> Connection:
+        sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = Connection(sock.detach())
+        try:
+            # рукопожатие как у multiprocessing.connection.Client, но с таймаутом на ответ
+            if not conn.poll(self.connect_timeout):
+                raise TimeoutError("шард не прислал challenge")
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _acquire(self) -> Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, conn: Connection) -> None:
+        with self._lock:
+            self._idle.append(conn)
+
+    def call(self, request: bytes, timeout: float) -> Any:
+        """Синхронный вызов (в потоке): кадр запроса (shard_protocol.encode) → результат шарда или ShardUnavailable."""
+        if self.down:
+            self.skipped += 1
+            raise ShardUnavailable(f"шард {self.shard} недоступен: {self.last_error}")
+
+        self.requests += 1
+        t0 = time.perf_counter()
+        try:
+            try:
+                conn = self._acquire()
+            except (OSError, AuthenticationError) as e:
+                self._fail(None, e, mark_down=True)
+                raise ShardUnavailable(f"шард {self.shard}: {e}") from e
+
+            try:
+                conn.send_bytes(request)
+                if not conn.poll(timeout):
+                    # медленный, но живой шард: этот запрос — без него, следующий — как обычно
+                    self.timeouts += 1
+                    self._fail(conn, TimeoutError(f"нет ответа за {timeout * 1000:.0f} мс"), mark_down=False)
+                    raise ShardUnavailable(f"шард {self.shard}: {self.last_error}")
+                reply, _ = decode(conn.recv_bytes(MAX_MESSAGE_BYTES))
+            except (OSError, EOFError, ValueError) as e:
+                self._fail(conn, e, mark_down=True)
+                raise ShardUnavailable(f"шард {self.shard}: {e}") from e
+        finally:
+            self.total_ms += (time.perf_counter() - t0) * 1000
+
+        self._release(conn)
+        if reply.get("status") != "ok":
+            self.failures += 1
+            self.last_error = str(reply.get("error"))
+            raise ShardUnavailable(f"шард {self.shard}: {self.last_error}")
+        return reply.get("result")
+
+    def _fail(self, conn: Optional[Connection], error: Exception, mark_down: bool) -> None:
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        print(f"Шард {self.shard} ({self.address[0]}:{self.address[1]}): {self.last_error}")
+        if conn is not None:
+            conn.close()
+        if mark_down:
+            self._down_until = time.monotonic() + self.retry_seconds
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        answered = self.requests - self.failures
+        return {
+            "shard": self.shard,
+            "address": f"{self.address[0]}:{self.address[1]}",
+            "down": self.down,
+            "idle_connections": len(self._idle),
+            "requests": self.requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "avg_ms": round(self.total_ms / self.requests, 3) if self.requests else None,
+            "answered": answered,
+            "last_error": self.last_error,
+        }
+
+
+class ShardedGallery:
+    """
+    Координатор scatter-gather поиска по процессам-шардам (app/services/shard_server.py).
+
+    Запрос (или пакет запросов) уходит всем шардам параллельно; каждый
+    отвечает своим top_k по одной строке на человека. Человек целиком живёт
+    в одном шарде, поэтому слияние — просто top_k по score из объединения.
+
+    Шард, не ответивший за timeout_ms (или упавший), в слияние не попадает:
+    результат помечается partial, в статусе — номера таких шардов. Если не
+    ответил ни один шард — ShardUnavailable.
+    """
+
+    def __init__(
+        self,
+        addresses: Optional[Sequence[Tuple[str, int]]] = None,
+        timeout_ms: float = SHARD_TIMEOUT_MS,
+        authkey: str = SHARD_AUTHKEY,
+        connect_timeout: float = SHARD_CONNECT_TIMEOUT,
+        retry_seconds: float = SHARD_RETRY_SECONDS,
+    ):
+        addresses = list(addresses) if addresses is not None else parse_addresses(SEARCH_SHARDS)
+        if not addresses:
+            raise ValueError("SEARCH_MODE=sharded: SEARCH_SHARDS пуст")
+        self.timeout = max(0.0, timeout_ms) / 1000.0
+        self.clients = [
+            ShardClient(i, address, authkey, connect_timeout, retry_seconds)
+            for i, address in enumerate(addresses)
+        ]
+        # по потоку на шард на конкурентный запрос; поток, ждущий зависший шард,
+        # освобождается по poll(timeout)
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.clients) * 8,
+            thread_name_prefix="shard",
+        )
+
+        # метрики
+        self.searches = 0
+        self.partial = 0
+
+    @property
+    def shards(self) -> int:
+        return len(self.clients)
+
+    async def _scatter(self, request: bytes) -> List[Any]:
+        """Ответ каждого шарда на кадр request или исключение — в порядке шардов."""
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(self._executor, client.call, request, self.timeout)
+            for client in self.clients
+        ]
+        # запас сверх timeout — на соединение; дольше не ждём даже зависший connect
+        done, pending = await asyncio.wait(futures, timeout=self.timeout + SHARD_CONNECT_TIMEOUT)
+        replies: List[Any] = []
+        for client, fut in zip(self.clients, futures):
+            if fut in pending:
+                fut.cancel()
+                replies.append(ShardUnavailable(f"шард {client.shard}: нет ответа"))
+            elif fut.exception() is not None:
+                replies.append(fut.exception())
+            else:
+                replies.append(fut.result())
+        return replies
+
+    async def search_many(
+        self,
+        queries: np.ndarray,
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> Tuple[List[Hits], Dict[str, Any]]:
+        """
+        (M, dim) запросов → (M списков (person_id, score, snapshot_id), статус шардов).
+        Статус: {"shards", "answered", "failed": [номера], "partial"}.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        m = queries.shape[0]
+        replies = await self._scatter(encode(
+            {
+                "op": "search",
+                "top_k": top_k,
+                "threshold": threshold,
+                "filters": (
+                    filters.model_dump(mode="json", exclude_none=True)
+                    if filters is not None and not filters.empty else None
+                ),
+            },
+            queries,
+        ))
+
+        failed = [i for i, r in enumerate(replies) if isinstance(r, BaseException)]
+        self.searches += 1
+        if failed:
+            self.partial += 1
+        if len(failed) == self.shards:
+            raise ShardUnavailable("ни один шард не ответил")
+
+        merged: List[Hits] = []
+        for j in range(m):
+            candidates = [tuple(hit) for r in replies if not isinstance(r, BaseException) for hit in r[j]]
+            candidates.sort(key=lambda hit: hit[1], reverse=True)
+            merged.append(candidates[:top_k])
+
+        return merged, {
+            "shards": self.shards,
+            "answered": self.shards - len(failed),
+            "failed": failed,
+            "partial": bool(failed),
+        }
+
+    async def search(
+        self,
+        query: np.ndarray,
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> Tuple[Hits, Dict[str, Any]]:
+        hits, status = await self.search_many(
+            np.asarray(query, dtype=np.float32).reshape(1, -1),
+            top_k,
+            threshold,
+            filters,
+        )
+        return hits[0], status
+
+    async def ping(self) -> List[Any]:
+        """Состояние каждого шарда: ответ ping или текст ошибки."""
+        return [
+            r if not isinstance(r, BaseException) else {"shard": i, "error": str(r)}
+            for i, r in enumerate(await self._scatter(encode({"op": "ping"})))
+        ]
+
+    def close(self) -> None:
+        for client in self.clients:
+            client.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shards": self.shards,
+            "timeout_ms": round(self.timeout * 1000, 1),
+            "searches": self.searches,
+            "partial": self.partial,
+            "partial_ratio": round(self.partial / self.searches, 4) if self.searches else None,
+            "clients": [client.stats() for client in self.clients],
+        }
@@ -0,0 +1,255 @@
+# app/services/gallery_snapshot.py
+from __future__ import annotations
+import fcntl
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import GALLERY_SNAPSHOT_HEADROOM, GALLERY_SNAPSHOT_KEEP
+from app.services.gallery_filters import ATTRIBUTES, AttributeIndex
+
+_CURRENT = "CURRENT"
+_PREFIX = "gallery-"
+_MIN_HEADROOM = 1024   # строк запаса даже у маленькой галереи
+_WRITE_CHUNK = 65536   # строк за одну запись в файл
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GallerySnapshotStore:
+    """
+    Версионные снимки GalleryIndex на диске: каталог gallery-<версия>/ с .npy —
+    матрица строк в формате хранения индекса (уже нормированных и отобранных
+    шаблонами), scales для int8, person_id и snapshot_id строк, коды атрибутов, учёт шаблонов —
+    плюс meta.json (водяной знак refresher'а, словари атрибутов, параметры).
+
+    Матрица открывается np.load(mmap_mode="c"): процессы, открывшие одну
+    версию, делят её страницы в page cache. В файле есть запас строк
+    (headroom) — дозапись идёт туда копированием при записи только затронутых
+    страниц; запас кончился — матрица копируется в память процесса.
+
+    Запись атомарна: файлы пишутся во временный каталог, каталог публикуется
+    rename'ом, затем подменяется файл CURRENT. Читатель видит либо прежнюю
+    версию, либо новую целиком. Пишет один процесс на каталог (flock).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        headroom: float = GALLERY_SNAPSHOT_HEADROOM,
+        keep: int = GALLERY_SNAPSHOT_KEEP,
+    ):
+        self.directory = directory
+        self.headroom = max(0.0, headroom)
+        self.keep = max(1, keep)
+        self._writer_fd: Optional[int] = None
+
+        # метрики
+        self.writes = 0
+        self.last_write_seconds: Optional[float] = None
+        self.last_write_bytes = 0
+        self.last_load_seconds: Optional[float] = None
+
+    def _path(self, version: int) -> str:
+        return os.path.join(self.directory, f"{_PREFIX}{version:06d}")
+
+    def latest(self) -> Optional[int]:
+        """Последняя опубликованная версия (None — снимков ещё нет)."""
+        try:
+            with open(os.path.join(self.directory, _CURRENT)) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def is_writer(self) -> bool:
+        return self._writer_fd is not None
+
+    def acquire_writer(self) -> bool:
+        """
+        Писатель — один процесс на каталог (остальные воркеры только читают).
+        flock снимается сам, если процесс-писатель умер.
+        """
+        if self._writer_fd is not None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, ".writer.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._writer_fd = fd
+        return True
+
+    # ────────────────────────────────────────────
+    # Запись
+    # ────────────────────────────────────────────
+    def write(self, state: Dict[str, Any], meta: Dict[str, Any]) -> int:
+        """
+        state — GalleryIndex.export(), meta — JSON-совместимое состояние refresher'а.
+        Вызывается писателем (acquire_writer). Возвращает номер новой версии.
+        """
+        t0 = time.perf_counter()
+        # каталог без CURRENT (упали между rename и подменой CURRENT) номер не переиспользует
+        version = max([self.latest() or 0, *self.versions()]) + 1
+        # недописанные каталоги прошлых писателей (упали посреди записи)
+        for name in os.listdir(self.directory):
+            if name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        tmp = os.path.join(self.directory, f".tmp-{version}-{os.getpid()}")
+        os.makedirs(tmp)
+
+        try:
+            n, rows = state["size"], state["rows"]
+            capacity = n + max(_MIN_HEADROOM, int(n * self.headroom))
+            written = self._write_rows(os.path.join(tmp, "embeddings.npy"), state["codes"], rows, n, capacity)
+            if state["scales"] is not None:
+                written += self._write_rows(os.path.join(tmp, "scales.npy"), state["scales"], rows, n, capacity)
+
+            ids = state["ids"] if rows is None else state["ids"][rows]
+            self._save(tmp, "person_ids", np.asarray([str(pid) for pid in ids], dtype=str))
+            sids = state["snapshot_ids"] if rows is None else state["snapshot_ids"][rows]
+            self._save(tmp, "snapshot_ids", np.asarray(sids, dtype=np.uint64))
+            self._save(tmp, "values", np.asarray(state["values"], dtype=np.float32))
+            attributes = state["attributes"]
+            for name in ATTRIBUTES:
+                self._save(tmp, name, np.asarray(attributes["columns"][name], dtype=np.int32))
+
+            self._save_json(os.path.join(tmp, "meta.json"), {
+                **meta,
+                "version": version,
+                "size": n,
+                "capacity": capacity,
+                "dim": state["dim"],
+                "dtype": state["dtype"],
+                "templates": state["templates"],
+                "per_person": state["per_person"],
+                "snapshots": state["snapshots"],
+                "vocab": attributes["vocab"],
+                "written_at": datetime.now().isoformat(),
+            })
+            _fsync(tmp)
+            os.rename(tmp, self._path(version))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        # CURRENT — последним: до него новую версию никто не откроет
+        current = os.path.join(self.directory, f".{_CURRENT}.{os.getpid()}")
+        with open(current, "w") as f:
+            f.write(str(version))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current, os.path.join(self.directory, _CURRENT))
+        _fsync(self.directory)
+
+        self._prune(version)
+        self.writes += 1
+        self.last_write_seconds = time.perf_counter() - t0
+        self.last_write_bytes = written
+        return version
+
+    @staticmethod
+    def _write_rows(path: str, source: np.ndarray, rows: Optional[np.ndarray], n: int, capacity: int) -> int:
+        """Строки source (или source[rows]) в .npy на capacity строк; хвост — дыра в файле."""
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=source.dtype, shape=(capacity,) + source.shape[1:])
+        for lo in range(0, n, _WRITE_CHUNK):
+            hi = min(n, lo + _WRITE_CHUNK)
+            out[lo:hi] = source[lo:hi] if rows is None else source[rows[lo:hi]]
+        out.flush()
+        nbytes = int(out[:n].nbytes)
+        del out
+        _fsync(path)
+        return nbytes
+
+    @staticmethod
+    def _save(directory: str, name: str, array: np.ndarray) -> None:
+        path = os.path.join(directory, f"{name}.npy")
+        with open(path, "wb") as f:
+            np.save(f, array, allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _save_json(path: str, payload: Dict[str, Any]) -> None:
+        with open(path, "w") as f:
+            json.dump(payload, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _prune(self, latest: int) -> None:
+        """Старые версии — с диска; у процессов, держащих их mmap, страницы остаются до закрытия."""
+        for version in self.versions():
+            if version <= latest - self.keep:
+                shutil.rmtree(self._path(version), ignore_errors=True)
+
+    def versions(self) -> List[int]:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(
+            int(name[len(_PREFIX):]) for name in names
+            if name.startswith(_PREFIX) and name[len(_PREFIX):].isdigit()
+        )
+
+    # ────────────────────────────────────────────
+    # Чтение
+    # ────────────────────────────────────────────
+    def load(self, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Снимок для GalleryIndex.load_snapshot + meta. Матрица и scales — mmap
+        copy-on-write на capacity строк, остальное читается в память процесса.
+        """
+        version = self.latest() if version is None else version
+        if version is None:
+            return None
+        t0 = time.perf_counter()
+        path = self._path(version)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        scales_path = os.path.join(path, "scales.npy")
+        sids_path = os.path.join(path, "snapshot_ids.npy")
+        snapshot = {
+            "version": version,
+            "meta": meta,
+            "size": int(meta["size"]),
+            "snapshots": int(meta["snapshots"]),
+            "codes": np.load(os.path.join(path, "embeddings.npy"), mmap_mode="c"),
+            "scales": np.load(scales_path, mmap_mode="c") if os.path.exists(scales_path) else None,
+            "ids": np.load(os.path.join(path, "person_ids.npy")).tolist(),
+            # версии до snapshot_id: метаданные совпадений — по person_id
+            "snapshot_ids": np.load(sids_path) if os.path.exists(sids_path) else np.zeros(int(meta["size"]), dtype=np.uint64),
+            "values": np.load(os.path.join(path, "values.npy")),
+            "attributes": AttributeIndex.restore(
+                meta["vocab"],
+                {name: np.load(os.path.join(path, f"{name}.npy")) for name in ATTRIBUTES},
+            ),
+        }
+        self.last_load_seconds = time.perf_counter() - t0
+        return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "latest": self.latest(),
+            "versions": self.versions(),
+            "writer": self.is_writer,
+            "writes": self.writes,
+            "last_write_seconds": round(self.last_write_seconds, 3) if self.last_write_seconds is not None else None,
+            "last_write_mb": round(self.last_write_bytes / 2 ** 20, 1),
+            "last_load_seconds": round(self.last_load_seconds, 3) if self.last_load_seconds is not None else None,
+        }
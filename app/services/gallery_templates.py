@@ -0,0 +1,158 @@
+# app/services/gallery_templates.py
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import GALLERY_TEMPLATES, GALLERY_TEMPLATES_PER_PERSON
+from app.services.face_pipeline import snapshot_quality
+
+MODES = ("all", "best", "centroid")
+
+
+def quality_weights(
+    det_score: Sequence[Any],
+    blur: Sequence[Any],
+    face_size: Sequence[Any],
+) -> np.ndarray:
+    """Колонки качества снимков → quality_score на строку (пустые значения — 0)."""
+    return np.fromiter(
+        (snapshot_quality(d or 0.0, b or 0.0, s or 0) for d, b, s in zip(det_score, blur, face_size)),
+        dtype=np.float32,
+        count=len(det_score),
+    )
+
+
+def group_rows(person_ids: Sequence[str]) -> Tuple[np.ndarray, List[str]]:
+    """person_id по строкам → (номер группы на строку, person_id групп в порядке появления)."""
+    groups: Dict[str, int] = {}
+    inv = np.fromiter(
+        (groups.setdefault(pid, len(groups)) for pid in person_ids),
+        dtype=np.int64,
+        count=len(person_ids),
+    )
+    return inv, list(groups)
+
+
+def best_rows(inv: np.ndarray, quality: np.ndarray, k: int) -> np.ndarray:
+    """
+    Номера строк: до k лучших по quality в каждой группе (по возрастанию номера).
+    При равном quality выигрывает более поздняя строка — свежий снимок.
+    """
+    n = inv.shape[0]
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    # группа ↑, quality ↓, номер строки ↓
+    order = np.lexsort((-np.arange(n), -quality, inv))
+    grouped = inv[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    rank = np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+    return np.sort(order[rank < k])
+
+
+class PersonTemplates:
+    """
+    Какие строки GalleryIndex представляют каждого человека.
+
+      all      — каждый снимок отдельной строкой (как раньше);
+      best     — до per_person лучших снимков по quality_score;
+      centroid — одна строка: взвешенный по quality_score центроид
+                 нормированных снимков.
+
+    Хранит только учёт (строки и их quality / норму суммы центроида);
+    сами векторы — в GalleryIndex. Изменения — под блокировкой индекса.
+    """
+
+    def __init__(self, mode: str = GALLERY_TEMPLATES, per_person: int = GALLERY_TEMPLATES_PER_PERSON):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный GALLERY_TEMPLATES: {mode}")
+        self.mode = mode
+        self.per_person = 1 if mode == "centroid" else max(1, per_person)
+        # best: person → [(quality, строка)]; centroid: person → [(|Σ w·x|, строка)]
+        self._rows: Dict[str, List[Tuple[float, int]]] = {}
+        self.snapshots = 0  # снимков учтено с последней полной загрузки
+
+    @property
+    def fanout(self) -> int:
+        """Сколько строк на человека может попасть в выдачу (запас на дедупликацию)."""
+        return self.per_person
+
+    @property
+    def persons(self) -> int:
+        return len(self._rows)
+
+    def load(self, person_ids: Sequence[str], values: np.ndarray, snapshots: int) -> None:
+        """Учёт после полной загрузки / уплотнения: строка i — person_ids[i] со значением values[i]."""
+        self._rows = {}
+        for row, (pid, v) in enumerate(zip(person_ids, values)):
+            self._rows.setdefault(pid, []).append((float(v), row))
+        self.snapshots = snapshots
+
+    def row_values(self, n: int) -> np.ndarray:
+        """Значение учёта по строкам [0, n) (для снимка галереи); строки вне учёта — 0."""
+        values = np.zeros(n, dtype=np.float32)
+        for slots in self._rows.values():
+            for v, r in slots:
+                if r < n:
+                    values[r] = v
+        return values
+
+    def remap(self, new_row: np.ndarray) -> None:
+        """Номера строк после уплотнения: new_row[старая] → новая (-1 — удалена)."""
+        self._rows = {
+            pid: kept
+            for pid, slots in self._rows.items()
+            if (kept := [(v, int(new_row[r])) for v, r in slots if new_row[r] >= 0])
+        }
+
+    # ── дозапись ──
+    def plan_best(
+        self,
+        person_ids: Sequence[str],
+        quality: np.ndarray,
+        start: int,
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Режим all / best: новые строки j (будут строками start, start + 1, ...
+        в порядке keep) → (какие новые оставить, какие старые строки вывести).
+        Учёт обновляется сразу.
+        """
+        slots_of: Dict[str, List[Tuple[float, Any]]] = {}
+        for j, (pid, w) in enumerate(zip(person_ids, quality)):
+            slots = slots_of.get(pid)
+            if slots is None:
+                slots = slots_of[pid] = [(v, ("old", r)) for v, r in self._rows.get(pid, [])]
+            slots.append((float(w), ("new", j)))
+            if self.mode == "best" and len(slots) > self.per_person:
+                # худший слот уходит; при равенстве — более старый
+                slots.remove(min(slots, key=lambda s: (s[0], s[1][0] == "new", s[1][1])))
+
+        keep = sorted(j for slots in slots_of.values() for _, (kind, j) in slots if kind == "new")
+        position = {j: start + i for i, j in enumerate(keep)}
+        retire: List[int] = []
+        for pid, slots in slots_of.items():
+            alive = {r for _, (kind, r) in slots if kind == "old"}
+            retire.extend(r for _, r in self._rows.get(pid, []) if r not in alive)
+            self._rows[pid] = [
+                (v, r if kind == "old" else position[r]) for v, (kind, r) in slots
+            ]
+        self.snapshots += len(person_ids)
+        return keep, retire
+
+    def centroid_of(self, person_id: str) -> Optional[Tuple[float, int]]:
+        slots = self._rows.get(person_id)
+        return slots[0] if slots else None
+
+    def set_centroid(self, person_id: str, norm: float, row: int) -> None:
+        self._rows[person_id] = [(norm, row)]
+
+    def stats(self) -> Dict[str, Any]:
+        rows = sum(len(s) for s in self._rows.values())
+        return {
+            "mode": self.mode,
+            "per_person": self.per_person,
+            "persons": self.persons,
+            "template_rows": rows,
+            "snapshots": self.snapshots,
+            "snapshots_per_template": round(self.snapshots / rows, 2) if rows else None,
+        }
@@ -0,0 +1,247 @@
+# app/services/inference_pool.py
+from __future__ import annotations
+import asyncio
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from app.core.config import (
+    INFERENCE_WORKERS,
+    INFERENCE_THREADS,
+    INFERENCE_MAX_QUEUE,
+    INFERENCE_PIN_CPUS,
+)
+from app.core import metrics
+from app.core.metrics import stage
+from app.services.face_pipeline import (
+    FaceCandidate,
+    FaceEmbeddingResult,
+    detect_image_bytes,
+    detect_images_bytes,
+    embed_aligned,
+)
+from app.services.recognition_batcher import RecognitionBatcher
+
+
+class InferenceQueueFull(Exception):
+    """Очередь инференса переполнена — запрос лучше отклонить (503), чем копить."""
+
+
+# ────────────────────────────────────────────────
+# Код, выполняемый внутри процесса-воркера
+# ────────────────────────────────────────────────
+_worker_models = None
+
+
+def _worker_init(threads: int, counter, pin: bool) -> None:
+    global _worker_models
+    from app.services.face_models import load_face_models
+
+    with counter.get_lock():
+        worker_idx = counter.value
+        counter.value += 1
+
+    # закрепляем воркер за своим диапазоном ядер: сессии не толкаются за одни и те же ядра
+    if pin and threads > 0 and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        lo = (worker_idx * threads) % len(cpus)
+        os.sched_setaffinity(0, cpus[lo:lo + threads] or cpus)
+
+    _worker_models = load_face_models(threads)
+    # замеры этапов уходят в процесс приложения вместе с результатом
+    metrics.defer()
+
+
+def _worker_ping():
+    # pid и этапы загрузки моделей воркера (сессии, prepare, прогрев)
+    return os.getpid(), _worker_models.stats()
+
+
+# воркер отвечает (результат, замеры этапов) — см. metrics.defer / metrics.replay
+def _worker_detect(img_bytes: bytes, with_crop: bool, gates: Dict[str, Any]):
+    return detect_image_bytes(img_bytes, _worker_models, with_crop=with_crop, **gates), metrics.take_deferred()
+
+
+def _worker_detect_batch(images: List[Optional[bytes]], gates: Dict[str, Any]):
+    return detect_images_bytes(images, _worker_models, **gates), metrics.take_deferred()
+
+
+def _worker_recognize(aligned: List[np.ndarray]):
+    return embed_aligned(_worker_models, aligned), metrics.take_deferred()
+
+
+# ────────────────────────────────────────────────
+# Пул
+# ────────────────────────────────────────────────
+class InferencePool:
+    """
+    Пул инференса лиц.
+
+    workers > 0 — отдельные процессы, у каждого свои ONNX-сессии
+    с фиксированным бюджетом threads intra-op потоков (и, опционально,
+    закреплением за ядрами). workers = 0 — прежний режим: одна модель
+    в процессе приложения через asyncio.to_thread.
+
+    Очередь ограничена max_queue: сверх workers + max_queue запросов
+    в полёте новые отклоняются InferenceQueueFull.
+
+    Запрос проходит два этапа: детекция + выравнивание — по одному фото,
+    ArcFace — через RecognitionBatcher, общим батчем для кропов
+    конкурентных запросов. Лимит очереди действует на входе (детекция):
+    прошедший её запрос на recognition уже не отклоняется.
+
+    Этапы pool_detect / pool_recognize — полный путь через пул (очередь,
+    передача в процесс, работа); их разница с decode + detect + ... — ожидание.
+    """
+
+    def __init__(
+        self,
+        local_models_factory: Callable[[], Any],
+        workers: int = INFERENCE_WORKERS,
+        threads: int = INFERENCE_THREADS,
+        max_queue: int = INFERENCE_MAX_QUEUE,
+        pin_cpus: bool = INFERENCE_PIN_CPUS,
+    ):
+        self.local_models_factory = local_models_factory
+        self.workers = workers
+        self.threads = threads
+        self.max_queue = max_queue
+        self.pin_cpus = pin_cpus
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # FaceModels.stats() по процессам с моделями (pid → загрузка): /ready, лог старта
+        self.models_loaded: Dict[int, Dict[str, Any]] = {}
+
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+        # в полёте не больше одного батча на воркер: остальное копится и укрупняет следующий
+        self.batcher = RecognitionBatcher(self._recognize, max_concurrent=self.capacity)
+
+    @property
+    def mode(self) -> str:
+        return "process" if self.workers > 0 else "in-process"
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self.workers)
+
+    def start(self) -> None:
+        if self.workers <= 0:
+            self.models_loaded = {os.getpid(): self.local_models_factory().stats()}
+            return
+        if self._executor is not None:
+            return
+
+        # spawn: форк процесса с уже созданными ONNX-сессиями/потоками небезопасен
+        ctx = mp.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_worker_init,
+            initargs=(self.threads, ctx.Value("i", 0), self.pin_cpus),
+        )
+        # поднимаем все процессы сразу, чтобы модели грузились на старте, а не на первом запросе
+        futures = [self._executor.submit(_worker_ping) for _ in range(self.workers)]
+        self.models_loaded = dict(f.result() for f in futures)
+        print(f"Inference pool: {len(self.models_loaded)} workers × {self.threads} threads")
+
+    def shutdown(self) -> None:
+        self.batcher.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, local_fn: Callable, worker_fn: Callable, *args):
+        if self.in_flight >= self.capacity + self.max_queue:
+            self.rejected += 1
+            raise InferenceQueueFull(
+                f"Очередь инференса переполнена ({self.in_flight} запросов в работе)"
+            )
+
+        self.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            with stage("pool_detect"):
+                if self._executor is None:
+                    return await asyncio.to_thread(local_fn, *args, self.local_models_factory())
+                loop = asyncio.get_running_loop()
+                result, samples = await loop.run_in_executor(self._executor, worker_fn, *args)
+                metrics.replay(samples)
+                return result
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - t0
+
+    async def _recognize(self, aligned: List[np.ndarray]) -> np.ndarray:
+        with stage("pool_recognize"):
+            if self._executor is None:
+                return await asyncio.to_thread(embed_aligned, self.local_models_factory(), aligned)
+            loop = asyncio.get_running_loop()
+            feats, samples = await loop.run_in_executor(self._executor, _worker_recognize, aligned)
+            metrics.replay(samples)
+            return feats
+
+    async def detect(
+        self,
+        img_bytes: bytes,
+        gates: Dict[str, Any],
+        *,
+        with_crop: bool = False,
+    ) -> Optional[FaceCandidate]:
+        def local(img_bytes, with_crop, gates, models):
+            return detect_image_bytes(img_bytes, models, with_crop=with_crop, **gates)
+
+        return await self._submit(local, _worker_detect, img_bytes, with_crop, gates)
+
+    async def embed(
+        self,
+        img_bytes: bytes,
+        gates: Dict[str, Any],
+        *,
+        with_crop: bool = False,
+    ) -> Optional[FaceEmbeddingResult]:
+        candidate = await self.detect(img_bytes, gates, with_crop=with_crop)
+        if candidate is None:
+            return None
+        embedding = await self.batcher.embed(candidate.aligned)
+        return FaceEmbeddingResult(embedding=embedding.tolist(), meta=candidate.meta, crop=candidate.crop)
+
+    async def embed_batch(
+        self,
+        images: List[Optional[bytes]],
+        gates: Dict[str, Any],
+    ) -> List[Union[FaceEmbeddingResult, Exception, None]]:
+        def local(images, gates, models):
+            return detect_images_bytes(images, models, **gates)
+
+        candidates = await self._submit(local, _worker_detect_batch, images, gates)
+        chosen = [c for c in candidates if isinstance(c, FaceCandidate)]
+        feats = iter(await self.batcher.embed_many([c.aligned for c in chosen]))
+        return [
+            FaceEmbeddingResult(embedding=next(feats).tolist(), meta=c.meta)
+            if isinstance(c, FaceCandidate) else c
+            for c in candidates
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "pin_cpus": self.pin_cpus,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.capacity),
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "recognition": self.batcher.stats(),
+            "models_loaded": self.models_loaded,
+        }
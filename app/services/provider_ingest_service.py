@@ -1,16 +1,18 @@
 from dataclasses import dataclass
-from typing import Optional, List
-import os
-import uuid
-import base64
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple, Union
 import asyncio
-import numpy as np
-import cv2
 
+from app.core.config import BULK_CONCURRENCY, BULK_INSERT_BATCH, REGISTER_WAIT_DURABLE
+from app.core.metrics import stage
 from app.schemas.register import RegisterInput
 from app.repositories.faceid_repo import FaceIdRepo
-from app.services.face_pipeline import get_face_embedding_strict
-from app.services.utils import new_uuid
+from app.repositories.snapshot_buffer import SnapshotBuffer
+from app.services.crop_store import CropStore
+from app.services.database import run_db
+from app.services.face_pipeline import snapshot_quality
+from app.services.gallery_refresher import GalleryRefresher
+from app.services.inference_pool import InferencePool, InferenceQueueFull
+from app.services.utils import new_snapshot_id, new_uuid, b64_to_bytes
 
 
 # ────────────────────────────────────────────────
@@ -20,8 +22,12 @@ EMB_OK = 1
 EMB_NONE = 0
 EMB_FAILED = 2
 
-IMAGES_DIR = "images/persons"
-os.makedirs(IMAGES_DIR, exist_ok=True)
+# Quality gates для регистрации (строже, чем при поиске)
+REGISTER_GATES = {
+    "min_det_score": 0.60,
+    "min_face_size": 80,
+    "min_blur": 60.0,
+}
 
 
 # ────────────────────────────────────────────────
@@ -42,65 +48,58 @@ def quality_score(p: PhotoResult) -> float:
     """
     Итоговый скор качества фото (используется при сравнении снимков)
     """
-    return (
-        (p.det_score * 100.0)
-        + (min(p.blur, 300.0) * 0.2)
-        + (min(p.face_size, 200) * 0.5)
-    )
+    return snapshot_quality(p.det_score, p.blur, p.face_size)
 
 
 # ────────────────────────────────────────────────
 # Основной ingest-сервис
 # ────────────────────────────────────────────────
 class ProviderIngestService:
-    def __init__(self, repo: FaceIdRepo, face_app):
+    def __init__(
+        self,
+        repo: FaceIdRepo,
+        pool: InferencePool,
+        refresher: Optional[GalleryRefresher] = None,
+        buffer: Optional[SnapshotBuffer] = None,
+        crops: Optional[CropStore] = None,
+    ):
         self.repo = repo
-        self.face_app = face_app
+        self.pool = pool
+        self.refresher = refresher
+        self.buffer = buffer
+        # без хранилища кропы не сохраняются (face_url = None)
+        self.crops = crops
 
     # ────────────────────────────────────────────
     # Обработка фото
     # ────────────────────────────────────────────
     async def process_photo(self, input: RegisterInput) -> PhotoResult:
-        if not input.photos_base64:
+        if not input.photos_base64 and not input.photo_bytes:
             return PhotoResult(embedding_status=EMB_NONE)
 
         try:
-            photo_b64 = input.photos_base64
+            # бинарная загрузка приходит уже байтами — base64 не нужен
+            img_bytes = input.photo_bytes
+            if not img_bytes:
+                with stage("b64_decode"):
+                    img_bytes = b64_to_bytes(input.photos_base64)
 
-            if "," in photo_b64:
-                _, photo_b64 = photo_b64.split(",", 1)
-
-            img_bytes = base64.b64decode(photo_b64)
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-            if img is None:
-                raise ValueError("Не удалось декодировать изображение")
-
-            result = await asyncio.to_thread(
-                get_face_embedding_strict,
-                img,
-                self.face_app,
-                min_det_score=0.60,
-                min_face_size=80,
-                min_blur=60.0,
-            )
+            # декодирование + детекция + embedding — в пуле инференса
+            with stage("embed"):
+                result = await self.pool.embed(img_bytes, REGISTER_GATES, with_crop=True)
 
             if result is None:
                 print("Фото не прошло quality gates")
                 return PhotoResult(embedding_status=EMB_FAILED)
 
-            # сохраняем кроп лица
-            tmp_id = str(uuid.uuid4())
-            face_filename = f"{tmp_id}.jpg"
-            face_path = os.path.join(IMAGES_DIR, face_filename)
-
-            x1, y1, x2, y2 = result.meta.bbox
-            crop = img[int(y1):int(y2), int(x1):int(x2)]
-            cv2.imwrite(face_path, crop, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+            # кроп лица пишется в фоне, путь по хэшу содержимого известен сразу
+            face_url = None
+            if self.crops is not None:
+                with stage("crop_enqueue"):
+                    face_url = await self.crops.put(result.crop)
 
             return PhotoResult(
-                face_url=face_path,
+                face_url=face_url,
                 embedding=result.embedding,
                 embedding_status=EMB_OK,
                 det_score=result.meta.det_score,
@@ -109,6 +108,8 @@ class ProviderIngestService:
                 faces_found=result.meta.faces_found,
             )
 
+        except InferenceQueueFull:
+            raise
         except Exception as e:
             print(f"Ошибка обработки фото: {str(e)}")
             return PhotoResult(embedding_status=EMB_FAILED)
@@ -116,7 +117,10 @@ class ProviderIngestService:
     # ────────────────────────────────────────────
     # INGEST (РЕГИСТРАЦИЯ)
     # ────────────────────────────────────────────
-    async def ingest(self, input: RegisterInput) -> str:
+    async def build_snapshot(self, input: RegisterInput) -> Dict[str, Any]:
+        """
+        Фото → embedding → строка face_snapshots (без записи в БД).
+        """
         person_id = str(new_uuid())
 
         photo_result = await self.process_photo(input)
@@ -126,8 +130,9 @@ class ProviderIngestService:
         if photo_result.embedding_status != EMB_OK or not photo_result.embedding:
             raise ValueError("Фото не прошло проверку качества. Регистрация отклонена.")
 
-        snapshot = {
+        return {
             "person_id": person_id,
+            "snapshot_id": new_snapshot_id(),
             "full_name": input.full_name,
             "passport": input.passport,
             "sex": input.sex,
@@ -148,6 +153,112 @@ class ProviderIngestService:
             "faces_found": photo_result.faces_found,
         }
 
-        self.repo.insert_document_snapshot(snapshot)
+    async def ingest(self, input: RegisterInput, wait_durable: bool = REGISTER_WAIT_DURABLE) -> str:
+        """
+        С буфером строка уходит в общий пакетный INSERT; wait_durable — дождаться
+        его (ошибка записи вернётся вызывающему), иначе ответ сразу после постановки.
+        """
+        snapshot = await self.build_snapshot(input)
+
+        with stage("store"):
+            if self.buffer is None:
+                await run_db(self.repo.insert_document_snapshot, snapshot)
+                self._apply_local(snapshot)
+                return snapshot["person_id"]
+
+            written = self.buffer.add(snapshot)
+            # в поиск — только после успешного INSERT: упавший пакет не оставит
+            # в галерее строку, которой нет в ClickHouse. Колбэк, а не код после
+            # await: клиент может отключиться, пока строка ждёт пакета, — INSERT
+            # всё равно произойдёт, и строка должна попасть в поиск
+            written.add_done_callback(lambda f: self._apply_written(f, snapshot))
+            if wait_durable:
+                # shield: отмена запроса не отменяет future буфера; колбэк выше
+                # зарегистрирован раньше shield и отрабатывает до возврата отсюда
+                await asyncio.shield(written)
+        return snapshot["person_id"]
+
+    def _apply_local(self, snapshot: Dict[str, Any]) -> None:
+        # сразу видно в поиске на этом узле, не дожидаясь цикла обновления
+        if self.refresher is not None:
+            self.refresher.apply_local(snapshot)
+
+    def _apply_written(self, written: asyncio.Future, snapshot: Dict[str, Any]) -> None:
+        if not written.cancelled() and written.exception() is None:
+            self._apply_local(snapshot)
+
+    # ────────────────────────────────────────────
+    # BULK INGEST (поток строк JSONL)
+    # ────────────────────────────────────────────
+    async def ingest_bulk(
+        self,
+        items: AsyncIterator[Tuple[int, Union[RegisterInput, Exception]]],
+        *,
+        concurrency: int = BULK_CONCURRENCY,
+        batch_size: int = BULK_INSERT_BATCH,
+    ) -> List[Dict[str, Any]]:
+        """
+        items — (номер строки, RegisterInput | ошибка разбора).
+        Фото обрабатываются параллельно (не больше concurrency одновременно),
+        строки пишутся в ClickHouse пакетами по batch_size одним INSERT.
+        Возвращает результат по каждой строке в исходном порядке.
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        pending: List[Tuple[int, Dict[str, Any]]] = []
+        flush_lock = asyncio.Lock()
+        sem = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def flush() -> None:
+            async with flush_lock:
+                if not pending:
+                    return
+                batch = pending[:]
+                pending.clear()
+                try:
+                    await run_db(
+                        self.repo.insert_document_snapshots,
+                        [snapshot for _, snapshot in batch],
+                    )
+                except Exception as e:
+                    for line_no, _ in batch:
+                        results[line_no] = {"line": line_no, "status": "error", "error": str(e)}
+                    return
+
+                for line_no, snapshot in batch:
+                    results[line_no] = {
+                        "line": line_no,
+                        "status": "ok",
+                        "person_id": snapshot["person_id"],
+                    }
+                    self._apply_local(snapshot)
+
+        async def handle(line_no: int, input: RegisterInput) -> None:
+            try:
+                snapshot = await self.build_snapshot(input)
+            except Exception as e:
+                results[line_no] = {"line": line_no, "status": "error", "error": str(e)}
+                return
+            finally:
+                sem.release()
+
+            pending.append((line_no, snapshot))
+            if len(pending) >= batch_size:
+                await flush()
+
+        async for line_no, item in items:
+            if isinstance(item, Exception):
+                results[line_no] = {"line": line_no, "status": "error", "error": str(item)}
+                continue
+
+            # backpressure: не читаем поток дальше, пока заняты все слоты
+            await sem.acquire()
+            task = asyncio.create_task(handle(line_no, item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        await flush()
 
-        return person_id
+        return [results[k] for k in sorted(results)]
@@ -0,0 +1,110 @@
+# app/services/quantization.py
+from __future__ import annotations
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+# форматы хранения строк галереи
+DTYPES = ("float32", "float16", "int8")
+
+_CHUNK = 16384  # строк, раскодируемых во float32 за один GEMM (≈ 32 МБ при dim=512)
+
+
+class QuantizedRows:
+    """
+    (N, dim) матрица в компактном виде:
+
+      float16 — codes float16, scales нет;
+      int8    — codes int8 + scale float32 на строку (строка ≈ codes * scale).
+
+    Ведёт себя как ndarray там, где это нужно поиску: shape, срезы
+    и индексация строк, `rows @ q` / `rows @ Q.T` — раскодирование во float32
+    идёт кусками, полная float32-копия не создаётся.
+    """
+
+    __slots__ = ("codes", "scales")
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def kind(self) -> str:
+        return "int8" if self.codes.dtype == np.int8 else "float16"
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, key) -> "QuantizedRows":
+        return QuantizedRows(
+            self.codes[key],
+            self.scales[key] if self.scales is not None else None,
+        )
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        other = np.asarray(other, dtype=np.float32)
+        n = self.codes.shape[0]
+        out = np.empty((n,) + other.shape[1:], dtype=np.float32)
+        # один буфер на все куски: copyto в готовую память заметно быстрее astype
+        scratch = np.empty((min(n, _CHUNK), self.codes.shape[1]), dtype=np.float32)
+        for lo in range(0, n, _CHUNK):
+            hi = min(lo + _CHUNK, n)
+            block = scratch[:hi - lo]
+            np.copyto(block, self.codes[lo:hi])
+            block = block @ other
+            if self.scales is not None:
+                block *= self.scales[lo:hi].reshape((-1,) + (1,) * (block.ndim - 1))
+            out[lo:hi] = block
+        return out
+
+    def to_float32(self) -> np.ndarray:
+        out = self.codes.astype(np.float32)
+        if self.scales is not None:
+            out *= self.scales[:, None]
+        return out
+
+    def normalized(self) -> Tuple["QuantizedRows", np.ndarray]:
+        """
+        L2-нормировка без раскодирования кодов: меняется только scale.
+        Возвращает (строки, маска валидных) — как normalize_rows.
+        """
+        norms = np.empty(len(self), dtype=np.float32)
+        for lo in range(0, len(self), _CHUNK):
+            block = self.codes[lo:lo + _CHUNK].astype(np.float32)
+            norms[lo:lo + _CHUNK] = np.linalg.norm(block, axis=1)
+        valid = np.isfinite(norms) & (norms > 0.0)
+
+        if self.kind == "int8":
+            return QuantizedRows(self.codes[valid], (1.0 / norms[valid]).astype(np.float32)), valid
+        # у float16 scale нет — нормируем сами коды (ошибка ≤ точности float16)
+        codes = (self.codes[valid].astype(np.float32) / norms[valid, None]).astype(np.float16)
+        return QuantizedRows(codes), valid
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Union[np.ndarray, QuantizedRows]:
+    """
+    float32-строки → формат хранения dtype. Для float32 возвращает вход как есть.
+    int8 — симметричное квантование со scale = max|x| / 127 на строку.
+    """
+    if dtype == "float32":
+        return embeddings
+    if dtype == "float16":
+        return QuantizedRows(embeddings.astype(np.float16))
+    if dtype == "int8":
+        peak = np.abs(embeddings).max(axis=1) if embeddings.shape[0] else np.empty(0, np.float32)
+        scales = np.where(peak > 0.0, peak / 127.0, 1.0).astype(np.float32)
+        codes = np.rint(embeddings / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return QuantizedRows(codes, scales)
+    raise ValueError(f"Неизвестный формат embedding'ов: {dtype}")
+
+
+def as_float32(rows: Union[np.ndarray, QuantizedRows]) -> np.ndarray:
+    return rows.to_float32() if isinstance(rows, QuantizedRows) else np.asarray(rows, dtype=np.float32)
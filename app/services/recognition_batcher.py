@@ -0,0 +1,160 @@
+# app/services/recognition_batcher.py
+from __future__ import annotations
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import RECOGNITION_BATCH_MAX, RECOGNITION_BATCH_WINDOW_MS
+from app.core.metrics import LATENCY_WINDOW, percentiles, size_bucket
+
+_Pending = Tuple[np.ndarray, asyncio.Future, float]
+
+
+class RecognitionBatcher:
+    """
+    Динамический micro-batching для ArcFace.
+
+    Выровненные кропы от конкурентных запросов копятся в очереди; батч
+    уходит в run_batch, как только набралось max_batch лиц или истекло
+    window_ms с момента постановки самого старого. Пока все max_concurrent
+    слотов заняты, очередь продолжает расти — под нагрузкой батчи крупнеют
+    сами, без увеличения окна.
+
+    run_batch: async (список кропов) -> (N, EMB_SIZE) — обычно прогон
+    в пуле инференса. Каждый запрос получает свою строку результата.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[np.ndarray]], Awaitable[np.ndarray]],
+        max_batch: int = RECOGNITION_BATCH_MAX,
+        window_ms: float = RECOGNITION_BATCH_WINDOW_MS,
+        max_concurrent: int = 1,
+    ):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_concurrent = max(1, max_concurrent)
+
+        self._pending: Deque[_Pending] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # метрики
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.full_batches = 0  # ушли по max_batch, а не по окну
+        self._size_hist: Counter = Counter()
+        self._wait_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)   # очередь → старт батча
+        self._run_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)    # прогон батча
+        self._total_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)  # очередь → embedding
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            # примитивы создаём в работающем loop'е, а не при импорте
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def embed(self, aligned: np.ndarray) -> np.ndarray:
+        """Один выровненный кроп → L2-нормированный embedding (EMB_SIZE,)."""
+        self._ensure_started()
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((aligned, fut, time.perf_counter()))
+        self._wakeup.set()
+        return await fut
+
+    async def embed_many(self, aligned: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """Кропы одного запроса ставятся в очередь разом и уезжают одним батчем (до max_batch)."""
+        if not aligned:
+            return []
+        return list(await asyncio.gather(*(self.embed(a) for a in aligned)))
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._pending:
+            _, fut, _ = self._pending.popleft()
+            if not fut.done():
+                fut.cancel()
+
+    async def _loop(self) -> None:
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # окно считается от самого старого ожидающего, а не от начала итерации
+            deadline = self._pending[0][2] + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            batch: List[_Pending] = []
+            while self._pending and len(batch) < self.max_batch:
+                item = self._pending.popleft()
+                if not item[1].done():  # запрос могли отменить (клиент ушёл)
+                    batch.append(item)
+            if not batch:
+                self._slots.release()
+                continue
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[_Pending]) -> None:
+        t0 = time.perf_counter()
+        try:
+            feats = await self.run_batch([a for a, _, _ in batch])
+        except Exception as e:
+            self.errors += 1
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (_, fut, _), emb in zip(batch, feats):
+                if not fut.done():
+                    fut.set_result(emb)
+        finally:
+            self._slots.release()
+
+        t1 = time.perf_counter()
+        n = len(batch)
+        self.batches += 1
+        self.items += n
+        if n >= self.max_batch:
+            self.full_batches += 1
+        self._size_hist[size_bucket(n)] += 1
+        self._run_ms.append((t1 - t0) * 1000)
+        for _, _, enq in batch:
+            self._wait_ms.append((t0 - enq) * 1000)
+            self._total_ms.append((t1 - enq) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "window_ms": round(self.window * 1000, 3),
+            "max_concurrent": self.max_concurrent,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "full_batches": self.full_batches,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "batch_size_hist": dict(sorted(self._size_hist.items(), key=lambda kv: int(kv[0].split("-")[0]))),
+            "queue_wait_ms": percentiles(self._wait_ms),
+            "batch_run_ms": percentiles(self._run_ms),
+            "latency_ms": percentiles(self._total_ms),
+        }
@@ -1,23 +1,95 @@
-from typing import Dict, Any, List
-import base64
+from typing import Dict, Any, List, Optional, Tuple
 import numpy as np
-import cv2
 import asyncio
 
-from app.services.face_pipeline import get_face_embedding_strict
+from app.core.config import SEARCH_MODE
+from app.core.metrics import stage
 from app.repositories.faceid_repo import FaceIdRepo
+from app.schemas.search import SearchFilters
+from app.services.database import run_db
+from app.services.embedding_cache import EmbeddingCache
+from app.services.gallery_index import GalleryIndex, Hit
+from app.services.gallery_shards import ShardedGallery
+from app.services.inference_pool import InferencePool
+from app.services.utils import b64_to_bytes
+
+
+# Quality gates для запроса поиска (мягче, чем при регистрации)
+SEARCH_GATES = {
+    "min_det_score": 0.45,
+    "min_face_size": 60,
+    "min_blur": 40.0,
+}
+
+
+def _to_match(person_id: str, score: float, c: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        # --- Идентификация ---
+        "person_id": person_id,
+        "full_name": c.get("full_name"),
+        "passport": c.get("passport"),
+
+        # --- Доп. данные ---
+        "citizenship": c.get("citizenship"),
+        "birth_date": c.get("birth_date"),
+        "visa_type": c.get("visa_type"),
+        "visa_number": c.get("visa_number"),
+        "entry_date": c.get("entry_date"),
+        "exit_date": c.get("exit_date"),
+
+        # --- Face данные ---
+        "face_url": c.get("face_url"),
+
+        # --- Схожесть (ВСЕГДА число) ---
+        "similarity": round(score * 100, 2),
+    }
 
 
 class SearchService:
-    def __init__(self, repo: FaceIdRepo, face_app):
+    def __init__(
+        self,
+        repo: FaceIdRepo,
+        pool: InferencePool,
+        gallery: GalleryIndex,
+        mode: str = SEARCH_MODE,
+        cache: Optional[EmbeddingCache] = None,
+        shards: Optional[ShardedGallery] = None,
+    ):
+        if mode not in ("local", "clickhouse", "sharded"):
+            raise ValueError(f"Неизвестный SEARCH_MODE: {mode}")
+        if mode == "sharded" and shards is None:
+            raise ValueError("SEARCH_MODE=sharded: не задан координатор шардов")
         self.repo = repo
-        self.face_app = face_app
+        self.pool = pool
+        self.gallery = gallery
+        self.mode = mode
+        self.cache = cache
+        self.shards = shards
+
+    async def _faces(self, hits: List[List[Hit]]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """
+        Метаданные совпадений: того снимка, на котором совпало (по snapshot_id).
+        Совпадения без snapshot_id (0 — строки до миграции, снимок не найден) —
+        метаданные последнего снимка человека. Ключ — (person_id, snapshot_id).
+        """
+        by_sid = await run_db(
+            self.repo.get_faces_by_snapshot_ids,
+            list({sid for per_query in hits for _, _, sid in per_query if sid}),
+        )
+        missing = {pid for per_query in hits for pid, _, sid in per_query if sid not in by_sid}
+        latest = await run_db(self.repo.get_faces_by_person_ids, list(missing)) if missing else {}
+        return {
+            (pid, sid): by_sid[sid] if sid in by_sid else latest.get(pid, {})
+            for per_query in hits
+            for pid, _, sid in per_query
+        }
 
     async def search_by_image_b64(
         self,
         image_b64: str,
         top_k: int = 5,
         threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
     ) -> Dict[str, Any]:
         """
         Поиск человека по фото (base64)
@@ -31,26 +103,45 @@ class SearchService:
             }
 
         try:
-            # Убираем data:image/...;base64,
-            if "," in image_b64:
-                _, image_b64 = image_b64.split(",", 1)
-
-            img_bytes = base64.b64decode(image_b64)
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-            if img is None:
-                raise ValueError("Не удалось декодировать изображение")
-
-            # Получаем embedding для поиска
-            result = await asyncio.to_thread(
-                get_face_embedding_strict,
-                img,
-                self.face_app,
-                min_det_score=0.45,
-                min_face_size=60,
-                min_blur=40.0,
-            )
+            with stage("b64_decode"):
+                img_bytes = b64_to_bytes(image_b64)
+        except Exception as e:
+            print(f"Ошибка поиска: {str(e)}")
+            return {
+                "status": "error",
+                "message": str(e),
+                "matches": [],
+            }
+
+        return await self.search_by_image_bytes(img_bytes, top_k=top_k, threshold=threshold, filters=filters)
+
+    async def search_by_image_bytes(
+        self,
+        img_bytes: bytes,
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> Dict[str, Any]:
+        """
+        Поиск человека по фото (сырые байты JPEG/PNG — бинарная загрузка).
+        filters ограничивают кандидатов до скоринга, а не отсеивают готовый top_k.
+        """
+
+        if not img_bytes:
+            return {
+                "status": "error",
+                "message": "Пустое изображение",
+                "matches": [],
+            }
+
+        try:
+            # Получаем embedding для поиска (декодирование + инференс — в пуле;
+            # то же фото повторно — из кэша, сразу к скорингу)
+            with stage("embed"):
+                if self.cache is not None:
+                    result = await self.cache.embed(img_bytes, SEARCH_GATES, self.pool.embed)
+                else:
+                    result = await self.pool.embed(img_bytes, SEARCH_GATES)
 
             if result is None or not result.embedding:
                 return {
@@ -77,71 +168,187 @@ class SearchService:
                     "matches": [],
                 }
 
-            # Забираем кандидатов из БД
-            candidates = self.repo.get_all_face_embeddings()
+            if self.mode == "clickhouse":
+                # Скоринг на стороне ClickHouse: по сети — только top_k строк с метаданными
+                with stage("score"):
+                    rows = await run_db(
+                        self.repo.search_similar,
+                        query_embedding.tolist(),
+                        top_k,
+                        threshold,
+                        filters,
+                    )
+                matches = [_to_match(r["person_id"], r["score"], r) for r in rows]
+            elif self.mode == "sharded":
+                # Запрос — всем шардам параллельно, top_k сливается из их ответов;
+                # шарды, не ответившие за SHARD_TIMEOUT_MS, помечают ответ partial
+                with stage("score"):
+                    hits, shard_status = await self.shards.search(query_embedding, top_k, threshold, filters)
+                with stage("metadata"):
+                    faces = await self._faces([hits])
 
-            matches: List[Dict[str, Any]] = []
+                return {
+                    "status": "ok",
+                    "message": "Поиск выполнен",
+                    "matches": [_to_match(pid, score, faces[pid, sid]) for pid, score, sid in hits],
+                    "partial": shard_status["partial"],
+                    "shards": shard_status,
+                }
+            else:
+                # Скоринг по резидентному индексу: одно умножение матрица × вектор
+                with stage("score"):
+                    hits = await asyncio.to_thread(
+                        self.gallery.search,
+                        query_embedding,
+                        top_k,
+                        threshold,
+                        filters,
+                    )
 
-            for c in candidates:
-                emb = c.get("embedding")
-                if not emb:
-                    continue
+                # Метаданные — только для совпавших строк
+                with stage("metadata"):
+                    faces = await self._faces([hits])
 
-                db_embedding = np.array(emb, dtype=np.float32)
+                matches = [_to_match(pid, score, faces[pid, sid]) for pid, score, sid in hits]
 
-                # 🔒 ЗАЩИТА: NaN / Inf в embedding из БД
-                if np.any(np.isnan(db_embedding)) or np.any(np.isinf(db_embedding)):
-                    continue
+            return {
+                "status": "ok",
+                "message": "Поиск выполнен",
+                "matches": matches,
+            }
 
-                d_norm = np.linalg.norm(db_embedding)
-                if d_norm == 0.0:
-                    continue
+        except Exception as e:
+            print(f"Ошибка поиска: {str(e)}")
+            return {
+                "status": "error",
+                "message": str(e),
+                "matches": [],
+            }
 
-                score = float(
-                    np.dot(query_embedding, db_embedding) / (q_norm * d_norm)
-                )
+    async def search_batch(
+        self,
+        images: List[Tuple[str, Any]],
+        top_k: int = 5,
+        threshold: float = 0.6,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Пакетный поиск: images — список ("b64" | "bytes", данные).
+        Детекция по каждому фото, один batch recognition, один GEMM по галерее,
+        один запрос метаданных. Ошибка одного фото не валит весь пакет —
+        результаты возвращаются в исходном порядке. filters — общие для пакета.
+        """
+        n = len(images)
+        results: List[Optional[Dict[str, Any]]] = [None] * n
 
-                # 🔒 ФИНАЛЬНАЯ ЗАЩИТА
-                if not np.isfinite(score):
-                    continue
+        # 1. base64 → байты; ошибки фиксируем поштучно
+        raw: List[Optional[bytes]] = [None] * n
+        for i, (kind, data) in enumerate(images):
+            if not data:
+                results[i] = {"status": "error", "message": "Пустое изображение", "matches": []}
+                continue
+            try:
+                if kind == "b64":
+                    with stage("b64_decode"):
+                        raw[i] = b64_to_bytes(data)
+                else:
+                    raw[i] = data
+            except Exception as e:
+                results[i] = {"status": "error", "message": str(e), "matches": []}
 
-                if score >= threshold:
-                    matches.append(
-                        {
-                            # --- Идентификация ---
-                            "person_id": c.get("person_id"),
-                            "full_name": c.get("full_name"),
-                            "passport": c.get("passport"),
+        # 2. Декодирование + детекция + один batch recognition — в пуле
+        #    (фото, уже бывшие в кэше, в пул не уходят)
+        try:
+            with stage("embed_batch"):
+                if self.cache is not None:
+                    embedded = await self.cache.embed_batch(raw, SEARCH_GATES, self.pool.embed_batch)
+                else:
+                    embedded = await self.pool.embed_batch(raw, SEARCH_GATES)
+        except Exception as e:
+            print(f"Ошибка пакетного поиска: {str(e)}")
+            return [
+                r or {"status": "error", "message": str(e), "matches": []}
+                for r in results
+            ]
 
-                            # --- Доп. данные ---
-                            "citizenship": c.get("citizenship"),
-                            "birth_date": c.get("birth_date"),
-                            "visa_type": c.get("visa_type"),
-                            "visa_number": c.get("visa_number"),
-                            "entry_date": c.get("entry_date"),
-                            "exit_date": c.get("exit_date"),
+        rows: List[int] = []
+        for i, emb in enumerate(embedded):
+            if results[i] is not None:
+                continue
+            if isinstance(emb, Exception):
+                results[i] = {"status": "error", "message": str(emb), "matches": []}
+                continue
+            if emb is None or not emb.embedding:
+                results[i] = {"status": "ok", "message": "Лицо не прошло quality gates", "matches": []}
+                continue
+            rows.append(i)
 
-                            # --- Face данные ---
-                            "face_url": c.get("face_url"),
+        if not rows:
+            return results
 
-                            # --- Схожесть (ВСЕГДА число) ---
-                            "similarity": round(score * 100, 2),
-                        }
-                    )
+        if self.mode == "clickhouse":
+            return await self._search_batch_clickhouse(results, embedded, rows, top_k, threshold, filters)
 
-            # Сортируем по убыванию схожести
-            matches.sort(key=lambda x: x["similarity"], reverse=True)
+        shard_status = None
+        try:
+            # 3. Все запросы против галереи одним матричным умножением
+            #    (sharded — одним сообщением каждому шарду, GEMM на их стороне)
+            queries = np.asarray([embedded[i].embedding for i in rows], dtype=np.float32)
+            with stage("score_batch"):
+                if self.mode == "sharded":
+                    hits, shard_status = await self.shards.search_many(queries, top_k, threshold, filters)
+                else:
+                    hits = await asyncio.to_thread(self.gallery.search_many, queries, top_k, threshold, filters)
 
-            return {
+            # 4. Метаданные — одним запросом на объединение совпадений
+            with stage("metadata"):
+                faces = await self._faces(hits)
+        except Exception as e:
+            print(f"Ошибка пакетного поиска: {str(e)}")
+            for i in rows:
+                results[i] = {"status": "error", "message": str(e), "matches": []}
+            return results
+
+        for i, per_query in zip(rows, hits):
+            results[i] = {
                 "status": "ok",
                 "message": "Поиск выполнен",
-                "matches": matches[:top_k],
+                "matches": [_to_match(pid, score, faces[pid, sid]) for pid, score, sid in per_query],
             }
+            if shard_status is not None:
+                results[i]["partial"] = shard_status["partial"]
+                results[i]["shards"] = shard_status
 
-        except Exception as e:
-            print(f"Ошибка поиска: {str(e)}")
-            return {
-                "status": "error",
-                "message": str(e),
-                "matches": [],
+        return results
+
+    async def _search_batch_clickhouse(
+        self,
+        results: List[Optional[Dict[str, Any]]],
+        embedded: List[Any],
+        rows: List[int],
+        top_k: int,
+        threshold: float,
+        filters: Optional[SearchFilters],
+    ) -> List[Dict[str, Any]]:
+        # запросы идут параллельно — каждый на своём соединении из пула
+        with stage("score_batch"):
+            found_all = await asyncio.gather(
+                *(
+                    run_db(self.repo.search_similar, embedded[i].embedding, top_k, threshold, filters)
+                    for i in rows
+                ),
+                return_exceptions=True,
+            )
+
+        for i, found in zip(rows, found_all):
+            if isinstance(found, Exception):
+                print(f"Ошибка пакетного поиска: {str(found)}")
+                results[i] = {"status": "error", "message": str(found), "matches": []}
+                continue
+            results[i] = {
+                "status": "ok",
+                "message": "Поиск выполнен",
+                "matches": [_to_match(r["person_id"], r["score"], r) for r in found],
             }
+
+        return results
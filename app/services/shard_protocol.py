@@ -0,0 +1,82 @@
+# app/services/shard_protocol.py
+"""
+Формат сообщений между координатором (ShardedGallery) и процессами-шардами.
+
+Без pickle: кадр — 4 байта длины заголовка (big-endian), JSON-заголовок
+и, если в заголовке есть "array", сырой little-endian float32 буфер
+запросов формы array.shape. Кадры передаются Connection.send_bytes /
+recv_bytes, так что разбор присланного не исполняет код: худшее, что может
+прислать клиент с ключом, — неверный запрос, на который шард ответит ошибкой.
+
+Соединение по-прежнему открывается HMAC-challenge с SHARD_AUTHKEY; ключ
+обязателен и не может быть прежним общеизвестным значением по умолчанию.
+"""
+from __future__ import annotations
+import json
+import struct
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+# прежнее значение SHARD_AUTHKEY по умолчанию — известно всем, кто видел код
+_PUBLIC_AUTHKEY = "face-id-shard"
+
+# потолок кадра: пакет из тысяч запросов по 512 float32 — единицы МБ
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+_HEADER_LEN = struct.Struct(">I")
+_DTYPE = np.dtype("<f4")
+
+
+class ProtocolError(ValueError):
+    """Кадр не разобран: битый заголовок, чужой dtype или неверная длина буфера."""
+
+
+def require_authkey(authkey: str) -> bytes:
+    """Ключ шардов → bytes для HMAC; пустой или общеизвестный — ValueError."""
+    if not authkey or authkey == _PUBLIC_AUTHKEY:
+        raise ValueError(
+            "SEARCH_MODE=sharded: задайте SHARD_AUTHKEY — общий секрет приложения и шардов "
+            "(пустой ключ и прежний 'face-id-shard' не принимаются)"
+        )
+    return authkey.encode()
+
+
+def encode(header: Dict[str, Any], array: Optional[np.ndarray] = None) -> bytes:
+    """Заголовок (+ float32 массив) → кадр."""
+    payload = b""
+    if array is not None:
+        array = np.ascontiguousarray(array, dtype=_DTYPE)
+        header = {**header, "array": list(array.shape)}
+        payload = array.tobytes()
+    head = json.dumps(header, ensure_ascii=False, default=str).encode()
+    return _HEADER_LEN.pack(len(head)) + head + payload
+
+
+def decode(frame: bytes) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    """Кадр → (заголовок, float32 массив или None)."""
+    if len(frame) < _HEADER_LEN.size:
+        raise ProtocolError("кадр короче заголовка")
+    (n,) = _HEADER_LEN.unpack_from(frame)
+    end = _HEADER_LEN.size + n
+    if end > len(frame):
+        raise ProtocolError("длина заголовка больше кадра")
+    try:
+        header = json.loads(frame[_HEADER_LEN.size:end])
+    except ValueError as e:
+        raise ProtocolError(f"заголовок не JSON: {e}") from e
+    if not isinstance(header, dict):
+        raise ProtocolError("заголовок — не объект")
+
+    shape = header.pop("array", None)
+    if shape is None:
+        if end != len(frame):
+            raise ProtocolError("лишние байты после заголовка")
+        return header, None
+    if not (isinstance(shape, list) and all(isinstance(d, int) and d >= 0 for d in shape)):
+        raise ProtocolError(f"неверная форма массива: {shape!r}")
+    expected = int(np.prod(shape, dtype=np.int64)) * _DTYPE.itemsize
+    if len(frame) - end != expected:
+        raise ProtocolError(f"буфер {len(frame) - end} байт, ожидалось {expected}")
+    count = expected // _DTYPE.itemsize
+    return header, np.frombuffer(frame, dtype=_DTYPE, count=count, offset=end if count else 0).reshape(shape)
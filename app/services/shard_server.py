@@ -0,0 +1,195 @@
+# app/services/shard_server.py
+"""
+Процесс-шард галереи (SEARCH_MODE=sharded).
+
+Держит GalleryIndex только со строками своего шарда — cityHash64(person_id) % n = i,
+все снимки человека в одном шарде — и отвечает на поиск по RPC
+(multiprocessing.connection поверх TCP, вход по HMAC-challenge с SHARD_AUTHKEY;
+кадры — JSON-заголовок + float32 буфер, без pickle, см. shard_protocol).
+Галерея обновляется своим GalleryRefresher. Без SHARD_AUTHKEY шард не стартует.
+
+    SHARD_AUTHKEY=... python -m app.services.shard_server --shard 0 --shards 4 --port 7100
+
+Запросы — заголовок {"op", ...}, ответы — {"status": "ok", "result"} или
+{"status": "error", "error": текст}:
+
+    {"op": "search", "top_k", "threshold", "filters": dict | null} + queries (M, dim) float32
+        → M списков [person_id, score, snapshot_id], как GalleryIndex.search_many
+    {"op": "ping"}  → {"shard", "shards", "loaded", "size"}
+    {"op": "stats"} → GalleryRefresher.stats() + счётчики сервера
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import threading
+import time
+from multiprocessing.connection import Connection, Listener
+from multiprocessing import AuthenticationError
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import GALLERY_SNAPSHOT_DIR, SHARD_AUTHKEY
+from app.schemas.search import SearchFilters
+from app.services.gallery_index import GalleryIndex
+from app.services.shard_protocol import MAX_MESSAGE_BYTES, ProtocolError, decode, encode, require_authkey
+
+
+class ShardServer:
+    """
+    RPC-обёртка над GalleryIndex: поток на соединение, соединения долгоживущие
+    (у координатора — пул). Поиск идёт без блокировки — индекс публикует
+    представление атомарно, refresher дописывает строки параллельно.
+    """
+
+    def __init__(
+        self,
+        index: GalleryIndex,
+        address: Tuple[str, int],
+        shard: Tuple[int, int] = (0, 1),
+        authkey: str = SHARD_AUTHKEY,
+        stats: Optional[Callable[[], Dict[str, Any]]] = None,
+    ):
+        self.index = index
+        self.shard = shard
+        self.extra_stats = stats
+        self._listener = Listener(address, family="AF_INET", authkey=require_authkey(authkey))
+        self._closed = False
+
+        # метрики
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.auth_failures = 0
+        self.search_seconds = 0.0
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._listener.address
+
+    def serve_forever(self) -> None:
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError as e:
+                self.auth_failures += 1
+                print(f"Shard {self.shard[0]}: соединение отклонено: {e}")
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def close(self) -> None:
+        self._closed = True
+        self._listener.close()
+
+    def _serve(self, conn: Connection) -> None:
+        with conn:
+            while True:
+                try:
+                    frame = conn.recv_bytes(MAX_MESSAGE_BYTES)
+                except (EOFError, OSError):
+                    # OSError — в том числе кадр больше MAX_MESSAGE_BYTES: соединение рвём
+                    return
+                try:
+                    reply = encode({"status": "ok", "result": self.handle(*decode(frame))})
+                except Exception as e:
+                    self.errors += 1
+                    reply = encode({"status": "error", "error": f"{type(e).__name__}: {e}"})
+                try:
+                    conn.send_bytes(reply)
+                except OSError:
+                    return
+
+    def handle(self, request: Dict[str, Any], queries: Optional[np.ndarray] = None) -> Any:
+        op = request.get("op")
+        self.requests += 1
+        if op == "search":
+            if queries is None or queries.ndim != 2 or queries.shape[1] != self.index.dim:
+                raise ProtocolError(f"search: нужен массив запросов (M, {self.index.dim})")
+            if not self.index.loaded:
+                raise RuntimeError("галерея шарда ещё не загружена")
+            filters = request.get("filters")
+            t0 = time.perf_counter()
+            hits = self.index.search_many(
+                queries,
+                int(request["top_k"]),
+                float(request["threshold"]),
+                SearchFilters(**filters) if filters else None,
+            )
+            self.search_seconds += time.perf_counter() - t0
+            return hits
+        if op == "ping":
+            return {
+                "shard": self.shard[0],
+                "shards": self.shard[1],
+                "loaded": self.index.loaded,
+                "size": self.index.size,
+            }
+        if op == "stats":
+            return {
+                **(self.extra_stats() if self.extra_stats else {}),
+                "shard": self.shard[0],
+                "shards": self.shard[1],
+                "connections": self.connections,
+                "requests": self.requests,
+                "errors": self.errors,
+                "auth_failures": self.auth_failures,
+                "search_seconds": round(self.search_seconds, 3),
+            }
+        raise ValueError(f"Неизвестная операция: {op}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gallery shard process")
+    parser.add_argument("--shard", type=int, required=True, help="номер шарда i (0 .. shards-1)")
+    parser.add_argument("--shards", type=int, required=True, help="всего шардов n")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard должен быть в диапазоне 0 .. shards-1")
+
+    # зависимости ClickHouse — только в процессе-шарде, не при импорте ShardServer
+    from app.repositories.faceid_repo import FaceIdRepo
+    from app.services.gallery_refresher import GalleryRefresher
+    from app.services.gallery_snapshot import GallerySnapshotStore
+
+    repo = FaceIdRepo()
+    index = GalleryIndex(rescore=repo.get_embeddings_by_person_ids)
+    # у каждого шарда свой каталог снимков: перезапуск шарда — без полной выгрузки его доли
+    snapshots = (
+        GallerySnapshotStore(os.path.join(GALLERY_SNAPSHOT_DIR, f"shard-{args.shard}-of-{args.shards}"))
+        if GALLERY_SNAPSHOT_DIR else None
+    )
+    refresher = GalleryRefresher(
+        index,
+        repo_factory=lambda: repo,
+        shard=(args.shard, args.shards),
+        snapshots=snapshots,
+    )
+
+    # первый цикл refresher'а делает full_load; ошибки БД — ретрай каждые interval секунд
+    threading.Thread(target=asyncio.run, args=(refresher.run(),), daemon=True).start()
+
+    server = ShardServer(
+        index,
+        (args.host, args.port),
+        shard=(args.shard, args.shards),
+        stats=refresher.stats,
+    )
+    print(f"Shard {args.shard}/{args.shards} listening on {args.host}:{server.address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,100 @@
 # app/services/utils.py
+import base64
+import secrets
+import struct
+from typing import Optional, Tuple
 from uuid import uuid4
 
+import cv2
+import numpy as np
+
 def new_uuid() -> str:
     """Генерирует новый UUID в строковом формате"""
-    return str(uuid4())
\ No newline at end of file
+    return str(uuid4())
+
+def new_snapshot_id() -> int:
+    """Идентификатор строки face_snapshots (snapshot_id): случайный, влезает в Int64 и UInt64"""
+    return secrets.randbits(63)
+
+def decode_image_bytes(img_bytes: bytes) -> np.ndarray:
+    """Декодирует JPEG/PNG байты в BGR-изображение"""
+    nparr = np.frombuffer(img_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return img
+
+# SOF-маркеры JPEG, в которых лежат размеры кадра (DHT/JPG/DAC — не SOF)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def image_size_from_header(img_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """(ширина, высота) из заголовка JPEG/PNG без декодирования; None — формат не распознан"""
+    if img_bytes[:8] == b"\x89PNG\r\n\x1a\n" and len(img_bytes) >= 24:
+        w, h = struct.unpack(">II", img_bytes[16:24])
+        return w, h
+    if img_bytes[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(img_bytes)
+    while i + 4 <= n:
+        if img_bytes[i] != 0xFF:
+            return None
+        marker = img_bytes[i + 1]
+        if marker == 0xFF:  # заполняющие байты
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        seg_len = struct.unpack(">H", img_bytes[i + 2:i + 4])[0]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            h, w = struct.unpack(">HH", img_bytes[i + 5:i + 9])
+            return w, h
+        i += 2 + seg_len
+    return None
+
+def fit_max_side(img: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    """Уменьшает изображение до max_side по длинной стороне; возвращает (img, масштаб к исходнику)"""
+    h, w = img.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return img, 1.0
+    scale = max_side / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+def decode_image_reduced(img_bytes: bytes, max_side: int) -> Tuple[np.ndarray, float]:
+    """
+    Декодирует сразу в уменьшенном разрешении: для JPEG — IMREAD_REDUCED_*
+    (масштабирование на уровне DCT, полный кадр не раскодируется), затем
+    досжатие до max_side. Возвращает (img, масштаб к исходному разрешению).
+    """
+    flag = cv2.IMREAD_COLOR
+    size = image_size_from_header(img_bytes) if max_side > 0 else None
+    if size is not None and img_bytes[:2] == b"\xff\xd8":
+        long_side = max(size)
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if long_side // factor >= max_side:
+                flag = reduced
+                break
+
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flag)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+
+    # масштаб считаем по длинной стороне: EXIF-поворот меняет местами ширину и высоту
+    scale = max(img.shape[:2]) / max(size) if size is not None else 1.0
+    img, extra = fit_max_side(img, max_side)
+    return img, scale * extra
+
+def b64_to_bytes(image_b64: str) -> bytes:
+    """Base64 (в т.ч. data:image/...;base64,) → сырые байты изображения"""
+    if "," in image_b64:
+        _, image_b64 = image_b64.split(",", 1)
+    return base64.b64decode(image_b64)
+
+def decode_image_b64(image_b64: str) -> np.ndarray:
+    """Base64 (в т.ч. data:image/...;base64,) → BGR-изображение"""
+    return decode_image_bytes(b64_to_bytes(image_b64))
@@ -1,4 +1,5 @@
 # db_init.py
+from app.core.config import CLICKHOUSE_VECTOR_INDEX
 from app.services.database import get_clickhouse_client
 
 client = get_clickhouse_client()
@@ -56,4 +57,47 @@ CREATE TABLE IF NOT EXISTS person_sgb_map_v2 (
 ORDER BY (sgb_person_id, version);
 """)
 
+# Компактная копия embedding'а для загрузки галереи (GALLERY_DTYPE=int8):
+# int8-коды + scale на строку, считаются самим ClickHouse из float32-колонки
+# при INSERT (DEFAULT) — вставка из приложения не меняется.
+# Это НЕ сжатие таблицы: колонки добавляются рядом с float32 embedding, и
+# face_snapshots растёт (~512 + 4 байт на строку до сжатия ClickHouse).
+# Уплотняется только резидентная галерея в памяти процесса. float32 embedding
+# остаётся источником истины и удалить его нельзя: по нему идут точный
+# пересчёт кандидатов (rescore), SEARCH_MODE=clickhouse и HNSW-индекс ниже.
+client.execute("""
+ALTER TABLE face_id_boom.face_snapshots
+    ADD COLUMN IF NOT EXISTS embedding_scale Float32
+        DEFAULT arrayMax(arrayMap(x -> abs(x), embedding)) / 127,
+    ADD COLUMN IF NOT EXISTS embedding_i8 Array(Int8)
+        DEFAULT arrayMap(x -> toInt8(round(x / greatest(embedding_scale, 1e-12))), embedding)
+""")
+
+# старые строки: DEFAULT вычисляется при чтении, пока колонку не материализовать
+client.execute("ALTER TABLE face_id_boom.face_snapshots MATERIALIZE COLUMN embedding_scale")
+client.execute("ALTER TABLE face_id_boom.face_snapshots MATERIALIZE COLUMN embedding_i8")
+
+# Идентификатор строки: refresher галереи узнаёт по нему уже загруженные строки
+# (перечитывая окно перекрытия), поиск — метаданные именно совпавшего снимка.
+# Приложение вставляет свой случайный snapshot_id; старым строкам DEFAULT
+# даёт хэш содержимого, MATERIALIZE фиксирует его на диске.
+client.execute("""
+ALTER TABLE face_id_boom.face_snapshots
+    ADD COLUMN IF NOT EXISTS snapshot_id UInt64
+        DEFAULT cityHash64(person_id, ifNull(face_url, ''), created_at, embedding)
+""")
+client.execute("ALTER TABLE face_id_boom.face_snapshots MATERIALIZE COLUMN snapshot_id")
+
+# Необязательно: HNSW-индекс для SEARCH_MODE=clickhouse (сервер с vector_similarity).
+# search_similar написан как ORDER BY cosineDistance(...) LIMIT k — индекс подхватывается сам.
+# Индекс требует, чтобы ВСЕ embedding были длины 512: строки другой длины
+# ломают MATERIALIZE и отклоняются при INSERT — удалите их заранее.
+if CLICKHOUSE_VECTOR_INDEX:
+    client.execute("""
+    ALTER TABLE face_id_boom.face_snapshots
+        ADD INDEX IF NOT EXISTS embedding_hnsw embedding
+        TYPE vector_similarity('hnsw', 'cosineDistance', 512)
+    """)
+    client.execute("ALTER TABLE face_id_boom.face_snapshots MATERIALIZE INDEX embedding_hnsw")
+
 print("Таблицы созданы успешно")
\ No newline at end of file
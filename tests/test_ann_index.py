@@ -0,0 +1,43 @@
+# tests/test_ann_index.py
+import numpy as np
+
+from app.services.ann_index import IVFBackend, exact_search
+from app.services.gallery_index import normalize_rows
+
+
+def gallery(n: int = 2000, dim: int = 16, seed: int = 0) -> np.ndarray:
+    rows, _ = normalize_rows(np.random.default_rng(seed).normal(size=(n, dim)))
+    return rows
+
+
+def test_ivf_without_list_copy_matches_copy():
+    emb = gallery()
+    q = emb[7]
+    shared = IVFBackend(nlist=16, nprobe=4, min_rows=0, list_copy=False)
+    copied = IVFBackend(nlist=16, nprobe=4, min_rows=0, list_copy=True)
+    shared.build(emb)
+    copied.build(emb)
+
+    idx_shared, scores_shared = shared.search(emb, q, 10)
+    idx_copied, scores_copied = copied.search(emb, q, 10)
+
+    assert idx_shared.tolist() == idx_copied.tolist()
+    assert np.allclose(scores_shared, scores_copied)
+    assert idx_shared[0] == 7
+    # без копии в индексе только центроиды и перестановка строк
+    assert shared.stats()["index_bytes"] < emb.nbytes < copied.stats()["index_bytes"]
+
+
+def test_ivf_with_full_probe_equals_exact_and_respects_mask():
+    emb = gallery()
+    q = emb[3]
+    ivf = IVFBackend(nlist=8, nprobe=8, min_rows=0, list_copy=False)
+    ivf.build(emb)
+    mask = np.zeros(emb.shape[0], dtype=bool)
+    mask[::2] = True
+
+    idx, _ = ivf.search(emb, q, 5, mask)
+    exact_idx, _ = exact_search(emb, q, 5, mask)
+
+    assert idx.tolist() == exact_idx.tolist()
+    assert mask[idx].all()
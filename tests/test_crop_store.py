@@ -0,0 +1,93 @@
+# tests/test_crop_store.py
+import asyncio
+import os
+
+import numpy as np
+
+from app.services.crop_store import CropStore
+
+
+def crop(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, size=(32, 32, 3), dtype=np.uint8)
+
+
+def files(root) -> list:
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, fs in os.walk(root) for f in fs)
+
+
+def test_same_crop_in_flight_is_written_once(tmp_path):
+    store = CropStore(root=str(tmp_path), workers=2, max_queue=100)
+
+    async def main():
+        paths = [await store.put(crop(0)) for _ in range(3)]
+        await store.close()
+        return paths
+
+    paths = asyncio.run(main())
+    assert len(set(paths)) == 1
+    digest = CropStore.digest(crop(0))
+    # <root>/ab/cd/abcd….jpg
+    assert files(tmp_path) == [os.path.join(digest[:2], digest[2:4], f"{digest}.jpg")]
+    stats = store.stats()
+    assert (stats["written"], stats["deduplicated"], stats["queue_depth"]) == (1, 2, 0)
+
+
+def test_crop_already_on_disk_is_not_rewritten(tmp_path):
+    async def put(store, img):
+        path = await store.put(img)
+        await store.close()
+        return path
+
+    first = CropStore(root=str(tmp_path))
+    path = asyncio.run(put(first, crop(0)))
+    mtime = os.stat(path).st_mtime_ns
+
+    # другой процесс / перезапуск: в очереди пусто, но файл уже есть
+    second = CropStore(root=str(tmp_path))
+    assert asyncio.run(put(second, crop(0).copy())) == path
+    assert os.stat(path).st_mtime_ns == mtime
+    assert (second.stats()["written"], second.stats()["deduplicated"]) == (0, 1)
+
+
+def test_different_crops_get_different_files(tmp_path):
+    store = CropStore(root=str(tmp_path))
+
+    async def main():
+        paths = [await store.put(crop(i)) for i in range(3)]
+        # та же картинка другой формы — другой хэш
+        paths.append(await store.put(crop(0).reshape(16, 64, 3)))
+        await store.close()
+        return paths
+
+    paths = asyncio.run(main())
+    assert len(set(paths)) == 4
+    assert all(os.path.exists(p) for p in paths)
+    assert not any(f.endswith(".tmp") for f in files(tmp_path))
+    assert store.stats()["written"] == 4
+
+
+def test_full_queue_makes_put_wait_for_its_write(tmp_path):
+    store = CropStore(root=str(tmp_path), max_queue=0)
+
+    async def main():
+        path = await store.put(crop(0))
+        # put вернулся только после записи своего кропа
+        assert os.path.exists(path)
+        await store.close()
+
+    asyncio.run(main())
+    assert store.stats()["waited"] == 1
+
+
+def test_write_error_is_counted_not_raised(tmp_path):
+    root = tmp_path / "crops"
+    root.write_bytes(b"")  # корень — файл: каталоги кропов не создать
+    store = CropStore(root=str(root))
+
+    async def main():
+        await store.put(crop(0))
+        await store.close()
+
+    asyncio.run(main())
+    stats = store.stats()
+    assert (stats["errors"], stats["written"]) == (1, 0)
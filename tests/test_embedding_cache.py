@@ -0,0 +1,171 @@
+# tests/test_embedding_cache.py
+import asyncio
+
+import pytest
+
+from app.services import embedding_cache
+from app.services.embedding_cache import EmbeddingCache
+from app.services.face_pipeline import EMB_SIZE, FaceEmbeddingResult, FaceMeta
+
+GATES = {"min_det_score": 0.5, "min_face_size": 40, "min_blur": 10.0}
+META = FaceMeta(det_score=0.9, bbox=(0, 0, 100, 100), face_size=100, blur=100.0, faces_found=1)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Embedder:
+    """compute для кэша: embedding из первого байта фото, b"bad" — отказ gates."""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+        self.fail = False
+
+    def result(self, img_bytes):
+        if img_bytes == b"bad":
+            return None
+        return FaceEmbeddingResult(embedding=[float(img_bytes[0])] * EMB_SIZE, meta=META)
+
+    async def embed(self, img_bytes, gates):
+        self.calls.append(img_bytes)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("пул инференса недоступен")
+        return self.result(img_bytes)
+
+    async def embed_batch(self, images, gates):
+        self.calls.append(list(images))
+        return [None if img is None else self.result(img) for img in images]
+
+
+def test_repeated_photo_is_served_from_cache():
+    cache, embedder = EmbeddingCache(max_mb=1, ttl=60), Embedder()
+
+    async def main():
+        first = await cache.embed(b"a-photo", GATES, embedder.embed)
+        again = await cache.embed(b"a-photo", GATES, embedder.embed)
+        other_gates = await cache.embed(b"a-photo", {**GATES, "min_blur": 60.0}, embedder.embed)
+        return first, again, other_gates
+
+    first, again, other_gates = asyncio.run(main())
+    assert again.embedding == first.embedding and again.meta == META
+    # другие пороги gates — другой ключ
+    assert other_gates is not None
+    assert len(embedder.calls) == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+
+
+def test_gate_rejection_is_cached_but_errors_are_not():
+    cache, embedder = EmbeddingCache(max_mb=1, ttl=60), Embedder()
+
+    async def main():
+        assert await cache.embed(b"bad", GATES, embedder.embed) is None
+        assert await cache.embed(b"bad", GATES, embedder.embed) is None
+
+        embedder.fail = True
+        with pytest.raises(RuntimeError):
+            await cache.embed(b"x-photo", GATES, embedder.embed)
+        embedder.fail = False
+        assert await cache.embed(b"x-photo", GATES, embedder.embed) is not None
+
+    asyncio.run(main())
+    assert embedder.calls == [b"bad", b"x-photo", b"x-photo"]
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_cache, "time", clock)
+    cache, embedder = EmbeddingCache(max_mb=1, ttl=60), Embedder()
+
+    async def main():
+        await cache.embed(b"a-photo", GATES, embedder.embed)
+        clock.now += 59
+        await cache.embed(b"a-photo", GATES, embedder.embed)
+        clock.now += 2
+        await cache.embed(b"a-photo", GATES, embedder.embed)
+
+    asyncio.run(main())
+    assert len(embedder.calls) == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["expirations"]) == (1, 1)
+
+
+def test_memory_limit_evicts_least_recently_used():
+    # запись — embedding float32 (2 КиБ) + накладные расходы: влезают две
+    cache, embedder = EmbeddingCache(max_mb=6 * 1024 / 2 ** 20, ttl=60), Embedder()
+
+    async def main():
+        for photo in (b"a", b"b", b"a", b"c"):  # повтор "a" делает её свежей
+            await cache.embed(photo, GATES, embedder.embed)
+        await cache.embed(b"a", GATES, embedder.embed)
+        await cache.embed(b"b", GATES, embedder.embed)
+
+    asyncio.run(main())
+    # "b" вытеснена записью "c", "a" осталась
+    assert embedder.calls == [b"a", b"b", b"c", b"b"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_concurrent_identical_requests_share_one_inference():
+    cache, embedder = EmbeddingCache(max_mb=1, ttl=60), Embedder(delay=0.02)
+
+    async def main():
+        return await asyncio.gather(*(cache.embed(b"a-photo", GATES, embedder.embed) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert embedder.calls == [b"a-photo"]
+    assert all(r.embedding == results[0].embedding for r in results)
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["inflight"]) == (1, 4, 0)
+
+
+def test_concurrent_waiters_see_the_error_of_shared_inference():
+    cache, embedder = EmbeddingCache(max_mb=1, ttl=60), Embedder(delay=0.02)
+    embedder.fail = True
+
+    async def main():
+        return await asyncio.gather(
+            *(cache.embed(b"a-photo", GATES, embedder.embed) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert len(embedder.calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.stats()["entries"] == 0
+
+
+def test_batch_computes_only_misses_and_duplicates_once():
+    cache, embedder = EmbeddingCache(max_mb=1, ttl=60), Embedder()
+
+    async def main():
+        await cache.embed(b"a", GATES, embedder.embed)
+        return await cache.embed_batch([b"a", b"b", None, b"b", b"bad"], GATES, embedder.embed_batch)
+
+    results = asyncio.run(main())
+    assert embedder.calls == [b"a", [b"b", None, b"bad"]]
+    assert results[0].embedding[0] == float(b"a"[0])
+    assert results[1].embedding == results[3].embedding
+    assert results[2] is None and results[4] is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["coalesced"]) == (1, 1)
+
+
+def test_disabled_cache_always_computes():
+    cache, embedder = EmbeddingCache(max_mb=0), Embedder()
+
+    async def main():
+        for _ in range(2):
+            await cache.embed(b"a-photo", GATES, embedder.embed)
+
+    asyncio.run(main())
+    assert len(embedder.calls) == 2
+    assert not cache.stats()["enabled"]
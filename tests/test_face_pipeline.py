@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+
+from app.services.face_pipeline import _blur_score, detect_best_face
+
+
+class FakeDetector:
+    """Одно лицо в фиксированном bbox (координаты кадра, поданного детектору)."""
+
+    def __init__(self, bbox, det_score=0.9):
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.det_score = det_score
+        self.frames = []
+
+    def detect(self, image, max_num=0, metric='default'):
+        self.frames.append(image.shape)
+        x1, y1, x2, y2 = self.bbox
+        w, h = x2 - x1, y2 - y1
+        kps = np.array([
+            [x1 + 0.35 * w, y1 + 0.4 * h],
+            [x1 + 0.65 * w, y1 + 0.4 * h],
+            [x1 + 0.5 * w, y1 + 0.55 * h],
+            [x1 + 0.38 * w, y1 + 0.75 * h],
+            [x1 + 0.62 * w, y1 + 0.75 * h],
+        ], dtype=np.float32)
+        return np.array([[*self.bbox, self.det_score]], dtype=np.float32), kps[None]
+
+
+class FakeRecognition:
+    input_size = (112, 112)
+
+
+class FakeFaceApp:
+    def __init__(self, bbox):
+        self.det_model = FakeDetector(bbox)
+        self.models = {'recognition': FakeRecognition()}
+
+
+def frames(blur_sigma=0.0, side=1000, scale=0.5):
+    rng = np.random.default_rng(0)
+    full = rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8)
+    if blur_sigma:
+        full = cv2.GaussianBlur(full, (0, 0), blur_sigma)
+    work = cv2.resize(full, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return full, work
+
+
+def test_blur_is_measured_on_original_resolution_crop():
+    full, work = frames()
+    app = FakeFaceApp((100, 100, 300, 300))
+    calls = []
+
+    def original():
+        calls.append(1)
+        return full
+
+    cand = detect_best_face(work, app, scale=0.5, original=original, min_face_size=80, min_blur=0.0)
+
+    assert cand is not None
+    assert calls == [1]
+    assert cand.meta.blur == _blur_score(full[200:600, 200:600])
+    assert cand.meta.bbox == (200, 200, 600, 600)
+    assert cand.meta.face_size == 400
+    # детектор видит кадр как есть — без полей вокруг всего кадра
+    assert app.det_model.frames == [work.shape]
+    assert cand.aligned.shape == (112, 112, 3)
+
+
+def test_blurry_original_is_rejected_even_if_downscale_looks_sharp():
+    full, work = frames(blur_sigma=2.0)
+    threshold = _blur_score(full[200:600, 200:600]) * 1.5
+    # уменьшенный кадр резче исходного: по нему размытое фото прошло бы порог
+    assert _blur_score(work[100:300, 100:300]) > threshold
+
+    app = FakeFaceApp((100, 100, 300, 300))
+    assert detect_best_face(work, app, scale=0.5, original=lambda: full, min_face_size=80, min_blur=threshold) is None
+
+
+def test_original_is_not_loaded_without_downscale():
+    full, _ = frames()
+    app = FakeFaceApp((100, 100, 300, 300))
+
+    def original():
+        raise AssertionError("кадр не уменьшен — исходник не нужен")
+
+    cand = detect_best_face(full, app, original=original, min_face_size=80, min_blur=0.0)
+    assert cand is not None
+    assert cand.meta.blur == _blur_score(full[100:300, 100:300])
+
+
+def test_face_at_frame_edge_is_aligned_with_white_fill():
+    full, _ = frames()
+    app = FakeFaceApp((-20, -20, 200, 200))
+
+    cand = detect_best_face(full, app, min_face_size=80, min_blur=0.0)
+    assert cand is not None
+    assert cand.meta.bbox == (0, 0, 200, 200)
+    # угол кропа за краем кадра — белый, как давали поля вокруг кадра
+    assert (cand.aligned[0, 0] == 255).all()
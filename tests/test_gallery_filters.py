@@ -0,0 +1,140 @@
+# tests/test_gallery_filters.py
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.schemas.search import SearchFilters
+from app.services.gallery_filters import AttributeIndex, day_number
+
+from test_gallery_index import make_index, unit
+
+CITIZENS = ["UZB", "kaz", " Uzb ", None, "TJK", ""]
+VISAS = ["work", "study", None, "WORK"]
+
+
+def make_attributes(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    days = [date(2025, 1, 1).toordinal() + int(d) for d in rng.integers(0, 60, size=n)]
+    return {
+        "citizenship": [CITIZENS[i] for i in rng.integers(0, len(CITIZENS), size=n)],
+        "visa_type": [VISAS[i] for i in rng.integers(0, len(VISAS), size=n)],
+        "entry_date": [date.fromordinal(d).isoformat() if i % 7 else None for i, d in enumerate(days)],
+        "exit_date": [date.fromordinal(d + 10) for d in days],
+    }
+
+
+def brute_force(attributes, filters: SearchFilters, n: int) -> np.ndarray:
+    """Эталон: проверка каждого фильтра по исходным значениям строки."""
+    def norm(v):
+        return None if v is None or not str(v).strip() else str(v).strip().lower()
+
+    keep = []
+    for i in range(n):
+        ok = True
+        for name in ("citizenship", "visa_type"):
+            wanted = getattr(filters, name)
+            if wanted is not None:
+                ok &= norm(attributes[name][i]) in {norm(w) for w in wanted}
+        for name in ("entry_date", "exit_date"):
+            lo, hi = getattr(filters, f"{name}_from"), getattr(filters, f"{name}_to")
+            if lo is None and hi is None:
+                continue
+            d = day_number(attributes[name][i])
+            if attributes[name][i] is None:
+                ok = False
+                continue
+            ok &= (lo is None or d >= lo.toordinal()) and (hi is None or d <= hi.toordinal())
+        if ok:
+            keep.append(i)
+    return np.array(keep, dtype=np.int64)
+
+
+def as_rows(selection: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(selection) if selection.dtype == bool else selection
+
+
+FILTERS = [
+    SearchFilters(citizenship="uzb"),
+    SearchFilters(citizenship=["KAZ", "tjk"], visa_type="work"),
+    SearchFilters(visa_type="study", entry_date_from=date(2025, 1, 20)),
+    SearchFilters(entry_date_from=date(2025, 1, 10), entry_date_to=date(2025, 1, 15)),
+    SearchFilters(exit_date_to=date(2025, 1, 20), citizenship="UZB,KAZ"),
+    SearchFilters(citizenship="nowhere"),
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("max_rows", [0, 10 ** 6])
+def test_select_matches_brute_force(filters, max_rows):
+    n = 500
+    attributes = make_attributes(n)
+    index = AttributeIndex()
+    index.extend(attributes, n)
+
+    selection = index.select(filters, n, max_rows)
+
+    # мало строк — номера строк, иначе маска; состав один и тот же
+    if max_rows == 0 and np.asarray(brute_force(attributes, filters, n)).size:
+        assert selection.dtype == bool
+    np.testing.assert_array_equal(as_rows(selection), brute_force(attributes, filters, n))
+
+
+def test_select_sees_unsorted_date_tail_and_ignores_rows_past_n():
+    first, second = make_attributes(300, seed=1), make_attributes(20, seed=2)
+    index = AttributeIndex()
+    index.extend(first, 300)
+    index.extend(second, 20)  # хвост меньше FILTER_DATE_TAIL_RATIO — сортировка не пересобрана
+    both = {name: first[name] + second[name] for name in first}
+    filters = SearchFilters(entry_date_from=date(2025, 1, 5), entry_date_to=date(2025, 1, 25))
+
+    np.testing.assert_array_equal(as_rows(index.select(filters, 320, 10 ** 6)), brute_force(both, filters, 320))
+    # читатель со старым снимком (n=300) не видит дописанных строк
+    np.testing.assert_array_equal(as_rows(index.select(filters, 300, 10 ** 6)), brute_force(first, filters, 300))
+
+
+def test_empty_filters_select_everything():
+    index = AttributeIndex()
+    index.extend(make_attributes(20), 20)
+    assert index.select(SearchFilters(), 20, 5).all()
+
+
+def test_missing_attribute_columns_never_match():
+    index = AttributeIndex()
+    index.extend(None, 10)
+    assert as_rows(index.select(SearchFilters(citizenship="UZB"), 10, 100)).size == 0
+    assert as_rows(index.select(SearchFilters(entry_date_from=date(2000, 1, 1)), 10, 100)).size == 0
+
+
+def test_take_and_restore_keep_selection():
+    n = 200
+    attributes = make_attributes(n, seed=3)
+    index = AttributeIndex()
+    index.extend(attributes, n)
+    filters = SearchFilters(citizenship="uzb", exit_date_from=date(2025, 1, 30))
+    expected = brute_force(attributes, filters, n)
+
+    keep = np.arange(0, n, 2)
+    taken = index.take(keep)
+    kept = {name: [values[i] for i in keep] for name, values in attributes.items()}
+    np.testing.assert_array_equal(as_rows(taken.select(filters, keep.size, 10 ** 6)), brute_force(kept, filters, keep.size))
+
+    exported = index.export(n)
+    restored = AttributeIndex.restore(exported["vocab"], exported["columns"])
+    assert restored.size == n
+    np.testing.assert_array_equal(as_rows(restored.select(filters, n, 10 ** 6)), expected)
+
+
+def test_gallery_search_respects_filters():
+    index = make_index()
+    index.replace(
+        ["a", "b", "c"],
+        np.stack([unit(1, 0), unit(1, 0.1), unit(1, 0.2)]),
+        attributes={"citizenship": ["UZB", "KAZ", "uzb"], "visa_type": ["work", "work", "study"]},
+    )
+
+    hits = index.search(unit(1, 0), top_k=5, threshold=-1.0, filters=SearchFilters(citizenship="UZB"))
+    assert [hit[0] for hit in hits] == ["a", "c"]
+
+    hits = index.search(unit(1, 0), top_k=5, threshold=-1.0, filters=SearchFilters(citizenship="uzb", visa_type="study"))
+    assert [hit[0] for hit in hits] == ["c"]
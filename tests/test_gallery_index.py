@@ -0,0 +1,169 @@
+# tests/test_gallery_index.py
+import numpy as np
+
+from app.services.ann_index import ExactBackend
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_templates import PersonTemplates
+
+DIM = 8
+
+
+def unit(*values: float) -> np.ndarray:
+    v = np.zeros(DIM, dtype=np.float32)
+    v[:len(values)] = values
+    return v / np.linalg.norm(v)
+
+
+def make_index(mode: str = "best", per_person: int = 3) -> GalleryIndex:
+    return GalleryIndex(
+        dim=DIM,
+        backend=ExactBackend(),
+        dtype="float32",
+        templates=PersonTemplates(mode, per_person),
+    )
+
+
+def test_search_top_k_sorted_by_score():
+    index = make_index()
+    index.replace(["a", "b", "c"], np.stack([unit(1, 0), unit(1, 1), unit(0, 1)]))
+
+    hits = index.search(unit(1, 0.1), top_k=2, threshold=-1.0)
+
+    assert [hit[0] for hit in hits] == ["a", "b"]
+    assert hits[0][1] > hits[1][1]
+
+
+def test_search_threshold_cuts_weak_hits():
+    index = make_index()
+    index.replace(["a", "b"], np.stack([unit(1, 0), unit(0, 1)]))
+
+    hits = index.search(unit(1, 0), top_k=5, threshold=0.5)
+
+    assert [hit[0] for hit in hits] == ["a"]
+    assert abs(hits[0][1] - 1.0) < 1e-5
+
+
+def test_search_skips_invalid_rows_and_queries():
+    index = make_index()
+    bad = np.full(DIM, np.nan, dtype=np.float32)
+    index.replace(["a", "b"], np.stack([unit(1, 0), bad]))
+
+    assert index.size == 1
+    assert index.search(np.zeros(DIM, dtype=np.float32), top_k=5, threshold=-1.0) == []
+    assert index.search(unit(1, 0), top_k=0, threshold=-1.0) == []
+
+
+def test_search_many_matches_search():
+    index = make_index()
+    rng = np.random.default_rng(0)
+    index.replace([f"p{i}" for i in range(50)], rng.normal(size=(50, DIM)).astype(np.float32))
+    queries = rng.normal(size=(4, DIM)).astype(np.float32)
+
+    batch = index.search_many(queries, top_k=5, threshold=0.0)
+
+    for q, hits in zip(queries, batch):
+        single = index.search(q, top_k=5, threshold=0.0)
+        assert [hit[0] for hit in hits] == [hit[0] for hit in single]
+
+
+def test_hit_carries_snapshot_id_of_matched_row():
+    index = make_index("all")
+    index.replace(
+        ["a", "a", "b"],
+        np.stack([unit(1, 0), unit(0, 1), unit(1, 1)]),
+        snapshot_ids=[11, 12, 21],
+    )
+
+    [(pid, _, sid)] = index.search(unit(0, 1), top_k=1, threshold=0.0)
+    assert (pid, sid) == ("a", 12)
+    [[(pid, _, sid)]] = index.search_many(np.stack([unit(1, 0)]), top_k=1, threshold=0.0)
+    assert (pid, sid) == ("a", 11)
+
+
+def test_rescore_reports_snapshot_of_best_exact_row():
+    exact = {"a": (np.stack([unit(1, 0), unit(0, 1)]), [11, 12])}
+    index = GalleryIndex(
+        dim=DIM,
+        backend=ExactBackend(),
+        dtype="int8",
+        rescore=lambda pids: {pid: exact[pid] for pid in pids if pid in exact},
+        templates=PersonTemplates("best", 1),
+    )
+    # в индексе — только первый снимок, точный пересчёт находит второй
+    index.replace(["a"], np.stack([unit(1, 1)]), snapshot_ids=[11])
+
+    [(pid, score, sid)] = index.search(unit(0, 1), top_k=1, threshold=0.0)
+
+    assert (pid, sid) == ("a", 12)
+    assert abs(score - 1.0) < 1e-5
+
+
+def crowded_gallery(index: GalleryIndex, copies: int = 10) -> None:
+    """"a" — много почти одинаковых снимков ближе всех к запросу, "b" и "c" — дальше."""
+    a = [unit(1, 0.001 * i) for i in range(copies)]
+    index.replace(["a"] * copies + ["b", "c"], np.stack(a + [unit(1, 0.5), unit(1, 1)]))
+
+
+def test_all_mode_finds_top_k_persons_behind_duplicate_snapshots():
+    index = make_index("all", per_person=3)
+    crowded_gallery(index)
+    assert index.size == 12
+
+    hits = index.search(unit(1, 0), top_k=3, threshold=0.0)
+
+    # top_k · fanout = 9 строк заняты снимками "a" — поиск добирает строки
+    assert [hit[0] for hit in hits] == ["a", "b", "c"]
+    [batch] = index.search_many(np.stack([unit(1, 0)]), top_k=3, threshold=0.0)
+    assert batch == hits
+
+
+def test_all_mode_expansion_stops_at_threshold():
+    index = make_index("all", per_person=1)
+    crowded_gallery(index)
+
+    # "b" и "c" ниже порога — добирать нечего, остаётся один человек
+    hits = index.search(unit(1, 0), top_k=3, threshold=0.95)
+    assert [hit[0] for hit in hits] == ["a"]
+
+
+def test_best_mode_keeps_best_quality_snapshots_per_person():
+    index = make_index("best", per_person=2)
+    index.replace(
+        ["a", "a", "a", "b"],
+        np.stack([unit(1, 0), unit(0, 1), unit(1, 1), unit(0, 0, 1)]),
+        quality=[10.0, 1.0, 5.0, 1.0],
+        snapshot_ids=[1, 2, 3, 4],
+    )
+    assert index.size == 3
+
+    # худший по quality снимок "a" (0, 1) в индекс не попал
+    [(pid, score, sid)] = index.search(unit(0, 1), top_k=1, threshold=0.0)
+    assert (pid, sid) == ("a", 3)
+    assert score < 0.99
+
+    # дозапись лучшего снимка выводит худший из оставшихся
+    index.append(["a"], np.stack([unit(0, 1)]), quality=[20.0], snapshot_ids=[5])
+    [(pid, score, sid)] = index.search(unit(0, 1), top_k=1, threshold=0.0)
+    assert (pid, sid) == ("a", 5)
+    [(pid, _, sid)] = index.search(unit(1, 1), top_k=1, threshold=0.0)
+    assert (pid, sid) == ("a", 1)
+
+
+def test_centroid_mode_searches_one_row_per_person():
+    index = make_index("centroid")
+    index.replace(
+        ["a", "a", "b"],
+        np.stack([unit(1, 0), unit(0, 1), unit(0, 0, 1)]),
+        quality=[1.0, 1.0, 1.0],
+    )
+    assert index.size == 2
+
+    [(pid, score, _)] = index.search(unit(1, 1), top_k=1, threshold=0.0)
+    assert pid == "a" and abs(score - 1.0) < 1e-5
+
+    # новый снимок сдвигает центроид, строка человека остаётся одна
+    index.append(["a"], np.stack([unit(1, 0)]), quality=[1.0])
+    assert index.search_many(np.stack([unit(0, 0, 1)]), top_k=5, threshold=-1.0)[0][0][0] == "b"
+    [(pid, score, _)] = index.search(unit(2, 1), top_k=1, threshold=0.0)
+    assert pid == "a" and abs(score - 1.0) < 1e-5
+    assert len(index.search(unit(1, 0), top_k=5, threshold=-1.0)) == 2
@@ -0,0 +1,181 @@
+# tests/test_gallery_refresher.py
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.services.ann_index import ExactBackend
+from app.services.gallery_filters import ATTRIBUTES
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_refresher import GalleryRefresher
+from app.services.gallery_templates import PersonTemplates
+
+DIM = 8
+T0 = datetime(2026, 1, 1)
+
+
+class TableRepo:
+    """face_snapshots как список строк: видимость INSERT'а задаёт сам тест."""
+
+    def __init__(self):
+        self.rows = []
+
+    def insert(self, person_id, snapshot_id, seconds, seed=None):
+        rng = np.random.default_rng(snapshot_id if seed is None else seed)
+        row = {
+            "person_id": person_id,
+            "snapshot_id": snapshot_id,
+            "created_at": T0 + timedelta(seconds=seconds),
+            "embedding": rng.normal(size=DIM).astype(np.float32).tolist(),
+        }
+        self.rows.append(row)
+        return row
+
+    def get_face_embedding_matrix(self, since=None, compact=False, shard=None):
+        rows = sorted(
+            (r for r in self.rows if since is None or r["created_at"] >= since),
+            key=lambda r: r["created_at"],
+        )
+        return {
+            "person_id": [r["person_id"] for r in rows],
+            "snapshot_id": [r["snapshot_id"] for r in rows],
+            "created_at": [r["created_at"] for r in rows],
+            **{name: [None] * len(rows) for name in ATTRIBUTES},
+            "det_score": [None] * len(rows),
+            "blur": [None] * len(rows),
+            "face_size": [None] * len(rows),
+            "embedding": np.asarray([r["embedding"] for r in rows], dtype=np.float32).reshape(-1, DIM),
+        }
+
+
+def make_refresher(repo, lag=30.0):
+    index = GalleryIndex(dim=DIM, backend=ExactBackend(), dtype="float32", templates=PersonTemplates("all"))
+    return GalleryRefresher(index, repo_factory=lambda: repo, lag=lag)
+
+
+def test_refresh_appends_new_rows_and_advances_watermark():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo)
+    assert refresher.full_load() == 1
+
+    repo.insert("b", 2, 5)
+    assert refresher.refresh_once() == 1
+    assert refresher.watermark == T0 + timedelta(seconds=5)
+    assert refresher.index.size == 2
+
+
+def test_overlap_rows_are_not_applied_twice():
+    repo = TableRepo()
+    for i in range(3):
+        repo.insert(f"p{i}", i + 1, 0)  # все на одной секунде — ровно на водяном знаке
+    refresher = make_refresher(repo)
+    refresher.full_load()
+
+    assert refresher.refresh_once() == 0
+    assert refresher.refresh_once() == 0
+    assert refresher.index.size == 3
+
+
+def test_late_visible_insert_inside_lag_is_picked_up():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    repo.insert("b", 2, 20)
+    refresher = make_refresher(repo, lag=30.0)
+    refresher.full_load()
+
+    # INSERT со временем раньше водяного знака стал виден только сейчас
+    repo.insert("late", 3, 10)
+    assert refresher.refresh_once() == 1
+    assert refresher.index.size == 3
+
+
+def test_seen_rows_are_forgotten_outside_lag():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo, lag=5.0)
+    refresher.full_load()
+
+    repo.insert("b", 2, 60)
+    refresher.refresh_once()
+    assert set(refresher._seen) == {2}
+
+
+def test_apply_local_then_refresh_does_not_duplicate():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo)
+    refresher.full_load()
+
+    row = repo.insert("b", 2, 3)
+    refresher.apply_local(row)
+    assert refresher.index.size == 2
+    assert refresher.stats()["pending_local_rows"] == 1
+
+    assert refresher.refresh_once() == 0
+    assert refresher.index.size == 2
+    assert refresher.stats()["pending_local_rows"] == 0
+
+
+def test_refresh_then_apply_local_does_not_duplicate():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo)
+    refresher.full_load()
+
+    row = repo.insert("b", 2, 3)
+    refresher.refresh_once()
+    # INSERT уже пришёл циклом, а apply_local вызван после
+    refresher.apply_local(row)
+    assert refresher.index.size == 2
+    assert refresher.stats()["pending_local_rows"] == 0
+
+
+def test_snapshots_without_face_url_do_not_collide():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo)
+    refresher.full_load()
+
+    # два снимка одного человека без кропа (face_url = None) — разные строки
+    first = repo.insert("b", 2, 3)
+    second = repo.insert("b", 3, 3)
+    refresher.apply_local({**first, "face_url": None})
+    refresher.apply_local({**second, "face_url": None})
+    assert refresher.index.size == 3
+    assert refresher.refresh_once() == 0
+    assert refresher.index.size == 3
+
+
+def test_apply_local_without_snapshot_id_is_skipped():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo)
+    refresher.full_load()
+
+    # строку без snapshot_id не узнать в цикле — её применит только он
+    row = repo.insert("b", 2, 3)
+    refresher.apply_local({**row, "snapshot_id": None})
+    assert refresher.index.size == 1
+    assert refresher.refresh_once() == 1
+    assert refresher.index.size == 2
+
+
+def test_local_row_arriving_late_is_not_duplicated():
+    repo = TableRepo()
+    repo.insert("a", 1, 0)
+    refresher = make_refresher(repo, lag=30.0)
+    refresher.full_load()
+
+    row = {"person_id": "b", "snapshot_id": 2, "embedding": [1.0] * DIM}
+    refresher.apply_local(row)
+    # INSERT долго не виден: циклы идут, водяной знак уходит вперёд
+    for i in range(3):
+        repo.insert(f"p{i}", 10 + i, 100 * (i + 1))
+        refresher.refresh_once()
+    assert refresher.stats()["pending_local_rows"] == 1
+
+    # строка стала видна в окне перекрытия — в индексе она уже есть
+    repo.insert("b", 2, 290)
+    assert refresher.refresh_once() == 0
+    assert refresher.index.size == 5
+    assert refresher.stats()["pending_local_rows"] == 0
@@ -0,0 +1,21 @@
+# tests/test_metrics.py
+import pytest
+
+from app.core import metrics
+from app.core.metrics import Counter
+
+
+def test_counter_samples_use_the_declared_name():
+    counter = Counter("test_requests_total", "Запросы в тесте", ("result",))
+    counter.inc("ok")
+    counter.inc("ok", amount=2)
+
+    lines = counter.render()
+    assert lines[:2] == ["# HELP test_requests_total Запросы в тесте", "# TYPE test_requests_total counter"]
+    assert lines[2:] == ['test_requests_total{result="ok"} 3.0']
+    assert "# TYPE faceid_quality_gate_total counter" in metrics.render()
+
+
+def test_counter_name_without_total_suffix_is_refused():
+    with pytest.raises(ValueError):
+        Counter("test_requests", "Запросы в тесте")
@@ -0,0 +1,50 @@
+# tests/test_register_bulk_stream.py
+import asyncio
+import json
+
+from app.api.router_register import _iter_jsonl
+from app.schemas.register import RegisterInput
+
+
+class ChunkedRequest:
+    def __init__(self, body: bytes, size: int):
+        self.chunks = [body[i:i + size] for i in range(0, len(body), size)]
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def person(name: str, photo: str = "AAAA") -> str:
+    return json.dumps({"full_name": name, "passport": "AA1", "gender": 1, "photos_base64": photo})
+
+
+def collect(body: bytes, size: int):
+    async def run():
+        return [item async for item in _iter_jsonl(ChunkedRequest(body, size))]
+    return asyncio.run(run())
+
+
+def test_lines_split_across_chunks_keep_numbering():
+    long_photo = "A" * 10000
+    lines = [
+        person("first", long_photo),
+        "",
+        "not json",
+        person("last"),
+    ]
+    body = "\n".join(lines).encode()
+
+    for size in (1, 7, 4096, len(body)):
+        items = collect(body, size)
+        assert [line for line, _ in items] == [1, 3, 4]
+        assert isinstance(items[0][1], RegisterInput)
+        assert items[0][1].full_name == "first"
+        assert isinstance(items[1][1], Exception)
+        assert items[2][1].full_name == "last"
+
+
+def test_trailing_newline_and_crlf():
+    body = (person("a") + "\r\n" + person("b") + "\n").encode()
+    items = collect(body, 5)
+    assert [(line, item.full_name) for line, item in items] == [(1, "a"), (2, "b")]
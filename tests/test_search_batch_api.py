@@ -0,0 +1,86 @@
+# tests/test_search_batch_api.py
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import router_search
+from app.core.config import UPLOAD_MAX_BYTES
+from app.dependencies import (
+    get_embedding_cache,
+    get_faceid_repo,
+    get_gallery_index,
+    get_inference_pool,
+    get_shard_gallery,
+)
+
+
+def make_client() -> TestClient:
+    # до сервиса поиска запросы не доходят: проверяется только разбор входа
+    app = FastAPI()
+    app.include_router(router_search.router, prefix="/search")
+    for dep in (get_inference_pool, get_gallery_index, get_faceid_repo, get_embedding_cache, get_shard_gallery):
+        app.dependency_overrides[dep] = lambda: None
+    return TestClient(app)
+
+
+def test_multipart_threshold_not_a_number_is_422():
+    response = make_client().post(
+        "/search/batch",
+        files=[("files", ("a.jpg", b"\xff\xd8", "image/jpeg"))],
+        data={"threshold": "abc"},
+    )
+    assert response.status_code == 422
+
+
+def test_json_body_not_an_object_is_422():
+    response = make_client().post("/search/batch", json=["not", "an", "object"])
+    assert response.status_code == 422
+
+
+def test_invalid_json_is_400():
+    response = make_client().post(
+        "/search/batch", content=b"{", headers={"content-type": "application/json"},
+    )
+    assert response.status_code == 400
+
+
+def test_multipart_file_over_upload_limit_is_413():
+    response = make_client().post(
+        "/search/batch",
+        files=[("files", ("big.jpg", b"\0" * (UPLOAD_MAX_BYTES + 1), "image/jpeg"))],
+    )
+    assert response.status_code == 413
+
+
+class Thresholds:
+    """SearchService, запоминающий порог, с которым его вызвали."""
+
+    seen = []
+
+    def __init__(self, **deps):
+        pass
+
+    async def search_by_image_bytes(self, img_bytes, threshold, filters):
+        self.seen.append(threshold)
+        return {}
+
+    async def search_batch(self, images, threshold, filters):
+        self.seen.append(threshold)
+        return []
+
+
+def test_explicit_zero_threshold_is_not_replaced_by_default(monkeypatch):
+    monkeypatch.setattr(router_search, "SearchService", Thresholds)
+    monkeypatch.setattr(Thresholds, "seen", [])
+    client = make_client()
+    photo = ("a.jpg", b"\xff\xd8", "image/jpeg")
+
+    client.post("/search/upload", files={"file": photo}, data={"threshold": "0"})
+    client.post(
+        "/search/upload", content=b"\xff\xd8",
+        headers={"content-type": "application/octet-stream", "x-threshold": "0"},
+    )
+    client.post("/search/upload", files={"file": photo})
+    client.post("/search/batch", files=[("files", photo)], data={"threshold": "0"})
+    client.post("/search/batch", json={"photos_base64": ["AA=="], "threshold": 0})
+    client.post("/search/batch", files=[("files", photo)])
+    assert Thresholds.seen == [0.0, 0.0, 0.6, 0.0, 0.0, 0.6]
@@ -0,0 +1,25 @@
+# tests/test_search_service.py
+import asyncio
+
+import numpy as np
+
+from app.repositories.memory_repo import MemoryFaceIdRepo
+from app.services.search_service import SearchService
+
+DIM = 8
+
+
+def test_metadata_comes_from_matched_snapshot():
+    repo = MemoryFaceIdRepo(dim=DIM)
+    repo.extend(np.eye(3, DIM, dtype=np.float32), {
+        "person_id": ["a", "a", "b"],
+        "snapshot_id": [11, 12, 21],
+        "face_url": ["a-old.jpg", "a-new.jpg", "b.jpg"],
+    })
+    service = SearchService(repo=repo, pool=None, gallery=None, mode="local")
+
+    # совпал старый снимок "a"; у "b" snapshot_id неизвестен — последний снимок человека
+    faces = asyncio.run(service._faces([[("a", 0.9, 11), ("b", 0.7, 0)]]))
+
+    assert faces["a", 11]["face_url"] == "a-old.jpg"
+    assert faces["b", 0]["face_url"] == "b.jpg"
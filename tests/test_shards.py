@@ -0,0 +1,105 @@
+# tests/test_shards.py
+import asyncio
+import threading
+from datetime import date
+from multiprocessing.connection import Client
+
+import numpy as np
+import pytest
+
+from app.schemas.search import SearchFilters
+from app.services.gallery_shards import ShardedGallery, ShardUnavailable
+from app.services.shard_protocol import ProtocolError, decode, encode, require_authkey
+from app.services.shard_server import ShardServer
+
+from test_gallery_index import make_index, unit
+
+KEY = "test-shard-key"
+
+
+@pytest.fixture
+def shard():
+    index = make_index("all")
+    index.replace(
+        ["a", "b", "c"],
+        np.stack([unit(1, 0), unit(1, 0.2), unit(0, 1)]),
+        attributes={"entry_date": ["2025-01-01", "2025-02-01", "2025-03-01"]},
+        snapshot_ids=[11, 21, 31],
+    )
+    server = ShardServer(index, ("127.0.0.1", 0), authkey=KEY)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.close()
+
+
+def test_frame_round_trip_and_malformed_frames():
+    header, array = decode(encode({"op": "search", "top_k": 3}, np.ones((2, 4), dtype=np.float64)))
+    assert header == {"op": "search", "top_k": 3}
+    assert array.dtype == np.float32 and array.shape == (2, 4)
+    assert decode(encode({"op": "ping"})) == ({"op": "ping"}, None)
+
+    frame = encode({"op": "search"}, np.ones((2, 4)))
+    for bad in (frame[:-1], frame + b"\0", b"\0\0", b"\0\0\0\x05[1,2", encode({"op": "x", "array": [-1]})):
+        with pytest.raises(ProtocolError):
+            decode(bad)
+
+
+@pytest.mark.parametrize("key", ["", "face-id-shard"])
+def test_empty_or_public_authkey_is_refused(key):
+    with pytest.raises(ValueError):
+        require_authkey(key)
+    with pytest.raises(ValueError):
+        ShardServer(make_index(), ("127.0.0.1", 0), authkey=key)
+    with pytest.raises(ValueError):
+        ShardedGallery([("127.0.0.1", 1)], authkey=key)
+
+
+def test_sharded_search_over_the_wire(shard):
+    gallery = ShardedGallery([shard.address], authkey=KEY)
+
+    async def main():
+        hits, status = await gallery.search(unit(1, 0), top_k=2, threshold=0.0)
+        filtered, _ = await gallery.search(
+            unit(1, 0), top_k=5, threshold=-1.0, filters=SearchFilters(entry_date_from=date(2025, 1, 15)),
+        )
+        return hits, status, filtered, await gallery.ping()
+
+    try:
+        hits, status, filtered, ping = asyncio.run(main())
+    finally:
+        gallery.close()
+    assert [(pid, sid) for pid, _, sid in hits] == [("a", 11), ("b", 21)]
+    assert isinstance(hits[0], tuple)
+    assert not status["partial"]
+    assert [hit[0] for hit in filtered] == ["b", "c"]
+    assert ping[0]["size"] == 3
+
+
+UNPICKLED = []
+
+
+def _unpickled():
+    UNPICKLED.append(True)
+
+
+class Exploit:
+    # распаковка pickle вызвала бы _unpickled() в процессе шарда
+    def __reduce__(self):
+        return (_unpickled, ())
+
+
+def test_shard_does_not_unpickle_requests(shard):
+    with Client(shard.address, authkey=KEY.encode()) as conn:
+        conn.send(Exploit())
+        reply, _ = decode(conn.recv_bytes())
+    assert reply["status"] == "error"
+    assert UNPICKLED == []
+
+
+def test_wrong_key_is_rejected(shard):
+    gallery = ShardedGallery([shard.address], authkey="other-key", retry_seconds=0)
+    try:
+        with pytest.raises(ShardUnavailable):
+            asyncio.run(gallery.search(unit(1, 0), top_k=1, threshold=0.0))
+    finally:
+        gallery.close()
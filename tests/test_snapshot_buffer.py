@@ -0,0 +1,157 @@
+# tests/test_snapshot_buffer.py
+import asyncio
+import threading
+
+import pytest
+
+from app.repositories.snapshot_buffer import SnapshotBuffer
+from app.services.provider_ingest_service import ProviderIngestService
+
+
+class Inserts:
+    """insert_rows для буфера: запоминает пакеты, по требованию падает."""
+
+    def __init__(self, fail: int = 0):
+        self.batches = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            if self.fail:
+                self.fail -= 1
+                raise RuntimeError("clickhouse недоступен")
+            self.batches.append([row["n"] for row in rows])
+
+
+def test_full_buffer_flushes_without_waiting_for_delay():
+    inserts = Inserts()
+
+    async def main():
+        buffer = SnapshotBuffer(inserts, max_rows=3, max_delay_ms=60_000)
+        await asyncio.wait_for(asyncio.gather(*(buffer.add({"n": i}) for i in range(3))), 5)
+        await buffer.close()
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert inserts.batches == [[0, 1, 2]]
+    assert stats["full_flushes"] == 1
+    assert stats["rows_written"] == 3
+    assert stats["flush_size_hist"] == {"3-4": 1}
+
+
+def test_rows_flush_after_delay():
+    inserts = Inserts()
+
+    async def main():
+        buffer = SnapshotBuffer(inserts, max_rows=100, max_delay_ms=20)
+        first, second = buffer.add({"n": 0}), buffer.add({"n": 1})
+        await asyncio.wait_for(asyncio.gather(first, second), 5)
+        await buffer.close()
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert inserts.batches == [[0, 1]]
+    assert stats["full_flushes"] == 0
+    assert stats["row_delay_ms"]["p50"] is not None
+
+
+def test_failed_insert_fails_futures_of_its_batch_only():
+    inserts = Inserts(fail=1)
+
+    async def main():
+        buffer = SnapshotBuffer(inserts, max_rows=2, max_delay_ms=60_000)
+        failed = [buffer.add({"n": 0}), buffer.add({"n": 1})]
+        results = await asyncio.wait_for(asyncio.gather(*failed, return_exceptions=True), 5)
+        await asyncio.wait_for(asyncio.gather(buffer.add({"n": 2}), buffer.add({"n": 3})), 5)
+        await buffer.close()
+        return results, buffer.stats()
+
+    results, stats = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert inserts.batches == [[2, 3]]
+    assert (stats["errors"], stats["rows_failed"], stats["rows_written"]) == (1, 2, 2)
+
+
+def test_flush_and_close_write_what_is_buffered():
+    inserts = Inserts()
+
+    async def main():
+        buffer = SnapshotBuffer(inserts, max_rows=100, max_delay_ms=60_000)
+        first = buffer.add({"n": 0})
+        await buffer.flush()
+        assert first.done() and inserts.batches == [[0]]
+
+        last = buffer.add({"n": 1})
+        await asyncio.wait_for(buffer.close(), 5)
+        assert last.done() and last.exception() is None
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert inserts.batches == [[0], [1]]
+    assert stats["buffered_rows"] == 0 and stats["flushing_rows"] == 0
+
+
+class Refresher:
+    def __init__(self):
+        self.applied = []
+
+    def apply_local(self, snapshot):
+        self.applied.append(snapshot["n"])
+
+
+@pytest.mark.parametrize("fail, applied", [(0, [0]), (1, [])])
+def test_ingest_without_wait_applies_locally_only_after_insert(fail, applied):
+    inserts = Inserts(fail=fail)
+    refresher = Refresher()
+
+    async def main():
+        buffer = SnapshotBuffer(inserts, max_rows=1, max_delay_ms=60_000)
+        service = ProviderIngestService(repo=None, pool=None, refresher=refresher, buffer=buffer)
+
+        async def build_snapshot(input):
+            return {"n": 0, "person_id": "p"}
+
+        service.build_snapshot = build_snapshot
+        assert await service.ingest(None, wait_durable=False) == "p"
+        # ответ ушёл до INSERT — в галерее строки ещё нет
+        assert refresher.applied == []
+        await asyncio.wait_for(buffer.close(), 5)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert refresher.applied == applied
+
+
+def test_ingest_cancelled_while_waiting_still_applies_written_row():
+    inserts = Inserts()
+    refresher = Refresher()
+
+    async def main():
+        buffer = SnapshotBuffer(inserts, max_rows=10, max_delay_ms=60_000)
+        service = ProviderIngestService(repo=None, pool=None, refresher=refresher, buffer=buffer)
+
+        async def build_snapshot(input):
+            return {"n": 0, "person_id": "p"}
+
+        service.build_snapshot = build_snapshot
+        # клиент отключился, пока строка ждала пакета
+        request = asyncio.create_task(service.ingest(None, wait_durable=True))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await asyncio.wait_for(buffer.close(), 5)
+        await asyncio.sleep(0)
+
+        assert refresher.applied == [0]
+
+        # дождавшийся запрос видит свою строку в поиске сразу после ответа
+        service.buffer = SnapshotBuffer(inserts, max_rows=1, max_delay_ms=60_000)
+        service.build_snapshot = lambda input: asyncio.sleep(0, {"n": 1, "person_id": "q"})
+        assert await service.ingest(None, wait_durable=True) == "q"
+        assert refresher.applied == [0, 1]
+        await asyncio.wait_for(service.buffer.close(), 5)
+
+    asyncio.run(main())
+    assert inserts.batches == [[0], [1]]
@@ -0,0 +1,135 @@
+# tools/ann_recall_report.py
+"""
+Офлайн-отчёт recall@k для ANN-бэкенда против точного cosine-поиска на одной галерее.
+
+    python -m tools.ann_recall_report --n 1000000 --k 10 --nprobe 4,8,16,32
+    python -m tools.ann_recall_report --source clickhouse --json ivf_report.json
+    python -m tools.ann_recall_report --source npy --npy gallery.npy
+
+recall@k = |ANN top-k ∩ exact top-k| / k, усреднённый по запросам.
+match_recall — то же, но только по точным совпадениям со score >= threshold,
+т.е. по тем строкам, которые реально вернул бы /search.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.ann_index import IVFBackend, exact_search
+from app.services.gallery_index import normalize_rows
+from tools.synthetic import make_gallery, make_queries
+
+
+def load_gallery(args) -> np.ndarray:
+    if args.source == "synthetic":
+        emb, _ = make_gallery(args.n, seed=args.seed)
+        return emb
+    if args.source == "npy":
+        emb, _ = normalize_rows(np.load(args.npy, mmap_mode="r"))
+        return emb
+    if args.source == "clickhouse":
+        from app.repositories.faceid_repo import FaceIdRepo
+        emb, _ = normalize_rows(FaceIdRepo().get_face_embedding_matrix()["embedding"])
+        return emb
+    raise ValueError(args.source)
+
+
+def _percentiles(samples_ms):
+    a = np.asarray(samples_ms)
+    return {
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF recall@k vs exact cosine")
+    parser.add_argument("--source", choices=["synthetic", "npy", "clickhouse"], default="synthetic")
+    parser.add_argument("--npy", help="путь к (N, 512) float32 .npy для --source npy")
+    parser.add_argument("--n", type=int, default=200000, help="размер синтетической галереи")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.6, help="порог /search для match_recall")
+    parser.add_argument("--nlist", type=int, default=0, help="0 = авто (≈ 4·√N)")
+    parser.add_argument("--nprobe", default="1,4,8,16,32,64")
+    parser.add_argument("--train-sample", type=int, default=100000)
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    gallery = load_gallery(args)
+    queries = make_queries(gallery, args.queries, seed=args.seed + 1)
+    print(f"gallery: {gallery.shape[0]} x {gallery.shape[1]}, queries: {queries.shape[0]}, k={args.k}")
+
+    # ── эталон: точный поиск ──
+    truth, matches, exact_ms = [], [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        idx, scores = exact_search(gallery, q, args.k)
+        exact_ms.append((time.perf_counter() - t0) * 1000)
+        truth.append(set(idx.tolist()))
+        matches.append(set(idx[scores >= args.threshold].tolist()))
+
+    # ── IVF ──
+    ivf = IVFBackend(
+        nlist=args.nlist,
+        train_sample=args.train_sample,
+        kmeans_iters=args.iters,
+        min_rows=0,
+        seed=args.seed,
+    )
+    ivf.build(gallery)
+    print(f"ivf build: {ivf.build_seconds:.2f}s, nlist={ivf.stats()['nlist']}")
+
+    report = {
+        "gallery_size": int(gallery.shape[0]),
+        "dim": int(gallery.shape[1]),
+        "queries": int(queries.shape[0]),
+        "k": args.k,
+        "threshold": args.threshold,
+        "source": args.source,
+        "exact": _percentiles(exact_ms),
+        "ivf": {
+            "nlist": ivf.stats()["nlist"],
+            "build_seconds": round(ivf.build_seconds, 3),
+            "runs": [],
+        },
+    }
+    print(f"exact      p50={report['exact']['p50_ms']:8.3f}ms  p95={report['exact']['p95_ms']:8.3f}ms")
+
+    for nprobe in [int(x) for x in args.nprobe.split(",")]:
+        ivf.nprobe = nprobe
+        hits, match_hits, ms = 0, 0, []
+        for q, t, m in zip(queries, truth, matches):
+            t0 = time.perf_counter()
+            idx, _ = ivf.search(gallery, q, args.k)
+            ms.append((time.perf_counter() - t0) * 1000)
+            found = set(idx.tolist())
+            hits += len(t & found)
+            match_hits += len(m & found)
+
+        n_matches = sum(len(m) for m in matches)
+        run = {
+            "nprobe": nprobe,
+            f"recall@{args.k}": round(hits / (args.k * len(truth)), 4),
+            "match_recall": round(match_hits / n_matches, 4) if n_matches else None,
+        }
+        run.update(_percentiles(ms))
+        report["ivf"]["runs"].append(run)
+        print(
+            f"nprobe={nprobe:<4} recall@{args.k}={run[f'recall@{args.k}']:.4f}  "
+            f"match_recall={run['match_recall']}  "
+            f"p50={run['p50_ms']:8.3f}ms  p95={run['p95_ms']:8.3f}ms"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# tools/bench_gallery_load.py
+"""
+Загрузка галереи из ClickHouse: время и пик памяти Python-процесса.
+
+  rows     — прежний путь: get_all_face_embeddings() (строка → dict со всеми
+             метаданными и списком из 512 float) + np.array по embedding'ам;
+  columnar — get_face_embedding_matrix(): по колонкам, embedding байтами
+             (reinterpretAsString) в одну (N, 512) матрицу, без метаданных;
+  compact  — то же для int8-галереи (embedding_i8 + embedding_scale).
+
+Для columnar / compact время включает GalleryIndex.replace (нормировку).
+
+    python -m tools.bench_gallery_load
+    python -m tools.bench_gallery_load --skip-rows --json load.json
+
+Пик — tracemalloc (аллокации Python и NumPy); сам tracemalloc замедляет
+путь с миллионами объектов, поэтому время меряется отдельным прогоном.
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.repositories.faceid_repo import FaceIdRepo
+from app.services.gallery_filters import ATTRIBUTES
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_templates import quality_weights
+
+
+def load_rows(repo: FaceIdRepo) -> int:
+    rows = repo.get_all_face_embeddings()
+    matrix = np.array([r["embedding"] for r in rows if r["embedding"]], dtype=np.float32)
+    return matrix.shape[0]
+
+
+def load_columnar(repo: FaceIdRepo, compact: bool) -> int:
+    cols = repo.get_face_embedding_matrix(compact=compact)
+    gallery = GalleryIndex(dtype="int8" if compact else "float32")
+    gallery.replace(
+        cols["person_id"],
+        cols["embedding"],
+        {name: cols[name] for name in ATTRIBUTES},
+        quality_weights(cols["det_score"], cols["blur"], cols["face_size"]),
+    )
+    return gallery.size
+
+
+def measure(fn) -> dict:
+    gc.collect()
+    t0 = time.perf_counter()
+    rows = fn()
+    seconds = time.perf_counter() - t0
+
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": rows, "seconds": round(seconds, 3), "peak_mb": round(peak / 2 ** 20, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gallery load: row path vs columnar path")
+    parser.add_argument("--skip-rows", action="store_true", help="не мерить прежний путь (долго на больших таблицах)")
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    repo = FaceIdRepo()
+    modes = {
+        "columnar": lambda: load_columnar(repo, compact=False),
+        "compact": lambda: load_columnar(repo, compact=True),
+    }
+    if not args.skip_rows:
+        modes = {"rows": lambda: load_rows(repo), **modes}
+
+    report = {}
+    for mode, fn in modes.items():
+        r = report[mode] = measure(fn)
+        print(f"{mode:<9} rows={r['rows']:>9}  {r['seconds']:8.2f}s  peak={r['peak_mb']:9.1f} MB")
+
+    if "rows" in report:
+        for mode in ("columnar", "compact"):
+            report[f"{mode}_speedup"] = round(report["rows"]["seconds"] / max(report[mode]["seconds"], 1e-9), 1)
+            report[f"{mode}_memory_ratio"] = round(report["rows"]["peak_mb"] / max(report[mode]["peak_mb"], 1e-9), 1)
+        print(f"columnar: ×{report['columnar_speedup']} быстрее, ×{report['columnar_memory_ratio']} меньше пик памяти")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
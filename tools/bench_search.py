@@ -0,0 +1,483 @@
+# tools/bench_search.py
+"""
+Офлайн-бенчмарк поиска без ClickHouse: SearchService поверх MemoryFaceIdRepo
+(app/repositories/memory_repo.py) на синтетических галереях от 10k до 10M строк
+плюс реальные образцы — persons.json и, если есть модели buffalo_l, фото images/persons.
+
+Режимы (каждый — отдельно):
+
+  loop  — прежний путь: все строки из репозитория + cosine в цикле Python
+          (только до --loop-max-rows, --loop-queries запросов);
+  exact — SEARCH_MODE=local, GalleryIndex с точным бэкендом (GEMV по матрице);
+  ivf   — SEARCH_MODE=local, GalleryIndex с IVF-бэкендом (ANN_BACKEND=ivf).
+
+Каждая пара (размер, режим) считается в отдельном процессе — peak RSS не
+смешивается между прогонами. Инференса в замере нет: embedding запроса
+готов заранее (пул-заглушка), меряется поиск + метаданные + ответ сервиса.
+
+    python -m tools.bench_search --sizes 10k,100k,1M --json bench.json
+    python -m tools.bench_search --sizes 10M --dtype int8 --modes exact,ivf --json bench_10m.json
+    python -m tools.bench_search --sizes 100k --json new.json --baseline bench.json --tolerance 0.15
+
+Отчёт — JSON (meta + по строке на размер × режим): p50/p95/p99, QPS одного
+клиента, QPS пакетного поиска, время загрузки галереи, RSS после генерации
+репозитория и peak RSS загрузки + поиска (пик генерации сброшен), доля
+запросов с совпадением, совпадение top-1 с exact. --baseline сравнивает
+p95 и QPS с прошлым отчётом и завершается с кодом 1 при регрессии.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import ANN_BACKEND
+from app.repositories.memory_repo import MemoryFaceIdRepo
+from app.services.ann_index import ExactBackend, IVFBackend
+from app.services.face_pipeline import EMB_SIZE, FaceEmbeddingResult, FaceMeta
+from app.services.gallery_filters import ATTRIBUTES
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_templates import PersonTemplates, quality_weights
+from app.services.quantization import DTYPES
+from app.services.search_service import SEARCH_GATES, SearchService
+from tools.synthetic import make_gallery, make_queries
+
+MODES = ("loop", "exact", "ivf")
+CITIZENSHIP = ("UZB", "KAZ", "RUS", "TJK", "KGZ", "TUR", "CHN", "IND")
+VISA_TYPES = ("tourist", "business", "work", "student", "transit")
+_META = FaceMeta(det_score=0.9, bbox=(0, 0, 0, 0), face_size=120, blur=100.0, faces_found=1)
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    factor = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+# ────────────────────────────────────────────────
+# Галерея
+# ────────────────────────────────────────────────
+def load_samples(persons_json: str, images_dir: str) -> List[Dict[str, Any]]:
+    """
+    Реальные образцы: persons.json (готовые embedding'и) и фото images_dir —
+    только если модели buffalo_l уже скачаны (бенчмарк не тянет их из сети).
+    """
+    samples = []
+    if persons_json and os.path.exists(persons_json):
+        with open(persons_json) as f:
+            for p in json.load(f):
+                if len(p.get("embedding") or []) != EMB_SIZE:
+                    continue
+                samples.append({
+                    "person_id": f"sample-person-{p['id']}",
+                    "full_name": p.get("full_name"),
+                    "passport": p.get("passport"),
+                    "birth_date": p.get("date_of_birth"),
+                    "embedding": p["embedding"],
+                })
+
+    files = sorted(glob.glob(os.path.join(images_dir, "*.jpg"))) if images_dir else []
+    models_dir = os.path.expanduser("~/.insightface/models/buffalo_l")
+    if files and not glob.glob(os.path.join(models_dir, "*.onnx")):
+        print(f"images: модели не найдены в {models_dir} — фото из {images_dir} пропущены")
+        files = []
+    if files:
+        from app.services.face_models import load_face_models
+        from app.services.face_pipeline import embed_image_bytes
+
+        models = load_face_models()
+        for path in files:
+            with open(path, "rb") as f:
+                result = embed_image_bytes(f.read(), models, **SEARCH_GATES)
+            if result is not None:
+                samples.append({
+                    "person_id": f"sample-image-{os.path.basename(path)}",
+                    "full_name": os.path.basename(path),
+                    "face_url": path,
+                    "embedding": result.embedding,
+                })
+    return samples
+
+
+def build_repo(size: int, samples: List[Dict[str, Any]], seed: int) -> MemoryFaceIdRepo:
+    emb, person_idx = make_gallery(size, seed=seed, chunk=16384)
+    rng = np.random.default_rng(seed)
+    ids = [f"synthetic-{p}" for p in person_idx]
+    base = date(2025, 1, 1)
+    entry = rng.integers(0, 365, size=size)
+    repo = MemoryFaceIdRepo()
+    repo.extend(emb, {
+        "person_id": ids,
+        "full_name": [f"Synthetic {p}" for p in person_idx],
+        "passport": [f"SX{p:08d}" for p in person_idx],
+        "citizenship": [CITIZENSHIP[c] for c in rng.integers(0, len(CITIZENSHIP), size=size)],
+        "visa_type": [VISA_TYPES[v] for v in rng.integers(0, len(VISA_TYPES), size=size)],
+        "entry_date": [base + timedelta(days=int(d)) for d in entry],
+        "exit_date": [base + timedelta(days=int(d) + 30) for d in entry],
+        "face_url": [f"synthetic/{i}.jpg" for i in range(size)],
+        "det_score": rng.uniform(0.6, 0.99, size=size).tolist(),
+        "blur": rng.uniform(60.0, 400.0, size=size).tolist(),
+        "face_size": rng.integers(80, 300, size=size).tolist(),
+    })
+    del emb
+    if samples:
+        repo.insert_document_snapshots(samples)
+    return repo
+
+
+def build_queries(repo: MemoryFaceIdRepo, samples: List[Dict[str, Any]], n: int, seed: int) -> np.ndarray:
+    """Синтетические «новые фото» + по зашумлённому запросу на каждый образец."""
+    queries = make_queries(repo.embeddings[:repo.size - len(samples)], n, seed=seed + 1)
+    if samples:
+        own = np.asarray([s["embedding"] for s in samples], dtype=np.float32)
+        own /= np.linalg.norm(own, axis=1, keepdims=True)
+        queries = np.vstack([queries, make_queries(own, len(samples), seed=seed + 2)])
+    return queries
+
+
+class StubPool:
+    """Пул инференса без моделей: байты запроса → заранее посчитанный embedding."""
+
+    def __init__(self, queries: np.ndarray):
+        self.queries = queries
+
+    def _result(self, img_bytes: bytes) -> FaceEmbeddingResult:
+        return FaceEmbeddingResult(embedding=self.queries[int(img_bytes)].tolist(), meta=_META)
+
+    async def embed(self, img_bytes: bytes, gates: Dict[str, Any], **_) -> FaceEmbeddingResult:
+        return self._result(img_bytes)
+
+    async def embed_batch(self, images: List[Optional[bytes]], gates: Dict[str, Any]) -> List[FaceEmbeddingResult]:
+        return [self._result(b) for b in images]
+
+
+# ────────────────────────────────────────────────
+# Один прогон (в отдельном процессе)
+# ────────────────────────────────────────────────
+def _latency(samples_ms: List[float], wall: float) -> Dict[str, Any]:
+    a = np.asarray(samples_ms)
+    return {
+        "queries": int(a.shape[0]),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "qps": round(a.shape[0] / wall, 1) if wall > 0 else None,
+    }
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> None:
+    """Сбросить пик RSS (Linux): генерация синтетики не должна попадать в замер."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    peak = _proc_status_mb("VmHWM")
+    # без /proc — ru_maxrss (КБ), пик за всю жизнь процесса
+    return peak if peak is not None else round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _run_loop(repo, queries, args, n_samples: int) -> Dict[str, Any]:
+    from tools.bench_search_modes import legacy_full_scan
+
+    # прежний путь медленный: первые loop_queries синтетических + запросы образцов
+    synthetic = queries.shape[0] - n_samples
+    queries = np.vstack([queries[:min(args.loop_queries, synthetic)], queries[synthetic:]])
+    ms, top1 = [], []
+    wall = time.perf_counter()
+    for q in queries:
+        t0 = time.perf_counter()
+        hits = legacy_full_scan(repo, q, args.k, args.threshold)
+        ms.append((time.perf_counter() - t0) * 1000)
+        top1.append(hits[0][0] if hits else None)
+    return {**_latency(ms, time.perf_counter() - wall), "top1": top1}
+
+
+async def _run_service(repo, queries, args, mode) -> Dict[str, Any]:
+    backend = IVFBackend(min_rows=0) if mode == "ivf" else ExactBackend()
+    gallery = GalleryIndex(
+        dtype=args.dtype,
+        backend=backend,
+        rescore=repo.get_embeddings_by_person_ids,
+        templates=PersonTemplates(args.templates),
+    )
+
+    # загрузка — как GalleryRefresher.full_load (+ построение IVF)
+    t0 = time.perf_counter()
+    cols = repo.get_face_embedding_matrix(compact=args.dtype == "int8")
+    gallery.replace(
+        cols["person_id"],
+        cols["embedding"],
+        {name: cols[name] for name in ATTRIBUTES},
+        quality_weights(cols["det_score"], cols["blur"], cols["face_size"]),
+        cols["snapshot_id"],
+    )
+    del cols
+    load_seconds = time.perf_counter() - t0
+
+    service = SearchService(repo=repo, pool=StubPool(queries), gallery=gallery, mode="local")
+    keys = [str(i).encode() for i in range(queries.shape[0])]
+
+    # прогрев: пулы потоков, ленивые индексы метаданных
+    for key in keys[:min(5, len(keys))]:
+        await service.search_by_image_bytes(key, top_k=args.k, threshold=args.threshold)
+
+    ms, top1, found = [], [], 0
+    wall = time.perf_counter()
+    for key in keys:
+        t0 = time.perf_counter()
+        r = await service.search_by_image_bytes(key, top_k=args.k, threshold=args.threshold)
+        ms.append((time.perf_counter() - t0) * 1000)
+        if r["status"] != "ok":
+            raise RuntimeError(r["message"])
+        top1.append(r["matches"][0]["person_id"] if r["matches"] else None)
+        found += bool(r["matches"])
+    report = _latency(ms, time.perf_counter() - wall)
+
+    wall = time.perf_counter()
+    for lo in range(0, len(keys), args.batch):
+        await service.search_batch([("bytes", k) for k in keys[lo:lo + args.batch]], top_k=args.k, threshold=args.threshold)
+    batch_wall = time.perf_counter() - wall
+
+    return {
+        **report,
+        "batch_size": args.batch,
+        "batch_qps": round(len(keys) / batch_wall, 1) if batch_wall > 0 else None,
+        "load_seconds": round(load_seconds, 3),
+        "gallery_rows": gallery.size,
+        "gallery_mb": round(gallery.nbytes / 2 ** 20, 1),
+        "match_rate": round(found / len(keys), 4),
+        "top1": top1,
+    }
+
+
+def run_one(size: int, mode: str, samples: List[Dict[str, Any]], args) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    repo = build_repo(size, samples, args.seed)
+    queries = build_queries(repo, samples, args.queries, args.seed)
+    generate_seconds = time.perf_counter() - t0
+    repo_rss_mb = _proc_status_mb("VmRSS")
+    _reset_peak_rss()
+
+    n_samples = len(samples)
+    if mode == "loop":
+        report = _run_loop(repo, queries, args, n_samples)
+    else:
+        report = asyncio.run(_run_service(repo, queries, args, mode))
+
+    if n_samples:
+        hits = [pid == s["person_id"] for pid, s in zip(report["top1"][-n_samples:], samples)]
+        report["sample_top1"] = round(float(np.mean(hits)), 4)
+    return {
+        "size": size,
+        "mode": mode,
+        "dtype": args.dtype if mode != "loop" else "float32",
+        "templates": args.templates if mode != "loop" else "all",
+        "status": "ok",
+        "generate_seconds": round(generate_seconds, 3),
+        **report,
+        "repo_rss_mb": repo_rss_mb,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _child(size, mode, samples, args, conn) -> None:
+    try:
+        conn.send(run_one(size, mode, samples, args))
+    except BaseException as e:
+        conn.send({"size": size, "mode": mode, "status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_isolated(size: int, mode: str, samples, args) -> Dict[str, Any]:
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_child, args=(size, mode, samples, args, child))
+    p.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        # процесс убит (обычно OOM killer) — без ответа
+        result = {"size": size, "mode": mode, "status": "error", "error": "процесс завершился без ответа"}
+    p.join()
+    if p.exitcode and result.get("status") == "ok":
+        result["exitcode"] = p.exitcode
+    return result
+
+
+# ────────────────────────────────────────────────
+# Память, отчёт, сравнение
+# ────────────────────────────────────────────────
+def available_mb() -> Optional[float]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def estimate_mb(size: int, mode: str, dtype: str) -> float:
+    """Грубая оценка пика: float32 в репозитории + галерея + копия IVF + колонки (~300 Б/строка)."""
+    row = EMB_SIZE * 4
+    gallery = EMB_SIZE * {"float32": 4, "float16": 2, "int8": 1}[dtype]
+    if mode == "loop":
+        per_row = row + 512 * 32  # embedding списком Python-float в get_all_face_embeddings
+    else:
+        per_row = row + 2 * gallery + (gallery if mode == "ivf" else 0)
+    return size * (per_row + 300) / 2 ** 20
+
+
+def meta() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "memory_available_mb": round(available_mb() or 0.0),
+    }
+
+
+def _key(r: Dict[str, Any]):
+    return r["size"], r["mode"], r.get("dtype"), r.get("templates")
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Регрессии против прошлого отчёта: p95 выросла или QPS упал больше чем на tolerance."""
+    before = {_key(r): r for r in baseline.get("results", []) if r.get("status") == "ok"}
+    regressions = []
+    for r in results:
+        old = before.get(_key(r))
+        if old is None or r.get("status") != "ok":
+            continue
+        p95, qps = r["p95_ms"] / old["p95_ms"] - 1.0, 1.0 - r["qps"] / old["qps"]
+        line = (
+            f"{r['size']:>9} {r['mode']:<5} p95 {old['p95_ms']:9.3f} → {r['p95_ms']:9.3f} ms ({p95:+.1%})  "
+            f"qps {old['qps']:9.1f} → {r['qps']:9.1f}"
+        )
+        print(line)
+        if p95 > tolerance or qps > tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline SearchService benchmark over synthetic galleries")
+    parser.add_argument("--sizes", default="10k,100k,1M", help="размеры галерей: 10k,100k,1M,10M")
+    parser.add_argument("--modes", default="loop,exact,ivf")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--loop-queries", type=int, default=5, help="прежний путь медленный — меньше запросов")
+    parser.add_argument("--loop-max-rows", type=int, default=100_000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--batch", type=int, default=32, help="фото в одном search_batch для batch_qps")
+    parser.add_argument("--dtype", choices=DTYPES, default="float32", help="формат строк GalleryIndex")
+    parser.add_argument("--templates", default="all", help="GALLERY_TEMPLATES: all | best | centroid")
+    parser.add_argument("--persons-json", default="persons.json")
+    parser.add_argument("--images", default="images/persons", help="фото образцов (нужны модели buffalo_l)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="не пропускать размеры, не влезающие в память")
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    parser.add_argument("--baseline", help="прошлый отчёт: сравнить p95 / QPS")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение для --baseline")
+    args = parser.parse_args()
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"неизвестные режимы: {sorted(unknown)}")
+
+    samples = load_samples(args.persons_json, args.images)
+    report = {
+        "meta": {**meta(), "ann_backend_default": ANN_BACKEND, "samples": len(samples)},
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        "results": [],
+    }
+    print(f"samples: {len(samples)}, queries: {args.queries} (+{len(samples)}), k={args.k}, threshold={args.threshold}")
+
+    free_mb = available_mb()
+    for size in sizes:
+        top1_exact = None
+        for mode in modes:
+            if mode == "loop" and size > args.loop_max_rows:
+                continue
+            need = estimate_mb(size, mode, args.dtype)
+            if free_mb is not None and need > free_mb and not args.force:
+                result = {
+                    "size": size, "mode": mode, "dtype": args.dtype, "status": "skipped",
+                    "error": f"нужно ≈{need:.0f} МБ, доступно {free_mb:.0f} МБ (--force — всё равно запустить)",
+                }
+            else:
+                result = run_isolated(size, mode, samples, args)
+
+            top1 = result.pop("top1", None)
+            if mode == "exact":
+                top1_exact = top1
+            elif top1 is not None and top1_exact is not None:
+                n = min(len(top1), len(top1_exact))
+                result["top1_agreement"] = round(float(np.mean([a == b for a, b in zip(top1[:n], top1_exact[:n])])), 4)
+            report["results"].append(result)
+
+            if result["status"] == "ok":
+                print(
+                    f"{size:>9} {mode:<5} p50={result['p50_ms']:9.3f} p95={result['p95_ms']:9.3f} "
+                    f"p99={result['p99_ms']:9.3f} ms  qps={result['qps']:8.1f}"
+                    + (f"  batch_qps={result['batch_qps']:8.1f}" if "batch_qps" in result else "")
+                    + f"  rss={result['peak_rss_mb']:8.1f} MB"
+                    + (f"  top1_agreement={result['top1_agreement']}" if "top1_agreement" in result else "")
+                )
+            else:
+                print(f"{size:>9} {mode:<5} {result['status']}: {result.get('error')}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"report → {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        if regressions:
+            print(f"регрессии (> {args.tolerance:.0%}): {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
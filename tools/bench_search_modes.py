@@ -0,0 +1,167 @@
+# tools/bench_search_modes.py
+"""
+Три способа поиска против одной и той же локальной ClickHouse:
+
+  full_scan  — прежний путь: get_all_face_embeddings() (вся таблица со всеми
+               метаданными) + цикл cosine в Python;
+  clickhouse — SEARCH_MODE=clickhouse: search_similar, по сети только top_k строк;
+  local      — SEARCH_MODE=local: резидентный GalleryIndex + метаданные совпадений
+               (время загрузки галереи печатается отдельно).
+
+    python -m tools.bench_search_modes --queries 50
+    python -m tools.bench_search_modes --populate 100000 --queries 50 --json modes.json
+    python -m tools.bench_search_modes --cleanup
+
+--populate N дописывает N синтетических строк (person_id с префиксом bench-),
+--cleanup удаляет их. Только для локального стенда.
+"""
+import argparse
+import json
+import time
+import uuid
+
+import numpy as np
+
+from app.repositories.faceid_repo import FaceIdRepo
+from app.services.gallery_index import GalleryIndex, normalize_rows
+from app.services.gallery_templates import PersonTemplates
+from tools.synthetic import make_gallery, make_queries
+
+BENCH_PREFIX = "bench-"
+
+
+def legacy_full_scan(repo: FaceIdRepo, query: np.ndarray, top_k: int, threshold: float):
+    """Старый SearchService: вся таблица в Python, cosine по строке."""
+    q_norm = np.linalg.norm(query)
+    matches = []
+    for c in repo.get_all_face_embeddings():
+        emb = c.get("embedding")
+        if not emb:
+            continue
+        db_embedding = np.array(emb, dtype=np.float32)
+        if np.any(np.isnan(db_embedding)) or np.any(np.isinf(db_embedding)):
+            continue
+        d_norm = np.linalg.norm(db_embedding)
+        if d_norm == 0.0 or len(db_embedding) != len(query):
+            continue
+        score = float(np.dot(query, db_embedding) / (q_norm * d_norm))
+        if np.isfinite(score) and score >= threshold:
+            matches.append((c.get("person_id"), score))
+    matches.sort(key=lambda m: m[1], reverse=True)
+    return matches[:top_k]
+
+
+def populate(repo: FaceIdRepo, n: int, batch: int = 5000) -> None:
+    emb, person_idx = make_gallery(n)
+    for lo in range(0, n, batch):
+        repo.insert_document_snapshots([
+            {
+                "person_id": f"{BENCH_PREFIX}{person_idx[i]}",
+                "full_name": "bench",
+                "passport": "bench",
+                "sex": 1,
+                "face_url": f"bench/{uuid.uuid4()}.jpg",
+                "embedding": emb[i].tolist(),
+                "embedding_status": 1,
+                "det_score": 0.9,
+                "blur": 100.0,
+                "face_size": 120,
+                "faces_found": 1,
+            }
+            for i in range(lo, min(lo + batch, n))
+        ])
+        print(f"populate: {min(lo + batch, n)}/{n}")
+
+
+def cleanup(repo: FaceIdRepo) -> None:
+    repo.client.execute(
+        "ALTER TABLE face_id_boom.face_snapshots DELETE WHERE startsWith(person_id, %(p)s)",
+        {"p": BENCH_PREFIX},
+    )
+    print("cleanup: мутация удаления bench-строк отправлена")
+
+
+def _timed(fn, queries):
+    ms, out = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        out.append(fn(q))
+        ms.append((time.perf_counter() - t0) * 1000)
+    return out, {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "mean_rows_returned": round(float(np.mean([len(r) for r in out])), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="full scan vs ClickHouse pushdown vs local index")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--full-scan-queries", type=int, default=5, help="прежний путь медленный — меньше запросов")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--populate", type=int, default=0)
+    parser.add_argument("--cleanup", action="store_true")
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    repo = FaceIdRepo()
+    if args.cleanup:
+        cleanup(repo)
+        return
+    if args.populate:
+        populate(repo, args.populate)
+
+    t0 = time.perf_counter()
+    cols = repo.get_face_embedding_matrix()
+    # все снимки, как у ClickHouse: сравниваем режимы поиска, а не отбор шаблонов
+    gallery = GalleryIndex(dtype="float32", templates=PersonTemplates("all"))
+    gallery.replace(cols["person_id"], cols["embedding"], snapshot_ids=cols["snapshot_id"])
+    load_seconds = time.perf_counter() - t0
+    if gallery.size == 0:
+        print("таблица пуста — запустите с --populate N")
+        return
+
+    queries = make_queries(normalize_rows(cols["embedding"])[0], args.queries, seed=1)
+    print(f"rows: {gallery.size}, queries: {len(queries)}, k={args.k}, local load: {load_seconds:.2f}s")
+
+    def local(q):
+        hits = gallery.search(q, args.k, args.threshold)
+        faces = repo.get_faces_by_snapshot_ids([sid for _, _, sid in hits])
+        return [(pid, s, faces.get(sid)) for pid, s, sid in hits]
+
+    local_hits, local_stats = _timed(local, queries)
+    ch_hits, ch_stats = _timed(lambda q: repo.search_similar(q.tolist(), args.k, args.threshold), queries)
+    _, full_stats = _timed(
+        lambda q: legacy_full_scan(repo, q, args.k, args.threshold),
+        queries[:args.full_scan_queries],
+    )
+
+    agree = np.mean([
+        [pid for pid, _, _ in a] == [r["person_id"] for r in b]
+        for a, b in zip(local_hits, ch_hits)
+    ])
+
+    report = {
+        "rows": gallery.size,
+        "k": args.k,
+        "threshold": args.threshold,
+        "local_load_seconds": round(load_seconds, 3),
+        "full_scan": full_stats,
+        "clickhouse": ch_stats,
+        "local": local_stats,
+        "clickhouse_vs_local_agreement": round(float(agree), 4),
+    }
+    for mode in ("full_scan", "clickhouse", "local"):
+        r = report[mode]
+        print(f"{mode:<11} p50={r['p50_ms']:9.2f}ms  p95={r['p95_ms']:9.2f}ms  rows/query={r['mean_rows_returned']}")
+    print(f"clickhouse vs local top-{args.k} agreement: {agree:.4f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# tools/bench_upload.py
+"""
+JSON+base64 против бинарной загрузки (multipart, octet-stream) для одного фото.
+
+Две части:
+
+  parse — в процессе, без сети и моделей: ровно тот серверный код, который
+          превращает тело запроса в байты фото (request.json() + b64_to_bytes
+          против read_binary_upload). Время и пиковая память (tracemalloc);
+  live  — с --url: реальные запросы к запущенному сервису, латентность p50/p95
+          по каждому варианту (/search против /search/upload).
+
+    python -m tools.bench_upload --image images/persons/x.jpg --repeat 50
+    python -m tools.bench_upload --image big.jpg --url http://localhost:8000 --json upload.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+
+from app.api.upload import read_binary_upload
+from app.services.utils import b64_to_bytes
+
+CHUNK = 64 * 1024  # как uvicorn отдаёт тело — кусками
+
+
+def encode(kind: str, img: bytes):
+    """(тело, content-type) для варианта kind"""
+    if kind == "json":
+        body = json.dumps({"photos_base64": base64.b64encode(img).decode(), "threshold": 0.6}).encode()
+        return body, "application/json"
+    if kind == "multipart":
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="threshold"\r\n\r\n0.6\r\n'
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="photo.jpg"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + img + f"\r\n--{boundary}--\r\n".encode()
+        return body, f"multipart/form-data; boundary={boundary}"
+    if kind == "octet":
+        return img, "application/octet-stream"
+    raise ValueError(kind)
+
+
+def _request(body: bytes, content_type: str):
+    from starlette.requests import Request
+
+    chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)] or [b""]
+    it = iter(range(len(chunks)))
+
+    async def receive():
+        i = next(it, None)
+        if i is None:
+            return {"type": "http.disconnect"}
+        return {"type": "http.request", "body": chunks[i], "more_body": i < len(chunks) - 1}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    }
+    return Request(scope, receive)
+
+
+async def server_parse(kind: str, body: bytes, content_type: str) -> bytes:
+    request = _request(body, content_type)
+    if kind == "json":
+        data = await request.json()
+        return b64_to_bytes(data["photos_base64"])
+    img, _ = await read_binary_upload(request)
+    return img
+
+
+def bench_parse(img: bytes, repeat: int):
+    out = {}
+    for kind in ("json", "multipart", "octet"):
+        body, ct = encode(kind, img)
+        assert asyncio.run(server_parse(kind, body, ct)) == img
+
+        ms = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            asyncio.run(server_parse(kind, body, ct))
+            ms.append((time.perf_counter() - t0) * 1000)
+
+        tracemalloc.start()
+        asyncio.run(server_parse(kind, body, ct))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        out[kind] = {
+            "payload_bytes": len(body),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "peak_alloc_mb": round(peak / 1e6, 2),
+        }
+    return out
+
+
+def bench_live(img: bytes, url: str, repeat: int):
+    import requests
+
+    routes = {"json": "/search", "multipart": "/search/upload", "octet": "/search/upload"}
+    out = {}
+    with requests.Session() as s:
+        for kind, path in routes.items():
+            body, ct = encode(kind, img)
+            ms = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                r = s.post(url.rstrip("/") + path, data=body, headers={"Content-Type": ct})
+                ms.append((time.perf_counter() - t0) * 1000)
+                r.raise_for_status()
+            out[kind] = {
+                "route": path,
+                "payload_bytes": len(body),
+                "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(ms, 95)), 2),
+            }
+    return out
+
+
+def _print(title, rows):
+    print(title)
+    for kind, r in rows.items():
+        extra = f"  peak={r['peak_alloc_mb']:.2f}MB" if "peak_alloc_mb" in r else ""
+        print(f"  {kind:<10} {r['payload_bytes'] / 1e6:7.2f}MB  p50={r['p50_ms']:8.3f}ms  p95={r['p95_ms']:8.3f}ms{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="base64 JSON vs binary upload")
+    parser.add_argument("--image", required=True, help="JPEG/PNG для загрузки")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--url", help="адрес запущенного сервиса для live-замера")
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        img = f.read()
+
+    report = {"image": args.image, "image_bytes": len(img), "parse": bench_parse(img, args.repeat)}
+    _print(f"server-side parse ({len(img) / 1e6:.2f}MB image)", report["parse"])
+
+    if args.url:
+        report["live"] = bench_live(img, args.url, args.repeat)
+        _print(f"live {args.url}", report["live"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
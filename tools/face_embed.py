@@ -0,0 +1,100 @@
+# tools/face_embed.py
+"""
+Кадр → embedding синхронно, в текущем процессе: для офлайн-замеров (tools/).
+Сервис так не считает — там детекция в пуле воркеров и общий batch ArcFace
+(detect_image_bytes / RecognitionBatcher).
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+from insightface.app import FaceAnalysis
+
+from app.core.config import DECODE_MAX_SIDE
+from app.services.face_pipeline import (
+    EMB_SIZE,
+    FaceCandidate,
+    FaceEmbeddingResult,
+    detect_best_face,
+    embed_aligned,
+)
+from app.services.utils import fit_max_side
+
+
+def get_face_embedding_strict(
+    image_bgr: np.ndarray,
+    face_app: FaceAnalysis,
+    *,
+    min_det_score: float = 0.60,
+    min_face_size: int = 80,
+    min_blur: float = 60.0
+) -> Optional[FaceEmbeddingResult]:
+    """
+    Извлекает лучшее лицо с жёсткими проверками качества.
+    Возвращает embedding + метаданные или None, если качество не прошло.
+    Recognition запускается только для одного выбранного лица.
+    """
+    work, scale = fit_max_side(image_bgr, DECODE_MAX_SIDE)
+    candidate = detect_best_face(
+        work,
+        face_app,
+        scale=scale,
+        original=lambda: image_bgr,
+        min_det_score=min_det_score,
+        min_face_size=min_face_size,
+        min_blur=min_blur,
+    )
+    if candidate is None:
+        return None
+
+    embedding = embed_aligned(face_app, [candidate.aligned])[0].tolist()
+    if len(embedding) != EMB_SIZE:
+        return None
+
+    return FaceEmbeddingResult(embedding=embedding, meta=candidate.meta)
+
+
+def get_face_embeddings_batch(
+    images_bgr: Sequence[Optional[np.ndarray]],
+    face_app: FaceAnalysis,
+    *,
+    min_det_score: float = 0.60,
+    min_face_size: int = 80,
+    min_blur: float = 60.0
+) -> List[Optional[FaceEmbeddingResult]]:
+    """
+    Детекция по каждому изображению, затем один batch recognition на все лица,
+    прошедшие quality gates. Порядок результатов совпадает с порядком входа;
+    None — изображение отсутствует или не прошло проверки.
+    """
+    candidates: List[Optional[FaceCandidate]] = []
+    for img in images_bgr:
+        if img is None:
+            candidates.append(None)
+            continue
+        work, scale = fit_max_side(img, DECODE_MAX_SIDE)
+        candidates.append(detect_best_face(
+            work,
+            face_app,
+            scale=scale,
+            original=lambda img=img: img,
+            min_det_score=min_det_score,
+            min_face_size=min_face_size,
+            min_blur=min_blur,
+        ))
+
+    chosen = [c for c in candidates if c is not None]
+    feats = embed_aligned(face_app, [c.aligned for c in chosen])
+
+    results: List[Optional[FaceEmbeddingResult]] = []
+    it = iter(feats)
+    for c in candidates:
+        if c is None:
+            results.append(None)
+            continue
+        emb = next(it)
+        if emb.shape[0] != EMB_SIZE:
+            results.append(None)
+            continue
+        results.append(FaceEmbeddingResult(embedding=emb.tolist(), meta=c.meta))
+
+    return results
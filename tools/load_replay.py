@@ -0,0 +1,422 @@
+# tools/load_replay.py
+"""
+Нагрузочный прогон запущенного сервиса: смесь /register и /search.
+
+Источник запросов:
+
+  по умолчанию — фото из photo_base64.txt (регистрация, у каждой — свои ФИО и
+                 паспорт) и search_photo.txt (поиск), доли — --mix;
+  --capture F  — записанный трафик, JSONL по запросу на строку:
+                 {"path": "/search", "body": {...}} (необязательно "name"),
+                 проигрывается по кругу в порядке файла.
+
+Модель нагрузки:
+
+  --rate R         — открытая: прибытия Пуассона с интенсивностью R/с, не
+                     зависящие от ответов сервиса; латентность считается от
+                     запланированного момента отправки (без coordinated omission);
+  --concurrency C  — закрытая: C клиентов, каждый шлёт следующий запрос после ответа;
+  --steps 5,10,20  — открытая нагрузка ступенями по --step-seconds: точка
+                     насыщения — первая ступень, где пропускная способность
+                     отстала от заданной, выросли ошибки или p99 вышла за --slo-ms.
+
+    FACEID_REPO=memory INFERENCE_WORKERS=2 uvicorn app.main:app --port 8000
+    python -m tools.load_replay --url http://localhost:8000 --rate 20 --duration 60 --json load.json
+    python -m tools.load_replay --url http://localhost:8000 --steps 5,10,20,40 --step-seconds 30 --slo-ms 500
+    python -m tools.load_replay --url http://localhost:8000 --capture traffic.jsonl --concurrency 8 --requests 2000
+
+Отчёт: по каждому типу запроса и в целом — p50/p90/p95/p99, гистограмма
+латентности (границы faceid_stage_seconds), доля и виды ошибок, пропускная
+способность; таймлайн по секундам (отправлено, завершено, ошибки, p50/p95);
+для --steps — строка на ступень, точка насыщения и /inference/pool после
+каждой ступени. Клиент делит машину с сервисом, если запущен на ней же, —
+для поиска насыщения его лучше запускать на соседней машине.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from app.core.metrics import LATENCY_BUCKETS
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass
+class Sample:
+    name: str
+    scheduled: float  # запланированный момент отправки (perf_counter)
+    started: float
+    finished: float
+    outcome: str      # ok | http_<код> | app_error | timeout | connect | <исключение>
+
+    @property
+    def latency(self) -> float:
+        return self.finished - self.scheduled
+
+    @property
+    def service_time(self) -> float:
+        return self.finished - self.started
+
+
+# ────────────────────────────────────────────────
+# Источник запросов
+# ────────────────────────────────────────────────
+Request = Tuple[str, str, Dict[str, Any]]  # (тип, путь, JSON-тело)
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """"search=9,register=1" → {"search": 9.0, "register": 1.0}"""
+    mix = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def builtin_requests(args) -> Iterator[Request]:
+    with open(args.register_photo) as f:
+        register_b64 = f.read().strip()
+    with open(args.search_photo) as f:
+        search_b64 = f.read().strip()
+
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - {"register", "search"}
+    if unknown:
+        raise ValueError(f"--mix: неизвестные типы {sorted(unknown)}")
+    names, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+    run = f"{int(time.time()) % 100000:05d}"
+
+    n = 0
+    while True:
+        name = rng.choices(names, weights)[0]
+        n += 1
+        if name == "register":
+            yield name, "/register", {
+                "photos_base64": register_b64,
+                "full_name": f"Load Test {run}-{n}",
+                "passport": f"LT{run}{n:07d}",
+                "gender": 1 + n % 2,
+                "citizenship": "UZB",
+            }
+        else:
+            yield name, "/search", {"photos_base64": search_b64, "threshold": args.threshold}
+
+
+def capture_requests(path: str) -> Iterator[Request]:
+    entries = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "path" not in entry or "body" not in entry:
+                raise ValueError(f"{path}:{line_no}: нужны поля path и body")
+            entries.append((entry.get("name") or entry["path"].strip("/"), entry["path"], entry["body"]))
+    if not entries:
+        raise ValueError(f"{path}: нет запросов")
+    while True:
+        yield from entries
+
+
+# ────────────────────────────────────────────────
+# Отправка
+# ────────────────────────────────────────────────
+async def send(client: httpx.AsyncClient, request: Request, scheduled: float) -> Sample:
+    name, path, body = request
+    started = time.perf_counter()
+    try:
+        r = await client.post(path, json=body)
+        if r.status_code != 200:
+            outcome = f"http_{r.status_code}"
+        else:
+            # /search отвечает 200 и на ошибки разбора фото — со status=error в теле
+            outcome = "app_error" if r.json().get("status") == "error" else "ok"
+    except httpx.TimeoutException:
+        outcome = "timeout"
+    except httpx.TransportError:
+        outcome = "connect"
+    except Exception as e:
+        outcome = type(e).__name__
+    return Sample(name, scheduled, started, time.perf_counter(), outcome)
+
+
+class Runner:
+    def __init__(self, client: httpx.AsyncClient, source: Iterator[Request], max_in_flight: int, seed: int):
+        self.client = client
+        self.source = source
+        self.max_in_flight = max_in_flight
+        self.rng = random.Random(seed)
+        self.samples: List[Sample] = []
+        self.dropped = 0  # открытая нагрузка: прибытия сверх max_in_flight (клиент не успевает)
+        self._in_flight = 0
+
+    async def _one(self, request: Request, scheduled: float) -> None:
+        # _in_flight увеличивает вызывающий — до create_task, иначе пачка прибытий его не видит
+        try:
+            self.samples.append(await send(self.client, request, scheduled))
+        finally:
+            self._in_flight -= 1
+
+    async def open_loop(self, rate: float, duration: float, limit: Optional[int], arrival: str) -> None:
+        """Прибытия по расписанию, не дожидаясь ответов."""
+        tasks = set()
+        start = time.perf_counter()
+        next_at = start
+        sent = 0
+        while (limit is None or sent < limit) and next_at - start < duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._in_flight >= self.max_in_flight:
+                self.dropped += 1
+            else:
+                self._in_flight += 1
+                task = asyncio.create_task(self._one(next(self.source), next_at))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            sent += 1
+            next_at += self.rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def closed_loop(self, concurrency: int, duration: float, limit: Optional[int]) -> None:
+        """concurrency клиентов, каждый — запрос за запросом."""
+        deadline = time.perf_counter() + duration
+        budget = [limit]
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                if budget[0] is not None:
+                    if budget[0] <= 0:
+                        return
+                    budget[0] -= 1
+                self._in_flight += 1
+                await self._one(next(self.source), time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+# ────────────────────────────────────────────────
+# Отчёт
+# ────────────────────────────────────────────────
+def _ms(seconds: np.ndarray, q: float) -> float:
+    return round(float(np.percentile(seconds, q)) * 1000, 2)
+
+
+def histogram(latencies: np.ndarray) -> Dict[str, int]:
+    """Число запросов по корзинам (не накопительно), границы в секундах."""
+    bounds = np.asarray(LATENCY_BUCKETS)
+    counts = np.bincount(np.searchsorted(bounds, latencies, side="left"), minlength=len(bounds) + 1)
+    return {**{f"le_{b:g}": int(c) for b, c in zip(bounds, counts)}, "le_inf": int(counts[-1])}
+
+
+def summarize(samples: List[Sample], window: float) -> Dict[str, Any]:
+    if not samples:
+        return {"requests": 0}
+    latency = np.asarray([s.latency for s in samples])
+    service = np.asarray([s.service_time for s in samples])
+    ok = sum(s.outcome == "ok" for s in samples)
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if s.outcome != "ok":
+            errors[s.outcome] = errors.get(s.outcome, 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": ok,
+        "error_rate": round(1 - ok / len(samples), 4),
+        "errors": errors,
+        "throughput_rps": round(ok / window, 2) if window > 0 else None,
+        "completed_rps": round(len(samples) / window, 2) if window > 0 else None,
+        **{f"p{q}_ms": _ms(latency, q) for q in PERCENTILES},
+        "max_ms": round(float(latency.max()) * 1000, 2),
+        "service_p50_ms": _ms(service, 50),
+        "service_p99_ms": _ms(service, 99),
+        "histogram": histogram(latency),
+    }
+
+
+def timeline(samples: List[Sample], start: float) -> List[Dict[str, Any]]:
+    """По секундам: отправлено (по расписанию), завершено, ошибки, латентность завершённых."""
+    if not samples:
+        return []
+    seconds = int(max(s.finished for s in samples) - start) + 1
+    rows = [{"second": i, "sent": 0, "completed": 0, "errors": 0, "_lat": []} for i in range(seconds)]
+    for s in samples:
+        rows[min(seconds - 1, max(0, int(s.scheduled - start)))]["sent"] += 1
+        row = rows[min(seconds - 1, int(s.finished - start))]
+        row["completed"] += 1
+        row["errors"] += s.outcome != "ok"
+        row["_lat"].append(s.latency)
+    for row in rows:
+        lat = np.asarray(row.pop("_lat"))
+        row["p50_ms"] = _ms(lat, 50) if lat.size else None
+        row["p95_ms"] = _ms(lat, 95) if lat.size else None
+    return rows
+
+
+def report(samples: List[Sample], start: float, window: float, dropped: int) -> Dict[str, Any]:
+    by_name: Dict[str, List[Sample]] = {}
+    for s in samples:
+        by_name.setdefault(s.name, []).append(s)
+    return {
+        "window_seconds": round(window, 3),
+        "dropped": dropped,
+        "total": summarize(samples, window),
+        "by_type": {name: summarize(group, window) for name, group in sorted(by_name.items())},
+        "timeline": timeline(samples, start),
+    }
+
+
+def saturated(step: Dict[str, Any], args) -> List[str]:
+    """Причины, по которым ступень считается за точкой насыщения."""
+    total = step["total"]
+    reasons = []
+    if step["dropped"]:
+        reasons.append(f"dropped={step['dropped']}")
+    if not total.get("requests"):
+        return reasons + ["нет ответов"]
+    # с фактической частотой прибытий, а не с заданной: у Пуассона за короткую ступень они расходятся
+    if total["completed_rps"] < (1 - args.rate_tolerance) * step["arrival_rps"]:
+        reasons.append(f"completed {total['completed_rps']} req/s < arrivals {step['arrival_rps']} req/s")
+    if total["error_rate"] > args.max_error_rate:
+        reasons.append(f"error_rate={total['error_rate']}")
+    if args.slo_ms and total["p99_ms"] > args.slo_ms:
+        reasons.append(f"p99={total['p99_ms']} ms > {args.slo_ms} ms")
+    return reasons
+
+
+def print_summary(title: str, rep: Dict[str, Any]) -> None:
+    print(title)
+    for name, r in [("total", rep["total"]), *rep["by_type"].items()]:
+        if not r.get("requests"):
+            continue
+        print(
+            f"  {name:<10} n={r['requests']:<6} ok/s={r['throughput_rps']:<8} err={r['error_rate']:.2%}  "
+            + "  ".join(f"p{q}={r[f'p{q}_ms']:.1f}" for q in PERCENTILES)
+            + f" ms  {r['errors'] or ''}"
+        )
+    if rep["dropped"]:
+        print(f"  dropped (max in flight): {rep['dropped']}")
+
+
+async def server_stats(client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
+    try:
+        r = await client.get("/inference/pool")
+        return r.json() if r.status_code == 200 else None
+    except Exception:
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    source = capture_requests(args.capture) if args.capture else builtin_requests(args)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits) as client:
+        runner = Runner(client, source, args.max_in_flight, args.seed)
+
+        if args.warmup:
+            await runner.closed_loop(1, float("inf"), args.warmup)
+            runner.samples.clear()
+
+        if args.steps:
+            steps, saturation = [], None
+            for rate in [float(r) for r in args.steps.split(",") if r.strip()]:
+                runner.samples, runner.dropped = [], 0
+                start = time.perf_counter()
+                await runner.open_loop(rate, args.step_seconds, None, args.arrival)
+                step = {
+                    "offered_rps": rate,
+                    "arrival_rps": round((len(runner.samples) + runner.dropped) / args.step_seconds, 2),
+                    **report(runner.samples, start, time.perf_counter() - start, runner.dropped),
+                    "server": await server_stats(client),
+                }
+                step["saturated"] = saturated(step, args)
+                steps.append(step)
+                print_summary(f"step {rate:g} req/s" + (f"  SATURATED: {', '.join(step['saturated'])}" if step["saturated"] else ""), step)
+                if step["saturated"] and saturation is None:
+                    saturation = rate
+                    if not args.keep_going:
+                        break
+            good = [s["offered_rps"] for s in steps if not s["saturated"]]
+            return {
+                "steps": steps,
+                "saturation_rps": saturation,
+                "max_sustained_rps": max(good) if good else None,
+            }
+
+        start = time.perf_counter()
+        if args.rate:
+            await runner.open_loop(args.rate, args.duration, args.requests, args.arrival)
+        else:
+            await runner.closed_loop(args.concurrency, args.duration, args.requests)
+        result = report(runner.samples, start, time.perf_counter() - start, runner.dropped)
+        result["server"] = await server_stats(client)
+        print_summary(
+            f"{'open loop ' + format(args.rate, 'g') + ' req/s' if args.rate else f'closed loop x{args.concurrency}'}",
+            result,
+        )
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay /register + /search traffic against a running service")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--capture", help="JSONL записанного трафика: {\"path\", \"body\"} на строку")
+    parser.add_argument("--mix", default="search=9,register=1", help="доли типов без --capture")
+    parser.add_argument("--register-photo", default="photo_base64.txt")
+    parser.add_argument("--search-photo", default="search_photo.txt")
+    parser.add_argument("--threshold", type=float, default=0.5)
+
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rate", type=float, help="открытая нагрузка: запросов в секунду")
+    load.add_argument("--concurrency", type=int, default=4, help="закрытая нагрузка: клиентов")
+    load.add_argument("--steps", help="открытая нагрузка ступенями: 5,10,20,40 req/s")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--duration", type=float, default=30.0, help="сек (без --steps)")
+    parser.add_argument("--requests", type=int, help="остановиться после N запросов")
+    parser.add_argument("--step-seconds", type=float, default=30.0)
+    parser.add_argument("--warmup", type=int, default=5, help="запросов до замера (модели, пулы соединений)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="потолок одновременных запросов клиента")
+    parser.add_argument("--timeout", type=float, default=30.0, help="сек на запрос")
+
+    parser.add_argument("--slo-ms", type=float, help="p99 выше — ступень насыщена")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--rate-tolerance", type=float, default=0.05, help="допустимое отставание пропускной способности")
+    parser.add_argument("--keep-going", action="store_true", help="не останавливать --steps на насыщении")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    result = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "url": args.url,
+            "source": args.capture or f"builtin mix {args.mix}",
+            "client_cpu_count": os.cpu_count(),
+            "latency_buckets_seconds": list(LATENCY_BUCKETS),
+        },
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        **result,
+    }
+    if "saturation_rps" in result:
+        print(f"saturation: {result['saturation_rps']} req/s, max sustained: {result['max_sustained_rps']} req/s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
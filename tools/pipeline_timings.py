@@ -0,0 +1,149 @@
+# tools/pipeline_timings.py
+"""
+До/после для face-пайплайна на образцах из images/:
+
+  before — FaceAnalysis('buffalo_l') со всеми модулями и face_app.get()
+           (landmark + genderage + ArcFace на каждом лице), затем quality gates;
+  after  — только detection + recognition, gates на выходе детектора,
+           ArcFace только для выбранного лица (get_face_embedding_strict).
+
+    python -m tools.pipeline_timings --repeat 20 --json pipeline_timings.json
+
+Веса buffalo_l — в <root>/models/buffalo_l (--root, как у FaceAnalysis).
+Без них insightface скачивает архив с github.com; на узле без сети
+скрипт останавливается сразу, до замеров.
+
+Печатает время загрузки моделей, медиану/p95 на изображение и cosine
+между embedding'ами двух путей (должен быть ≈ 1.0).
+"""
+import argparse
+import glob
+import json
+import os.path as osp
+import sys
+import time
+
+import cv2
+import numpy as np
+from insightface.app import FaceAnalysis
+from insightface.utils import ensure_available
+
+from app.services.face_pipeline import (
+    REQUIRED_MODULES,
+    _blur_score,
+    _clamp_bbox,
+)
+from app.services.utils import decode_image_bytes
+from tools.face_embed import get_face_embedding_strict
+
+
+def add_margin(image, margin_ratio=0.05):
+    """Белые поля вокруг всего кадра — как в старом пути до детектора."""
+    h, w = image.shape[:2]
+    top = bottom = int(h * margin_ratio)
+    left = right = int(w * margin_ratio)
+    return cv2.copyMakeBorder(image, top, bottom, left, right,
+                              borderType=cv2.BORDER_CONSTANT, value=[255, 255, 255])
+
+
+def legacy_embedding(image_bgr, face_app, *, min_det_score=0.60, min_face_size=80, min_blur=60.0):
+    """Старый путь: полный face_app.get() и отбор лучшего лица после recognition."""
+    image_bgr = add_margin(image_bgr)
+    faces = face_app.get(image_bgr)
+    h, w = image_bgr.shape[:2]
+    best, best_score = None, -1.0
+    for face in faces:
+        x1, y1, x2, y2 = _clamp_bbox(face.bbox, w, h)
+        if x2 <= x1 or y2 <= y1:
+            continue
+        blur = _blur_score(image_bgr[y1:y2, x1:x2])
+        det_score = float(face.det_score)
+        if (det_score >= min_det_score and min(x2 - x1, y2 - y1) >= min_face_size
+                and blur >= min_blur and det_score > best_score):
+            best, best_score = face, det_score
+    return None if best is None else best.normed_embedding
+
+
+def _time(fn, repeat):
+    samples = []
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return out, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="face pipeline before/after timings")
+    parser.add_argument("--images", default="images/persons/*.jpg")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--min-face-size", type=int, default=60, help="кропы в images/ небольшие")
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    parser.add_argument("--root", default="~/.insightface", help="каталог моделей insightface")
+    args = parser.parse_args()
+
+    model_dir = osp.join(osp.expanduser(args.root), "models", "buffalo_l")
+    if not glob.glob(osp.join(model_dir, "*.onnx")):
+        try:
+            ensure_available("models", "buffalo_l", root=args.root)
+        except Exception as e:
+            sys.exit(f"нет моделей buffalo_l в {model_dir} и скачать не удалось: {e}")
+
+    gates = {"min_det_score": 0.45, "min_face_size": args.min_face_size, "min_blur": 40.0}
+    files = sorted(glob.glob(args.images))
+    images = [decode_image_bytes(open(f, "rb").read()) for f in files]
+
+    t0 = time.perf_counter()
+    full_app = FaceAnalysis(name="buffalo_l", root=args.root, providers=["CPUExecutionProvider"])
+    full_app.prepare(ctx_id=0)
+    load_before = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    staged_app = FaceAnalysis(
+        name="buffalo_l",
+        root=args.root,
+        allowed_modules=REQUIRED_MODULES,
+        providers=["CPUExecutionProvider"],
+    )
+    staged_app.prepare(ctx_id=0)
+    load_after = time.perf_counter() - t0
+
+    report = {
+        "load_seconds": {"before": round(load_before, 3), "after": round(load_after, 3)},
+        "images": [],
+    }
+    print(f"model load: before={load_before:.2f}s after={load_after:.2f}s")
+    print(f"{'image':<45} {'before p50':>11} {'after p50':>10} {'speedup':>8} {'cos':>7}")
+
+    for path, img in zip(files, images):
+        old, before_ms = _time(lambda: legacy_embedding(img, full_app, **gates), args.repeat)
+        new, after_ms = _time(lambda: get_face_embedding_strict(img, staged_app, **gates), args.repeat)
+
+        cos = None
+        if old is not None and new is not None:
+            cos = float(np.dot(old, np.asarray(new.embedding, dtype=np.float32)))
+
+        row = {
+            "image": path,
+            "before_p50_ms": round(float(np.median(before_ms)), 2),
+            "before_p95_ms": round(float(np.percentile(before_ms, 95)), 2),
+            "after_p50_ms": round(float(np.median(after_ms)), 2),
+            "after_p95_ms": round(float(np.percentile(after_ms, 95)), 2),
+            "cosine_before_after": None if cos is None else round(cos, 5),
+        }
+        report["images"].append(row)
+        speedup = row["before_p50_ms"] / row["after_p50_ms"] if row["after_p50_ms"] else float("nan")
+        print(
+            f"{path:<45} {row['before_p50_ms']:>9.1f}ms {row['after_p50_ms']:>8.1f}ms "
+            f"{speedup:>7.2f}x {('%.4f' % cos) if cos is not None else '—':>7}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# tools/quant_report.py
+"""
+Отчёт по компактному хранению embedding'ов (GALLERY_DTYPE): память галереи
+и сдвиг score'ов float16 / int8 относительно float32 на одной галерее.
+
+    python -m tools.quant_report --source images --json quant_report.json
+    python -m tools.quant_report --source clickhouse
+    python -m tools.quant_report --source synthetic --n 200000
+
+Для каждого формата:
+  bytes / ratio            — память строк галереи (коды + scale);
+  score_delta mean / max   — |приближённый score − float32 score| по top-k кандидатам;
+  recall@k                 — доля точного top-k, найденная приближённым поиском;
+  match_recall             — то же только по совпадениям со score >= threshold;
+  rescored_match_recall    — после отбора k · factor кандидатов и точного
+                             float32-пересчёта (как в GalleryIndex) — должно быть 1.0;
+  p50_ms                   — полный скан галереи одним запросом.
+
+--source images — «наши образцы»: галерея из images/persons/*.jpg, запросы —
+зеркальные копии тех же фото (+ search_photo.txt, если есть). Нужны модели.
+"""
+import argparse
+import glob
+import json
+import time
+
+import cv2
+import numpy as np
+
+from app.core.config import QUANT_RESCORE_FACTOR
+from app.services.ann_index import exact_search
+from app.services.gallery_index import normalize_rows
+from app.services.quantization import quantize
+from tools.synthetic import make_gallery, make_queries
+
+
+def load_images(args):
+    from app.services.face_models import load_face_models
+    from app.services.utils import b64_to_bytes, decode_image_bytes
+    from tools.face_embed import get_face_embeddings_batch
+
+    gates = {"min_det_score": 0.45, "min_face_size": 40, "min_blur": 0.0}
+    files = sorted(glob.glob(args.images))
+    images = [decode_image_bytes(open(f, "rb").read()) for f in files]
+    models = load_face_models()
+
+    gallery = [r.embedding for r in get_face_embeddings_batch(images, models, **gates) if r is not None]
+    probes = [cv2.flip(img, 1) for img in images]
+    try:
+        probes.append(decode_image_bytes(b64_to_bytes(open(args.search_photo).read().strip())))
+    except (OSError, ValueError):
+        pass
+    queries = [r.embedding for r in get_face_embeddings_batch(probes, models, **gates) if r is not None]
+
+    emb, _ = normalize_rows(np.asarray(gallery, dtype=np.float32))
+    q, _ = normalize_rows(np.asarray(queries, dtype=np.float32))
+    return emb, q
+
+
+def load(args):
+    if args.source == "images":
+        return load_images(args)
+    if args.source == "synthetic":
+        emb, _ = make_gallery(args.n, seed=args.seed)
+    elif args.source == "npy":
+        emb, _ = normalize_rows(np.load(args.npy, mmap_mode="r"))
+    elif args.source == "clickhouse":
+        from app.repositories.faceid_repo import FaceIdRepo
+        emb, _ = normalize_rows(FaceIdRepo().get_face_embedding_matrix()["embedding"])
+    else:
+        raise ValueError(args.source)
+    return emb, make_queries(emb, args.queries, seed=args.seed + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="float16 / int8 gallery: memory and score drift")
+    parser.add_argument("--source", choices=["images", "synthetic", "npy", "clickhouse"], default="images")
+    parser.add_argument("--images", default="images/persons/*.jpg")
+    parser.add_argument("--search-photo", default="search_photo.txt")
+    parser.add_argument("--npy", help="путь к (N, 512) float32 .npy для --source npy")
+    parser.add_argument("--n", type=int, default=100000, help="размер синтетической галереи")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--factor", type=int, default=QUANT_RESCORE_FACTOR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    gallery, queries = load(args)
+    n, k = gallery.shape[0], min(args.k, gallery.shape[0])
+    print(f"gallery: {n} x {gallery.shape[1]}, queries: {queries.shape[0]}, k={k}")
+
+    truth, matches = [], []
+    for q in queries:
+        idx, scores = exact_search(gallery, q, k)
+        truth.append(set(idx.tolist()))
+        matches.append(set(idx[scores >= args.threshold].tolist()))
+    n_matches = sum(len(m) for m in matches)
+
+    report = {"source": args.source, "gallery_size": int(n), "k": k, "threshold": args.threshold, "formats": []}
+    print(f"{'dtype':<8} {'MB':>8} {'ratio':>6} {'Δmean':>9} {'Δmax':>9} {'recall':>7} {'match':>7} {'rescored':>8} {'p50':>8}")
+
+    for dtype in ("float32", "float16", "int8"):
+        rows = quantize(gallery, dtype)
+        deltas, hits, match_hits, rescored_hits, ms = [], 0, 0, 0, []
+
+        for q, t, m in zip(queries, truth, matches):
+            t0 = time.perf_counter()
+            idx, approx = exact_search(rows, q, k)
+            ms.append((time.perf_counter() - t0) * 1000)
+            deltas.append(np.abs(approx - gallery[idx] @ q))
+            found = set(idx.tolist())
+            hits += len(t & found)
+            match_hits += len(m & found)
+
+            # k · factor кандидатов по приближённому score → точный float32 пересчёт
+            cand, _ = exact_search(rows, q, k * args.factor)
+            exact = gallery[cand] @ q
+            rescored = cand[np.argsort(-exact)[:k]]
+            rescored_hits += len(m & set(rescored.tolist()))
+
+        d = np.concatenate(deltas) if deltas else np.zeros(1)
+        row = {
+            "dtype": dtype,
+            "bytes": int(rows.nbytes),
+            "ratio": round(gallery.nbytes / rows.nbytes, 2),
+            "score_delta_mean": float(d.mean()),
+            "score_delta_max": float(d.max()),
+            f"recall@{k}": round(hits / (k * len(truth)), 4) if truth else None,
+            "match_recall": round(match_hits / n_matches, 4) if n_matches else None,
+            "rescored_match_recall": round(rescored_hits / n_matches, 4) if n_matches else None,
+            "p50_ms": round(float(np.percentile(ms, 50)), 3) if ms else None,
+        }
+        report["formats"].append(row)
+        print(
+            f"{dtype:<8} {row['bytes'] / 1e6:8.2f} {row['ratio']:6.2f} "
+            f"{row['score_delta_mean']:9.2e} {row['score_delta_max']:9.2e} "
+            f"{row[f'recall@{k}']!s:>7} {row['match_recall']!s:>7} {row['rescored_match_recall']!s:>8} "
+            f"{row['p50_ms']!s:>7}ms"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report → {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# tools/run_shards.py
+"""
+Несколько процессов-шардов галереи на одной машине (SEARCH_MODE=sharded).
+
+  из ClickHouse — по процессу python -m app.services.shard_server на шард,
+                  каждый грузит свою долю face_snapshots;
+  --synthetic N — без БД: синтетическая галерея из N строк (tools/synthetic.py),
+                  разложенная по шардам crc32(person_id) % shards.
+
+    python -m tools.run_shards --shards 4 --port 7100
+    python -m tools.run_shards --shards 4 --synthetic 200000 --check 200
+    python -m tools.run_shards --shards 4 --synthetic 200000 --check 200 --kill 3
+
+Печатает строку SEARCH_SHARDS=... для приложения и держит шарды до Ctrl-C.
+Без SHARD_AUTHKEY в окружении ключ шардов генерируется и печатается вместе с ней.
+--check Q — Q запросов через ShardedGallery против одного GalleryIndex на всю
+галерею (только --synthetic): совпадение top-k и латентность scatter-gather.
+--kill I — перед проверкой останавливает шард I: ответы должны прийти partial.
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import secrets
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_shards import ShardedGallery
+from app.services.gallery_templates import PersonTemplates
+from tools.synthetic import make_gallery, make_queries
+
+
+def synthetic_ids(person_idx: np.ndarray) -> list:
+    return [f"synthetic-{p}" for p in person_idx]
+
+
+def synthetic_shard(pid: str, shards: int) -> int:
+    return zlib.crc32(pid.encode()) % shards
+
+
+def serve_synthetic(shard: int, shards: int, rows: int, host: str, port: int, authkey: str, ready) -> None:
+    from app.services.shard_server import ShardServer
+
+    emb, person_idx = make_gallery(rows)
+    ids = synthetic_ids(person_idx)
+    mine = [i for i, pid in enumerate(ids) if synthetic_shard(pid, shards) == shard]
+    index = GalleryIndex(dtype="float32", templates=PersonTemplates("all"))
+    index.replace([ids[i] for i in mine], emb[mine])
+    server = ShardServer(index, (host, port), shard=(shard, shards), authkey=authkey)
+    ready.set()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def start_synthetic(args):
+    ctx = mp.get_context("spawn")
+    procs, events = [], []
+    for i in range(args.shards):
+        ready = ctx.Event()
+        p = ctx.Process(
+            target=serve_synthetic,
+            args=(i, args.shards, args.synthetic, args.host, args.port + i, args.authkey, ready),
+            daemon=True,
+        )
+        p.start()
+        procs.append(p)
+        events.append(ready)
+    for ready in events:
+        ready.wait()
+    return procs
+
+
+def start_clickhouse(args):
+    return [
+        subprocess.Popen([
+            sys.executable, "-m", "app.services.shard_server",
+            "--shard", str(i), "--shards", str(args.shards),
+            "--host", args.host, "--port", str(args.port + i),
+        ])
+        for i in range(args.shards)
+    ]
+
+
+def stop(procs) -> None:
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        if isinstance(p, subprocess.Popen):
+            p.wait()
+        else:
+            p.join()
+
+
+async def check(args, addresses, procs) -> None:
+    emb, person_idx = make_gallery(args.synthetic)
+    full = GalleryIndex(dtype="float32", templates=PersonTemplates("all"))
+    full.replace(synthetic_ids(person_idx), emb)
+    queries = make_queries(emb, args.check, seed=1)
+
+    if args.kill is not None:
+        procs[args.kill].terminate()
+        procs[args.kill].join()
+        print(f"shard {args.kill} остановлен")
+
+    gallery = ShardedGallery(addresses, authkey=args.authkey)
+    ms, agree, partial = [], [], 0
+    try:
+        for q in queries:
+            t0 = time.perf_counter()
+            hits, status = await gallery.search(q, args.k, args.threshold)
+            ms.append((time.perf_counter() - t0) * 1000)
+            partial += status["partial"]
+
+            expected = full.search(q, args.k, args.threshold)
+            if args.kill is not None:
+                expected = [h for h in expected if synthetic_shard(h[0], args.shards) != args.kill][:args.k]
+            agree.append([h[0] for h in hits] == [h[0] for h in expected])
+
+        t0 = time.perf_counter()
+        batch, _ = await gallery.search_many(queries, args.k, args.threshold)
+        batch_ms = (time.perf_counter() - t0) * 1000
+        agree.append(all(
+            [h[0] for h in b] == [h[0] for h in full_hits]
+            for b, full_hits in zip(batch, full.search_many(queries, args.k, args.threshold))
+        ) or args.kill is not None)
+
+        print(
+            f"queries={len(queries)}  p50={np.percentile(ms, 50):.2f} ms  p95={np.percentile(ms, 95):.2f} ms  "
+            f"batch={batch_ms:.1f} ms  partial={partial}  top-{args.k} совпадает: {np.mean(agree):.3f}"
+        )
+        print(gallery.stats())
+    finally:
+        gallery.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local gallery shard processes")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7100, help="шард i слушает port + i")
+    parser.add_argument("--synthetic", type=int, default=0, help="синтетическая галерея из N строк вместо ClickHouse")
+    parser.add_argument("--check", type=int, default=0, help="прогнать Q запросов и сравнить с одним индексом")
+    parser.add_argument("--kill", type=int, help="остановить шард перед --check")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    args = parser.parse_args()
+    if args.check and not args.synthetic:
+        parser.error("--check — только с --synthetic")
+
+    # процессы-шарды из ClickHouse читают ключ из окружения
+    generated = not os.environ.get("SHARD_AUTHKEY")
+    args.authkey = os.environ.setdefault("SHARD_AUTHKEY", secrets.token_hex(16))
+
+    procs = start_synthetic(args) if args.synthetic else start_clickhouse(args)
+    addresses = [(args.host, args.port + i) for i in range(args.shards)]
+    print(
+        "SEARCH_MODE=sharded SEARCH_SHARDS=" + ",".join(f"{h}:{p}" for h, p in addresses)
+        + (f" SHARD_AUTHKEY={args.authkey}" if generated else "")
+    )
+
+    try:
+        if args.check:
+            asyncio.run(check(args, addresses, procs))
+            return
+        while all(p.is_alive() if isinstance(p, mp.process.BaseProcess) else p.poll() is None for p in procs):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop(procs)
+
+
+if __name__ == "__main__":
+    main()
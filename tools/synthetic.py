@@ -0,0 +1,59 @@
+# tools/synthetic.py
+"""
+Синтетическая галерея для офлайн-замеров: кластеры «личностей» на единичной сфере.
+Реальные ArcFace-эмбеддинги одного человека лежат кучно, поэтому равномерный шум
+был бы слишком пессимистичен для ANN и слишком оптимистичен для точного поиска.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from app.services.face_pipeline import EMB_SIZE
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def make_gallery(
+    n: int,
+    *,
+    per_person: int = 3,
+    noise: float = 0.6,
+    dim: int = EMB_SIZE,
+    seed: int = 0,
+    chunk: int = 262144,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (embeddings (n, dim) float32 unit-norm, person_idx (n,) int64).
+    Генерируется кусками — без промежуточных float64-матриц размера n.
+    """
+    rng = np.random.default_rng(seed)
+    n_persons = max(1, n // per_person)
+    centers = _unit(rng.standard_normal((n_persons, dim), dtype=np.float32))
+
+    out = np.empty((n, dim), dtype=np.float32)
+    person_idx = rng.integers(0, n_persons, size=n)
+    for lo in range(0, n, chunk):
+        hi = min(n, lo + chunk)
+        jitter = rng.standard_normal((hi - lo, dim), dtype=np.float32) * (noise / np.sqrt(dim))
+        out[lo:hi] = _unit(centers[person_idx[lo:hi]] + jitter)
+
+    return out, person_idx
+
+
+def make_queries(
+    gallery: np.ndarray,
+    n_queries: int,
+    *,
+    noise: float = 0.6,
+    seed: int = 1,
+) -> np.ndarray:
+    """
+    Запросы — «новые фото» зарегистрированных людей: зашумлённые строки галереи.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, gallery.shape[0], size=n_queries)
+    jitter = rng.standard_normal((n_queries, gallery.shape[1]), dtype=np.float32)
+    jitter *= noise / np.sqrt(gallery.shape[1])
+    return _unit(gallery[rows] + jitter)